@@ -1,14 +1,21 @@
 from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
 from fastapi import FastAPI
 from bmsdna.lakeapi.core.config import BasicConfig, Configs, get_default_config
 from bmsdna.lakeapi.core.route import init_routes
 import os
 
+if TYPE_CHECKING:
+    from bmsdna.lakeapi.api.flight import LakeApiFlightServer
+    from bmsdna.lakeapi.core.reload import ConfigReloader
+
 
 @dataclass(frozen=True)
 class LakeApiStartInfo:
     start_config: BasicConfig
     config: Configs
+    reloader: "Optional[ConfigReloader]" = None
+    flight_server: "Optional[LakeApiFlightServer]" = None
 
 
 def init_lakeapi(
@@ -19,19 +26,40 @@ def init_lakeapi(
 ) -> LakeApiStartInfo:
     start_config = start_config or get_default_config()
     real_config: Configs
+    config_path: Optional[str] = None
     if config is None:
-        real_config = Configs.from_yamls(
-            start_config, os.getenv("CONFIG_PATH", "config.yml")
-        )
+        config_path = os.getenv("CONFIG_PATH", "config.yml")
+        real_config = Configs.from_yamls(start_config, config_path)
     elif isinstance(config, str):
+        config_path = config
         real_config = Configs.from_yamls(start_config, config)
     else:
         real_config = config
-    router = init_routes(real_config, start_config)
+    router = init_routes(real_config, start_config, app)
+    reloader = None
+    if config_path is not None and start_config.config_reload_interval:
+        from bmsdna.lakeapi.core.reload import ConfigReloader
+
+        reloader = ConfigReloader(
+            router.lake_api_routes,  # type: ignore
+            start_config,
+            config_path,
+        )
+        reloader.start(start_config.config_reload_interval)
     if use_basic_auth:
         from bmsdna.lakeapi.core.uservalidation import add_user_middlware
 
         add_user_middlware(app, start_config, real_config.users)
+    flight_server = None
+    if start_config.flight_location:
+        from bmsdna.lakeapi.api.flight import start_flight_server
+
+        flight_server = start_flight_server(
+            start_config.flight_location,
+            real_config,
+            start_config,
+            real_config.users if use_basic_auth else None,
+        )
 
     app.include_router(router)
-    return LakeApiStartInfo(start_config, real_config)
+    return LakeApiStartInfo(start_config, real_config, reloader, flight_server)
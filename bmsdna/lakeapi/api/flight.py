@@ -0,0 +1,354 @@
+import base64
+import json
+import os
+import secrets
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Optional, Sequence, cast
+
+import anyio
+import pyarrow.flight as flight
+
+from bmsdna.lakeapi.context import get_context_by_engine
+from bmsdna.lakeapi.core.config import BasicConfig, Config, Configs, UserConfig
+from bmsdna.lakeapi.core.log import get_logger
+from bmsdna.lakeapi.utils.async_utils import _async
+
+if TYPE_CHECKING:
+    from deltalake2db import FilterType
+    from bmsdna.lakeapi.context.df_base import ExecutionContext
+    from bmsdna.lakeapi.core.datasource import Datasource
+
+logger = get_logger(__name__)
+
+FLIGHT_MAX_ENDPOINTS = int(
+    os.getenv("FLIGHT_MAX_ENDPOINTS", "64")
+)  # partitions of a GetFlightInfo, more are returned as one endpoint
+FLIGHT_TOKEN_TTL = int(os.getenv("FLIGHT_TOKEN_TTL", "3600"))  # seconds
+
+
+@dataclass
+class FlightRequest:
+    """The command of a flight descriptor and the content of a ticket, as json.
+    Same as the query parameters of the http route, partition selects one partition of a delta table"""
+
+    route: str
+    params: dict[str, Any] = field(default_factory=dict)
+    limit: Optional[int] = None  # all rows if the route allows it, otherwise 1000
+    offset: int = 0
+    select: Optional[str] = None
+    distinct: bool = False
+    engine: Optional[str] = None
+    partition: Optional[dict[str, str]] = None  # partition value as of the delta log
+
+    @classmethod
+    def from_json(cls, data: bytes):
+        try:
+            return cls(**json.loads(data))
+        except (TypeError, ValueError) as err:
+            raise ValueError(f"Invalid flight request: {err}")
+
+    def to_json(self) -> bytes:
+        return json.dumps(
+            {k: v for k, v in asdict(self).items() if v is not None}
+        ).encode("utf-8")
+
+
+def _partition_value(value: str, type: str) -> Any:
+    """A partition value of the delta log, which is always a string, as python value of the column type"""
+    if type in ["byte", "short", "integer", "int", "long"]:
+        return int(value)
+    if type in ["float", "double"]:
+        return float(value)
+    if type == "boolean":
+        return value.lower() == "true"
+    if type == "date":
+        return date.fromisoformat(value)
+    if type in ["timestamp", "timestamp_ntz"]:
+        return datetime.fromisoformat(value)
+    if type.startswith("decimal"):
+        return Decimal(value)
+    return value
+
+
+class _BasicAuthMiddleware(flight.ServerMiddleware):
+    def __init__(self, token: Optional[str]):
+        self.token = token
+
+    def sending_headers(self) -> dict[str, list[str] | list[bytes]]:
+        if self.token is not None:
+            return {"authorization": ["Bearer " + self.token]}
+        return {}
+
+
+class _HandshakeHandler(flight.ServerAuthHandler):
+    """Accepts the handshake of authenticate_basic_token, the middleware does the authentication"""
+
+    def authenticate(self, outgoing, incoming):
+        pass
+
+    def is_valid(self, token: str) -> bool:
+        # flight expects the peer identity here, the stubs declare a bool
+        return cast(bool, "")
+
+
+class _BasicAuthMiddlewareFactory(flight.ServerMiddlewareFactory):
+    """Basic auth with the users of the config. A successful login gets a bearer token, like
+    authenticate_basic_token of the flight client expects"""
+
+    def __init__(self, users: Sequence[UserConfig]):
+        self.users = users
+        self._tokens: dict[str, float] = {}  # expiry by token
+        self._lock = threading.Lock()
+
+    def start_call(self, info, headers):
+        from bmsdna.lakeapi.core.uservalidation import (
+            get_password_hash,
+            verify_credentials_sync,
+        )
+
+        auth = next(iter(headers.get("authorization", [])), "")
+        if isinstance(auth, bytes):
+            auth = auth.decode("latin-1")
+        scheme, _, value = auth.partition(" ")
+        if scheme.lower() == "bearer":
+            with self._lock:
+                expiry = self._tokens.get(value)
+            if expiry is not None and expiry > time.monotonic():
+                return _BasicAuthMiddleware(None)
+            raise flight.FlightUnauthenticatedError("Token expired")
+        if scheme.lower() != "basic":
+            raise flight.FlightUnauthenticatedError("Not authenticated")
+        try:
+            username, _, pwd = base64.b64decode(value).decode("utf-8").partition(":")
+        except ValueError:
+            raise flight.FlightUnauthenticatedError("Not authenticated")
+        hash = get_password_hash(username, self.users)
+        if (
+            hash is None
+            or verify_credentials_sync(username.casefold(), pwd, hash) != "ok"
+        ):
+            raise flight.FlightUnauthenticatedError("Incorrect email or password")
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = {t: e for t, e in self._tokens.items() if e > now}
+            self._tokens[token] = now + FLIGHT_TOKEN_TTL
+        return _BasicAuthMiddleware(token)
+
+
+class LakeApiFlightServer(flight.FlightServerBase):
+    """Arrow Flight server for the routes of configs. The record batches are sent as they are read,
+    without the temp file of the http endpoints. GetFlightInfo returns an endpoint per partition of
+    delta tables, if all rows are requested. users enables basic auth"""
+
+    def __init__(
+        self,
+        location: str,
+        configs: Configs,
+        basic_config: BasicConfig,
+        users: Optional[Sequence[UserConfig]] = None,
+        **kwargs,
+    ):
+        if users is not None:
+            kwargs["auth_handler"] = _HandshakeHandler()
+            kwargs["middleware"] = {"auth": _BasicAuthMiddlewareFactory(users)}
+        super().__init__(location, **kwargs)
+        self.configs = configs
+        self.basic_config = basic_config
+
+    def _get_config(self, route: str) -> Config:
+        config = self.configs.get_config_by_route(route)
+        if config is None or config.datasource is None:
+            raise KeyError(f"Unknown route {route}")
+        return config
+
+    def _get_limit(self, config: Config, request: FlightRequest) -> int:
+        limit = (
+            request.limit
+            if request.limit is not None
+            else (-1 if config.allow_get_all_pages else 1000)
+        )
+        if not (limit == -1 and config.allow_get_all_pages):
+            limit = (1000 if limit == -1 else limit) or 1000
+        return limit
+
+    def _open(
+        self, request: FlightRequest
+    ) -> "tuple[ExecutionContext, Datasource, Any]":
+        """The context, the datasource and the query of the request. The caller has to close them"""
+        from bmsdna.lakeapi.core.datasource import Datasource
+        from bmsdna.lakeapi.core.model import create_parameter_model
+        from bmsdna.lakeapi.endpoint.endpoint import build_query, resolve_engine
+
+        config = self._get_config(request.route)
+        assert config.datasource is not None
+        context = get_context_by_engine(
+            resolve_engine(config, self.basic_config, request.engine),  # type: ignore
+            chunk_size=config.chunk_size or self.basic_config.default_chunk_size,
+        )
+        datasource = Datasource(
+            config.version_str,
+            config.tag,
+            config.name,
+            config=config.datasource,
+            sql_context=context,
+            basic_config=self.basic_config,
+            accounts=self.configs.accounts,
+            duckdb_backend=config.duckdb_backend,
+        )
+        try:
+            params = None
+            if request.params:
+                param_model = create_parameter_model(
+                    datasource.get_schema(),
+                    config.tag + "_" + config.name + "_post",
+                    config.params,
+                    config.search,
+                    config.nearby,
+                    "post",
+                )
+                params = param_model.model_validate(request.params)
+            query = build_query(
+                context,
+                datasource,
+                config,
+                self.basic_config,
+                params,
+                limit=self._get_limit(config, request),
+                offset=request.offset,
+                select=request.select,
+                distinct=request.distinct,
+                jsonify_complex=False,
+                format="arrow",
+                has_complex=False,
+                filters=self._get_partition_filter(datasource, request.partition),
+            )
+        except BaseException:
+            datasource.__exit__(None, None, None)
+            context.close()
+            raise
+        return context, datasource, query
+
+    def _get_partition_filter(
+        self, datasource: "Datasource", partition: Optional[dict[str, str]]
+    ) -> "Optional[FilterType]":
+        if not partition:
+            return None
+        meta = datasource.get_delta_table(True)
+        if meta is None or meta.schema is None:
+            raise ValueError("partition is only supported for delta tables")
+        types = {f["name"]: f["type"] for f in meta.schema["fields"]}
+        return [
+            (col, "=", _partition_value(value, types.get(col, "string")))
+            for col, value in partition.items()
+        ]
+
+    def _get_partitions(
+        self, config: Config, datasource: "Datasource", request: FlightRequest
+    ) -> Optional[list[dict[str, str]]]:
+        """Values of the first partition column, if the request can be split by them"""
+        from bmsdna.lakeapi.endpoint.endpoint import remove_search_nearby
+
+        assert config.datasource is not None
+        if (
+            config.datasource.file_type != "delta"
+            or request.partition
+            or self._get_limit(config, request) != -1
+            or request.offset
+            or request.distinct
+            or config.datasource.sortby
+            or remove_search_nearby(request.params, config) != request.params
+        ):
+            return None
+        meta = datasource.get_delta_table(True)
+        if meta is None or not meta.last_metadata:
+            return None
+        partition_columns = meta.last_metadata.get("partitionColumns") or []
+        if not partition_columns:
+            return None
+        col = partition_columns[0]
+        values = {ac["partitionValues"].get(col) for ac in meta.add_actions.values()}
+        if None in values or not 1 < len(values) <= FLIGHT_MAX_ENDPOINTS:
+            return None
+        return [{col: v} for v in sorted(values)]
+
+    def _get_flight_info(self, descriptor: flight.FlightDescriptor):
+        if descriptor.descriptor_type != flight.DescriptorType.CMD:
+            raise ValueError("Only command descriptors are supported")
+        if descriptor.command is None:
+            raise ValueError("The descriptor has no command")
+        request = FlightRequest.from_json(descriptor.command)
+        context, datasource, query = self._open(request)
+        try:
+            with context.execute_sql(query) as result:
+                schema = result.arrow_schema()
+            config = self._get_config(request.route)
+            partitions = self._get_partitions(config, datasource, request)
+        finally:
+            datasource.__exit__(None, None, None)
+            context.close()
+        tickets = (
+            [FlightRequest(**{**asdict(request), "partition": p}) for p in partitions]
+            if partitions
+            else [request]
+        )
+        return flight.FlightInfo(
+            schema,
+            descriptor,
+            [flight.FlightEndpoint(t.to_json(), []) for t in tickets],
+            -1,
+            -1,
+        )
+
+    def get_flight_info(self, context, descriptor):
+        return self._get_flight_info(descriptor)
+
+    def list_flights(self, context, criteria):
+        for config in self.configs:
+            descriptor = flight.FlightDescriptor.for_command(
+                FlightRequest(config.route).to_json()
+            )
+            try:
+                yield self._get_flight_info(descriptor)
+            except Exception as err:
+                logger.warning(f"Could not get flight info of {config.route}: {err}")
+
+    def do_get(self, context, ticket):
+        request = FlightRequest.from_json(ticket.ticket)
+        sql_context, datasource, query = self._open(request)
+        try:
+            result = sql_context.execute_sql(query)
+            reader = anyio.run(
+                lambda: _async(result.to_arrow_recordbatch(result.chunk_size))
+            )
+        except BaseException:
+            datasource.__exit__(None, None, None)
+            sql_context.close()
+            raise
+
+        def _batches():
+            try:
+                yield from reader
+            finally:
+                result.__exit__(None, None, None)
+                datasource.__exit__(None, None, None)
+                sql_context.close()
+
+        return flight.GeneratorStream(reader.schema, _batches())
+
+
+def start_flight_server(
+    location: str,
+    configs: Configs,
+    basic_config: BasicConfig,
+    users: Optional[Sequence[UserConfig]] = None,
+) -> LakeApiFlightServer:
+    """Starts the flight server in a daemon thread"""
+    server = LakeApiFlightServer(location, configs, basic_config, users)
+    threading.Thread(target=server.serve, daemon=True, name="lakeapi-flight").start()
+    logger.info(f"Arrow Flight server listening on port {server.port}")
+    return server
@@ -1,5 +1,6 @@
 from abc import abstractmethod, ABC
 from datetime import datetime
+import threading
 
 from sqlglot import Dialect
 from bmsdna.lakeapi.core.types import FileTypes, OperatorType
@@ -156,7 +157,13 @@ class ResultData(ABC):
     @abstractmethod
     async def to_pandas(self) -> "pd.DataFrame": ...
 
-    async def write_parquet(self, file_name: str):
+    async def write_parquet(
+        self,
+        file_name: str,
+        *,
+        compression: str = "snappy",
+        compression_level: Optional[int] = None,
+    ):
         import pyarrow.parquet as paparquet
 
         batches = await self.to_arrow_recordbatch(self.chunk_size)
@@ -164,6 +171,8 @@ class ResultData(ABC):
         with paparquet.ParquetWriter(
             file_name,
             batches.schema,
+            compression=compression,
+            compression_level=compression_level,
         ) as writer:
             for batch in batches:
                 writer.write_batch(batch)
@@ -187,6 +196,10 @@ class FileTypeNotSupportedError(Exception):
         super().__init__(message)
 
 
+class QueryCancelledError(Exception):
+    pass
+
+
 class ExecutionContext(ABC):
     def __init__(self, chunk_size: int, engine_name: str) -> None:
         super().__init__()
@@ -194,6 +207,8 @@ class ExecutionContext(ABC):
         self.chunk_size = chunk_size
         self.len_func = "LEN"
         self.engine_name = engine_name
+        self.supports_alias_in_where = True
+        self.cancel_event = threading.Event()
 
         self.array_contains_func = "array_contains"
 
@@ -297,6 +312,17 @@ class ExecutionContext(ABC):
     @abstractmethod
     def close(self): ...
 
+    def interrupt(self):
+        """Cancels the queries currently running on this context. Can be called from any thread"""
+        self.cancel_event.set()
+
+    def estimate_cardinality(self, sql: str) -> Optional[Tuple[int, int]]:
+        """Estimated rows of the result and of the largest operator in the plan, if the engine can tell"""
+        return None
+
+    def set_threads(self, threads: int):
+        pass
+
     def init_search(
         self,
         source_view: str,
@@ -1,3 +1,4 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 
 from fastapi.concurrency import run_in_threadpool
@@ -15,16 +16,16 @@ import pyarrow.dataset
 import sqlglot.expressions as ex
 import sqlglot as sg
 import os
+import shutil
 from datetime import timezone
 from bmsdna.lakeapi.core.config import SearchConfig
 from uuid import uuid4
 
 from bmsdna.lakeapi.core.log import get_logger
-import multiprocessing
+import threading
 
 from bmsdna.lakeapi.utils.meta_cache import get_deltalake_meta
 from .source_uri import SourceUri
-import csv
 
 
 logger = get_logger(__name__)
@@ -33,6 +34,8 @@ ENABLE_COPY_TO = os.environ.get("ENABLE_COPY_TO", "0") == "1"
 USE_DELTA_EXT = os.getenv("DUCKDB_DELTA_USE_EXT", "0") == "1"
 USE_FSSPEC = os.getenv("DUCKDB_DELTA_USE_FSSPEC", "0") == "1"
 
+SEARCH_INDEX_BUILD_WORKERS = int(os.getenv("SEARCH_INDEX_BUILD_WORKERS", "1"))
+
 DUCK_CONFIG = {}
 DUCK_INIT_SCRIPTS: list[str] = []
 AZURE_LOADED_SCRIPTS: list[str] = []
@@ -115,15 +118,30 @@ class DuckDBResultData(ResultData):
 
         return await run_in_threadpool(_to_df)
 
-    async def write_parquet(self, file_name: str):
-        if not ENABLE_COPY_TO:
-            return await super().write_parquet(file_name)
+    async def write_parquet(
+        self,
+        file_name: str,
+        *,
+        compression: str = "snappy",
+        compression_level: Optional[int] = None,
+    ):
+        if not ENABLE_COPY_TO or (
+            compression_level is not None and compression != "zstd"
+        ):  # duckdb supports a level for zstd only
+            return await super().write_parquet(
+                file_name, compression=compression, compression_level=compression_level
+            )
+        options = "COMPRESSION " + (
+            "uncompressed" if compression == "none" else compression
+        )
+        if compression_level is not None:
+            options += f", COMPRESSION_LEVEL {compression_level}"
         query = get_sql(self.original_sql, dialect="duckdb")
         uuidstr = _get_temp_table_name()
         # temp table required because of https://github.com/duckdb/duckdb/issues/7616
         full_query = f"""CREATE TEMP VIEW {uuidstr} AS {query};
                          COPY (SELECT *FROM {uuidstr})
-                         TO '{file_name}' (FORMAT PARQUET,use_tmp_file False, ROW_GROUP_SIZE 10000);
+                         TO '{file_name}' (FORMAT PARQUET,use_tmp_file False, ROW_GROUP_SIZE 10000, {options});
                          DROP VIEW {uuidstr}"""
 
         await run_in_threadpool(self.con.execute, full_query)
@@ -164,6 +182,8 @@ class DuckDBResultData(ResultData):
             assert self.con.description is not None
             col_names = [d[0] for d in self.con.description]
             with open(file_name, "w", newline="", encoding="utf-8") as csvfile:
+                import csv
+
                 writer = csv.DictWriter(
                     csvfile, fieldnames=col_names, delimiter=separator
                 )
@@ -231,6 +251,202 @@ def match_25(
     return fn
 
 
+_search_index_executor: Optional[ThreadPoolExecutor] = None
+_search_index_builds: dict[str, Future] = {}
+_search_index_lock = threading.Lock()
+
+
+def get_search_index_path(persistence_name: str):
+    return os.path.join(os.getenv("TEMP", "/tmp/"), persistence_name + ".duckdb")
+
+
+def _search_index_is_current(persistance_file_name: str, modified_date: datetime):
+    # the mtime of the index file is set to the modified date of the data it was built from
+    return os.path.exists(persistance_file_name) and datetime.fromtimestamp(
+        os.path.getmtime(persistance_file_name), tz=timezone.utc
+    ) >= modified_date.astimezone(timezone.utc)
+
+
+def _load_search_table(
+    search_con: duckdb.DuckDBPyConnection,
+    persistence_name: str,
+    source_table_name: Optional[str],
+    uri: SourceUri,
+    file_type: FileTypes,
+):
+    ctx = DuckDbExecutionContextBase(search_con, chunk_size=10000)
+    ctx.register_datasource(
+        "__search_source", source_table_name, uri, file_type, filters=None
+    )
+    ctx.con.execute(f"DROP TABLE IF EXISTS {persistence_name}")
+    ctx.con.execute(
+        f"CREATE TABLE {persistence_name} AS SELECT ROW_NUMBER() OVER () AS __search_id, * FROM __search_source s"
+    )
+    ctx.con.execute("DROP VIEW __search_source")
+    ctx.close()
+
+
+def _search_file_key(add_action: dict) -> str:
+    # a path that is added again, eg. after a restore, gets another modification time
+    return f"{add_action['path']}@{add_action.get('modificationTime')}"
+
+
+def _update_search_table_delta(
+    search_con: duckdb.DuckDBPyConnection,
+    persistence_name: str,
+    uri: SourceUri,
+) -> bool:
+    """Applies the add and remove actions since the last build to the documents of the search index.
+    Every row knows the file it comes from (__search_file), ids of existing documents never change.
+    Returns False if the table has deletion vectors, which need a full rebuild"""
+    from deltalake2db.duckdb import get_sql_for_delta
+
+    meta = get_deltalake_meta(False, uri)
+    if any(ac.get("deletionVector") for ac in meta.add_actions.values()):
+        return False
+    actions = {_search_file_key(ac): ac for ac in meta.add_actions.values()}
+    current = set(actions.keys())
+    has_table = search_con.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name=? AND column_name='__search_file'",
+        [persistence_name],
+    ).fetchone()
+    if has_table:
+        indexed = {
+            r[0]
+            for r in search_con.execute(
+                f"SELECT DISTINCT __search_file FROM {persistence_name}"
+            ).fetchall()
+        }
+    else:
+        search_con.execute(f"DROP TABLE IF EXISTS {persistence_name}")
+        indexed = set()
+    removed = indexed - current
+    added = sorted(current - indexed)
+    logger.info(
+        f"Search index for {persistence_name}: {len(added)} files added, {len(removed)} files removed"
+    )
+    if removed:
+        search_con.execute(
+            f"DELETE FROM {persistence_name} WHERE __search_file IN (SELECT unnest(?))",
+            [list(removed)],
+        )
+    remote_uri, remote_opts = uri.get_uri_options(flavor="original")
+    duckdb_apply_storage_options(
+        search_con, remote_uri, remote_opts, use_fsspec=USE_FSSPEC
+    )
+    for key in added:
+        path = actions[key]["path"]
+        file_sql = get_sql_for_delta(
+            meta,
+            action_filter=lambda ac: ac["path"] == path,
+            duck_con=search_con,
+            use_fsspec=USE_FSSPEC,
+        )
+        if not has_table:
+            search_con.execute(
+                f"""CREATE TABLE {persistence_name} AS SELECT ROW_NUMBER() OVER () AS __search_id,
+                    ? AS __search_file, * FROM ({file_sql}) s""",
+                [key],
+            )
+            has_table = True
+            continue
+        search_con.execute(
+            f"""INSERT INTO {persistence_name} BY NAME
+                SELECT (SELECT COALESCE(MAX(__search_id), 0) FROM {persistence_name}) + ROW_NUMBER() OVER () AS __search_id,
+                    ? AS __search_file, * FROM ({file_sql}) s""",
+            [key],
+        )
+    if not has_table:  # empty delta table
+        file_sql = get_sql_for_delta(meta, duck_con=search_con, use_fsspec=USE_FSSPEC)
+        search_con.execute(
+            f"""CREATE TABLE {persistence_name} AS SELECT CAST(NULL AS BIGINT) AS __search_id,
+                CAST(NULL AS VARCHAR) AS __search_file, * FROM ({file_sql}) s LIMIT 0"""
+        )
+    return True
+
+
+def _build_search_index(
+    persistence_name: str,
+    source_table_name: Optional[str],
+    uri: SourceUri,
+    file_type: FileTypes,
+    search_columns: list[str],
+    modified_date: datetime,
+):
+    persistance_file_name = get_search_index_path(persistence_name)
+    if _search_index_is_current(persistance_file_name, modified_date):
+        return
+    incremental = file_type == "delta" and not USE_DELTA_EXT
+    logger.info(f"Building search index for {persistence_name}")
+    # unique temp file, the previous index keeps being served until it is replaced
+    persistance_file_name_temp = (
+        persistance_file_name + "_" + str(uuid4()).replace("-", "") + "_temp"
+    )
+    try:
+        if incremental and os.path.exists(persistance_file_name):
+            shutil.copyfile(persistance_file_name, persistance_file_name_temp)
+        with duckdb.connect(
+            persistance_file_name_temp, read_only=False, config=DUCK_CONFIG
+        ) as search_con:
+            if not incremental or not _update_search_table_delta(
+                search_con, persistence_name, uri
+            ):
+                _load_search_table(
+                    search_con, persistence_name, source_table_name, uri, file_type
+                )
+            # the fts extension cannot update an index, but this only reads the local table
+            scc = ", ".join([f"'{sc}'" for sc in search_columns])
+            search_con.execute(
+                f"PRAGMA create_fts_index('{persistence_name}', '__search_id', {scc}, overwrite=1)"
+            )
+        mtime = modified_date.timestamp()
+        os.utime(persistance_file_name_temp, (mtime, mtime))
+        os.replace(persistance_file_name_temp, persistance_file_name)
+    except Exception as err:
+        logger.warning(
+            f"Could not build search index for {persistence_name}: {err}", exc_info=err
+        )
+        raise
+    finally:
+        if os.path.exists(persistance_file_name_temp):
+            os.remove(persistance_file_name_temp)
+
+
+def schedule_search_index_build(
+    persistence_name: str,
+    source_table_name: Optional[str],
+    uri: SourceUri,
+    file_type: FileTypes,
+    search_configs: list[SearchConfig],
+    modified_date: datetime,
+) -> Future:
+    """Builds the full text search index in the background. There is at most one build per table at a time,
+    if one is already running, its Future is returned"""
+    global _search_index_executor
+    search_columns = []
+    for cfg in search_configs:
+        search_columns = search_columns + cfg.columns
+    with _search_index_lock:
+        running = _search_index_builds.get(persistence_name)
+        if running is not None and not running.done():
+            return running
+        if _search_index_executor is None:
+            _search_index_executor = ThreadPoolExecutor(
+                SEARCH_INDEX_BUILD_WORKERS, thread_name_prefix="search_index"
+            )
+        fut = _search_index_executor.submit(
+            _build_search_index,
+            persistence_name,
+            source_table_name,
+            uri,
+            file_type,
+            search_columns,
+            modified_date,
+        )
+        _search_index_builds[persistence_name] = fut
+        return fut
+
+
 class DuckDbExecutionContextBase(ExecutionContext):
     def __init__(
         self,
@@ -245,6 +461,7 @@ class DuckDbExecutionContextBase(ExecutionContext):
         self.res_con = None
         self.persistance_file_name = None
         self.array_contains_func = "array_contains"
+        self.sources: dict[str, tuple[Optional[str], SourceUri, FileTypes]] = {}
 
     @property
     def dialect(self):
@@ -264,6 +481,34 @@ class DuckDbExecutionContextBase(ExecutionContext):
     def close(self):
         self.con.close()
 
+    def interrupt(self):
+        super().interrupt()
+        self.con.interrupt()
+        if self.res_con is not None:
+            self.res_con.interrupt()
+
+    def estimate_cardinality(self, sql: str) -> Optional[Tuple[int, int]]:
+        import json
+
+        plan = json.loads(
+            self.con.execute("EXPLAIN (FORMAT JSON) " + sql).fetchall()[0][1]
+        )
+
+        def _estimates(node: dict):
+            est = node.get("extra_info", {}).get("Estimated Cardinality")
+            if est is not None:
+                yield int(est)
+            for child in node.get("children", []):
+                yield from _estimates(child)
+
+        root = next(_estimates(plan[0]), None)
+        if root is None:
+            return None
+        return root, max(e for n in plan for e in _estimates(n))
+
+    def set_threads(self, threads: int):
+        self.con.execute(f"SET threads={int(threads)}")
+
     def execute_sql(
         self,
         sql: Union[
@@ -326,54 +571,19 @@ class DuckDbExecutionContextBase(ExecutionContext):
         modified_date = self.modified_dates[source_view]
         if modified_date is None:
             return
-        persistence_name = source_view
-        search_columns = []
-        for cfg in search_configs:
-            search_columns = search_columns + cfg.columns
-        scc = ", ".join([f"{sc}" for sc in search_columns])
-        pk_name = "__search_id"
-        real_query = f"CREATE TABLE search_con.{persistence_name} AS SELECT ROW_NUMBER() OVER () AS __search_id, * FROM {source_view} s"
-        persitance_path = os.getenv("TEMP", "/tmp/")
-        persistance_file_name = os.path.join(
-            persitance_path, persistence_name + ".duckdb"
-        )
-
-        if (
-            not os.path.exists(persistance_file_name)
-            or datetime.fromtimestamp(
-                os.path.getmtime(persistance_file_name), tz=timezone.utc
-            )
-            < modified_date.astimezone(timezone.utc)
-            or datetime.fromtimestamp(
-                os.path.getmtime(persistance_file_name), tz=timezone.utc
-            )
-            < datetime.fromisoformat("2023-05-19").astimezone(
-                timezone.utc
-            )  # before duckdb upgrade
-        ):
-            persistance_file_name_temp = persistance_file_name + "_temp"
-            if os.path.exists(persistance_file_name_temp):
-                os.remove(persistance_file_name_temp)
-            search_con = duckdb.connect(
-                persistance_file_name_temp, read_only=False, config=DUCK_CONFIG
+        persistance_file_name = get_search_index_path(source_view)
+        if not _search_index_is_current(persistance_file_name, modified_date):
+            source_table_name, uri, file_type = self.sources[source_view]
+            build = schedule_search_index_build(
+                source_view,
+                source_table_name,
+                uri,
+                file_type,
+                search_configs,
+                modified_date,
             )
-
-            search_con.commit()  # create empty duck file
-            search_con.close()
-            self.con.execute(f"ATTACH '{persistance_file_name_temp}' AS search_con")
-            self.con.execute(real_query)
-            self.con.execute("DETACH search_con")
-            search_con = duckdb.connect(
-                persistance_file_name_temp, read_only=False, config=DUCK_CONFIG
-            )
-            scc = ", ".join([f"'{sc}'" for sc in search_columns])
-            search_con.execute(
-                f"PRAGMA create_fts_index('{persistence_name}', '{pk_name}', {scc})"
-            )
-            search_con.close()
-            if os.path.exists(persistance_file_name):
-                os.remove(persistance_file_name)
-            os.rename(persistance_file_name_temp, persistance_file_name)
+            if not os.path.exists(persistance_file_name):
+                build.result()  # no previous index to use meanwhile
         if not self.persistance_file_name:
             self.con.load_extension("fts")
         self.persistance_file_name = persistance_file_name
@@ -399,6 +609,7 @@ class DuckDbExecutionContextBase(ExecutionContext):
         limit: int | None = None,
     ):
         self.modified_dates[target_name] = self.get_modified_date(uri, file_type)
+        self.sources[target_name] = (source_table_name, uri, file_type)
 
         remote_uri, remote_opts = uri.get_uri_options(flavor="original")
         duckdb_apply_storage_options(
@@ -492,6 +703,8 @@ class DuckDbExecutionContext(DuckDbExecutionContextBase):
         super().__enter__()
         self.con.__enter__()
         self.con.execute("SET memory_limit='500MB'")
+        import multiprocessing
+
         self.con.execute(f"SET threads={int(multiprocessing.cpu_count() / 2)}")
         self.con.execute("SET default_null_order='nulls_first'")  # align with polars
         return self
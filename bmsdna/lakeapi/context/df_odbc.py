@@ -2,34 +2,121 @@ from datetime import datetime
 
 from fastapi.concurrency import run_in_threadpool
 import pyarrow as pa
-from typing import List, Optional, Tuple, Any, Union, cast
+from typing import List, Optional, Tuple, Any, Union, cast, TYPE_CHECKING
 from bmsdna.lakeapi.core.types import FileTypes, OperatorType
 from bmsdna.lakeapi.context.df_base import (
     FLAVORS,
     ExecutionContext,
+    QueryCancelledError,
     ResultData,
     get_sql,
 )
-import arrow_odbc
 import pyarrow.dataset
 import sqlglot.expressions as ex
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
 from bmsdna.lakeapi.core.config import SearchConfig
 from sqlglot import from_, parse_one
 from uuid import uuid4
 from .source_uri import SourceUri
 
+if TYPE_CHECKING:
+    import arrow_odbc
+
+ODBC_PREFETCH_BATCHES = int(
+    os.getenv("ODBC_PREFETCH_BATCHES", "2")
+)  # 0 disables the background fetch thread
+ODBC_FETCH_CONCURRENTLY = os.getenv("ODBC_FETCH_CONCURRENTLY", "1") == "1"
+ODBC_MAX_BYTES_PER_BATCH = (
+    int(os.environ["ODBC_MAX_BYTES_PER_BATCH"])
+    if os.getenv("ODBC_MAX_BYTES_PER_BATCH")
+    else None
+)
+
 
 def _get_temp_table_name():
     return "temp_" + str(uuid4()).replace("-", "")
 
 
-arrow_odbc.enable_odbc_connection_pooling()
+_pooling_enabled = False
+_pooling_lock = threading.Lock()
+
+
+def _get_arrow_odbc():
+    """Imports arrow_odbc, which loads the ODBC driver manager, once the first query runs"""
+    global _pooling_enabled
+    import arrow_odbc
+
+    with _pooling_lock:
+        if not _pooling_enabled:
+            arrow_odbc.enable_odbc_connection_pooling()
+            _pooling_enabled = True
+    return arrow_odbc
+
+
+ODBC_SCHEMA_CACHE_TTL = int(
+    os.getenv("ODBC_SCHEMA_CACHE_TTL", "300")
+)  # seconds, a changed table is seen after at most this time
+ODBC_SCHEMA_CACHE_SIZE = int(os.getenv("ODBC_SCHEMA_CACHE_SIZE", "1000"))
+
+# result schemas by connection and projection. filters, sorting and paging do not change the schema,
+# so they are not part of the key
+_schema_cache: "OrderedDict[tuple[str, str], tuple[pa.Schema, float]]" = OrderedDict()
+_schema_cache_lock = threading.Lock()
+
+
+def _get_cached_schema(key: tuple[str, str]) -> Optional[pa.Schema]:
+    with _schema_cache_lock:
+        entry = _schema_cache.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del _schema_cache[key]
+            return None
+        _schema_cache.move_to_end(key)
+        return entry[0]
+
+
+def _set_cached_schema(key: tuple[str, str], schema: pa.Schema):
+    with _schema_cache_lock:
+        _schema_cache[key] = (schema, time.monotonic() + ODBC_SCHEMA_CACHE_TTL)
+        _schema_cache.move_to_end(key)
+        while len(_schema_cache) > ODBC_SCHEMA_CACHE_SIZE:
+            _schema_cache.popitem(last=False)
+
+
+def _get_schema_key(
+    original_sql: Union[ex.Query, str], connection_string: str, dialect: str
+) -> tuple[str, str]:
+    if isinstance(original_sql, str):
+        return (connection_string, original_sql)
+    projection = original_sql.copy()
+    for arg in ("where", "order", "limit", "offset"):
+        projection.set(arg, None)
+    return (connection_string, projection.sql(dialect=dialect))
+
+
+_END_OF_BATCHES = object()
 
 
 class BatchReaderWrap:
-    def __init__(self, rdr: arrow_odbc.BatchReader):
+    """Iterates the batches of a reader. With prefetch > 0, batches are fetched in a background thread
+    while the consumer is still encoding the previous ones, at most prefetch batches ahead.
+    Stops with a QueryCancelledError between two batches once cancel_event is set"""
+
+    def __init__(
+        self,
+        rdr: "Union[arrow_odbc.BatchReader, pa.RecordBatchReader]",
+        prefetch: int = ODBC_PREFETCH_BATCHES,
+        cancel_event: Optional[threading.Event] = None,
+    ):
         self.rdr = rdr
+        self.prefetch = prefetch
+        self.cancel_event = cancel_event
+        self._stop = threading.Event()
 
     def __enter__(self, *args, **kwargs):
         return self
@@ -38,11 +125,64 @@ class BatchReaderWrap:
     def schema(self):
         return self.rdr.schema
 
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise QueryCancelledError()
+
+    def _iter_direct(self):
+        for batch in self.rdr:
+            self._check_cancelled()
+            yield batch
+
+    def _fetch(self, q: queue.Queue):
+        last = _END_OF_BATCHES
+        try:
+            for batch in self._iter_direct():
+                if not self._put(q, batch):
+                    return  # consumer is gone
+        except BaseException as err:
+            last = err
+        finally:
+            self._put(q, last)  # always ends the consumer's loop
+
+    def _iter_prefetched(self):
+        q: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        fetcher = threading.Thread(
+            target=self._fetch, args=(q,), name="odbc_prefetch", daemon=True
+        )
+        fetcher.start()
+        try:
+            while True:
+                try:
+                    item = q.get(timeout=0.5)
+                except queue.Empty:
+                    if not fetcher.is_alive() and q.empty():
+                        raise RuntimeError("ODBC fetch thread stopped unexpectedly")
+                    continue
+                if item is _END_OF_BATCHES:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._stop.set()
+
     def __iter__(self):
-        return self.rdr.__iter__()
+        if self.prefetch <= 0:
+            return self._iter_direct()
+        return self._iter_prefetched()
 
     def __exit__(self, *args, **kwargs):
-        pass
+        self._stop.set()
 
 
 class ODBCResultData(ResultData):
@@ -51,10 +191,12 @@ class ODBCResultData(ResultData):
         original_sql: Union[ex.Query, str],
         connection_string: str,
         chunk_size: int,
+        cancel_event: Optional[threading.Event] = None,
     ) -> None:
         super().__init__(chunk_size=chunk_size)
         self.original_sql = original_sql
         self.connection_string = connection_string
+        self.cancel_event = cancel_event
         self._arrow_schema = None
         self._df = None
         self.flavor: FLAVORS = (
@@ -76,28 +218,51 @@ class ODBCResultData(ResultData):
                 .as_("t")
             )
 
+    @property
+    def schema_key(self):
+        return _get_schema_key(self.original_sql, self.connection_string, self.dialect)
+
+    def _read_batches(self) -> "arrow_odbc.BatchReader":
+        query = get_sql(self.original_sql, dialect=self.dialect)
+        kwargs = {}
+        # passing None would disable the default limit of arrow_odbc
+        if ODBC_MAX_BYTES_PER_BATCH is not None:
+            kwargs["max_bytes_per_batch"] = ODBC_MAX_BYTES_PER_BATCH
+        reader = _get_arrow_odbc().read_arrow_batches_from_odbc(
+            query,
+            connection_string=self.connection_string,
+            batch_size=self.chunk_size,
+            fetch_concurrently=ODBC_FETCH_CONCURRENTLY,
+            **kwargs,
+        )
+        assert reader is not None
+        # no need for a TOP 0 query next time
+        _set_cached_schema(self.schema_key, reader.schema)
+        return reader
+
     def arrow_schema(self) -> pa.Schema:
         if self._arrow_schema is not None:
             return self._arrow_schema
+        if self._df is not None:
+            self._arrow_schema = self._df.schema
+            return self._arrow_schema
+        if (cached := _get_cached_schema(self.schema_key)) is not None:
+            self._arrow_schema = cached
+            return self._arrow_schema
         query = get_sql(self.original_sql, limit=0, dialect=self.dialect)
-        batches = arrow_odbc.read_arrow_batches_from_odbc(
+        batches = _get_arrow_odbc().read_arrow_batches_from_odbc(
             query, connection_string=self.connection_string, batch_size=self.chunk_size
         )
         assert batches is not None
         self._arrow_schema = batches.schema
+        _set_cached_schema(self.schema_key, batches.schema)
         return self._arrow_schema
 
     async def get_df(self):
         if self._df is None:
-            query = get_sql(self.original_sql, dialect=self.dialect)
-            batch_reader = await run_in_threadpool(
-                arrow_odbc.read_arrow_batches_from_odbc,
-                query,
-                connection_string=self.connection_string,
-                batch_size=self.chunk_size,
-            )
-            assert batch_reader is not None
-            self._df = pa.Table.from_batches(batch_reader, batch_reader.schema)
+            batch_reader = await run_in_threadpool(self._read_batches)
+            batches = BatchReaderWrap(batch_reader, 0, self.cancel_event)
+            self._df = pa.Table.from_batches(batches, batch_reader.schema)
         return self._df
 
     async def to_pandas(self):
@@ -108,15 +273,18 @@ class ODBCResultData(ResultData):
         return df.to_pylist()
 
     async def to_arrow_recordbatch(self, chunk_size: int = 10000):  # type: ignore
-        query = get_sql(self.original_sql, dialect=self.dialect)
-        res = await run_in_threadpool(
-            arrow_odbc.read_arrow_batches_from_odbc,
-            query,
-            connection_string=self.connection_string,
-            batch_size=self.chunk_size,
-        )
-        assert res is not None
-        return BatchReaderWrap(res)
+        if self._df is not None:  # already fetched, do not run the statement again
+            return BatchReaderWrap(
+                self._df.to_reader(max_chunksize=chunk_size),
+                prefetch=0,  # in memory, nothing to wait for
+                cancel_event=self.cancel_event,
+            )
+        res = await run_in_threadpool(self._read_batches)
+        return BatchReaderWrap(res, cancel_event=self.cancel_event)
+
+    def __exit__(self, *args, **kwargs):
+        self._df = None
+        super().__exit__(*args, **kwargs)
 
 
 class ODBCExecutionContext(ExecutionContext):
@@ -162,6 +330,7 @@ class ODBCExecutionContext(ExecutionContext):
             sql,
             chunk_size=self.chunk_size,
             connection_string=self.datasources[list(self.datasources.keys())[0]],
+            cancel_event=self.cancel_event,
         )
 
     def json_function(self, term: ex.Expression, assure_string=False):
@@ -1,9 +1,11 @@
 from bmsdna.lakeapi.context.df_base import (
     ExecutionContext,
     FileTypeNotSupportedError,
+    QueryCancelledError,
     ResultData,
     get_sql,
 )
+from fastapi.concurrency import run_in_threadpool
 
 import pyarrow as pa
 from typing import List, Optional, Tuple, Union, cast, Any, TYPE_CHECKING
@@ -12,6 +14,8 @@ from bmsdna.lakeapi.utils.meta_cache import get_deltalake_meta
 
 if TYPE_CHECKING:
     import polars as pl
+    from bmsdna.lakeapi.context.polars_search import SearchIndex
+    from bmsdna.lakeapi.core.config import SearchConfig
 from bmsdna.lakeapi.core.types import FileTypes, OperatorType
 from deltalake2db import FilterType
 import pyarrow.dataset
@@ -21,6 +25,7 @@ from sqlglot import from_, parse_one
 
 from uuid import uuid4
 import json
+import threading
 from .source_uri import SourceUri
 from sqlglot.dialects.postgres import Postgres
 import os
@@ -66,9 +71,12 @@ class PolarsResultData(ResultData):
         sql: Union[ex.Query, str],
         chunk_size: int,
         to_register: dict[str, pl.LazyFrame | pl.DataFrame] = {},
+        cancel_event: Optional[threading.Event] = None,
     ):
         super().__init__(chunk_size=chunk_size)
         self.sql = sql
+        self.cancel_event = cancel_event
+        self._query = None
         self._df = None
         self.random_name = "tbl_" + str(uuid4()).replace("-", "")
         self.registred_df = False
@@ -102,10 +110,25 @@ class PolarsResultData(ResultData):
     async def get_df_collected(self) -> "pl.DataFrame":
         _df = self.get_df()
         if isinstance(_df, pl.LazyFrame):
-            _df = await _df.collect_async()
+            self._query = _df.collect(background=True)
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                self.cancel()
+            try:
+                _df = await run_in_threadpool(self._query.fetch_blocking)
+            except pl.exceptions.ComputeError as err:
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    raise QueryCancelledError() from err
+                raise
+            finally:
+                self._query = None
             self._df = _df
         return _df
 
+    def cancel(self):
+        query = self._query
+        if query is not None:
+            query.cancel()  # takes effect at the next operator
+
     def columns(self):
         if self._df is None:
             _df = pl.DataFrame(
@@ -152,8 +175,19 @@ class PolarsResultData(ResultData):
             .to_reader(max_chunksize=chunk_size)
         )
 
-    async def write_parquet(self, file_name: str):
-        (await self.get_df_collected()).write_parquet(file_name, use_pyarrow=True)
+    async def write_parquet(
+        self,
+        file_name: str,
+        *,
+        compression: str = "snappy",
+        compression_level: Optional[int] = None,
+    ):
+        (await self.get_df_collected()).write_parquet(
+            file_name,
+            use_pyarrow=True,
+            compression="uncompressed" if compression == "none" else compression,  # type: ignore
+            compression_level=compression_level,
+        )
 
     async def write_json(self, file_name: str):
         (await self.get_df_collected()).write_json(file_name)
@@ -165,14 +199,44 @@ class PolarsResultData(ResultData):
         (await self.get_df_collected()).write_ndjson(file_name)
 
 
+def _get_filter_expr(filters: FilterType, schema: "pl.Schema") -> "pl.Expr":
+    """The filters as polars expression. Partition values are strings, so values are cast to the column type"""
+    import polars as pl
+
+    result = pl.lit(True)
+    for col, op, value in filters:
+        dtype = schema[col]
+        if op in ["in", "not in"]:
+            expr = pl.col(col).is_in(pl.Series(list(value)).cast(dtype))  # type: ignore
+            expr = ~expr if op == "not in" else expr
+        else:
+            lit = pl.lit(value).cast(dtype)
+            expr = {
+                "=": pl.col(col) == lit,
+                "<>": pl.col(col) != lit,
+                "<": pl.col(col) < lit,
+                "<=": pl.col(col) <= lit,
+                ">": pl.col(col) > lit,
+                ">=": pl.col(col) >= lit,
+            }[op]
+        result = result & expr
+    return result
+
+
 class PolarsExecutionContext(ExecutionContext):
     def __init__(self, chunk_size: int):
         super().__init__(chunk_size=chunk_size, engine_name="polars")
         import polars as pl
 
         self.len_func = "length"
+        self.supports_alias_in_where = False
         # self.sql_context = sql_context or pl.SQLContext()
         self._to_register: dict[str, pl.LazyFrame | pl.DataFrame] = {}
+        self._filters: dict[str, Optional[FilterType]] = {}
+        self._sources: dict[str, tuple[Optional[str], SourceUri, FileTypes]] = {}
+        self._search_indexes: dict[tuple[str, tuple[str, ...]], "SearchIndex"] = {}
+        self._search_score_count = 0
+        self._results: list[PolarsResultData] = []
 
     @property
     def dialect(self):
@@ -197,9 +261,79 @@ class PolarsExecutionContext(ExecutionContext):
     def close(self):
         pass
 
+    def interrupt(self):
+        super().interrupt()
+        for res in self._results:
+            res.cancel()
+
     def json_function(self, term: ex.Expression, assure_string=False):
         raise NotImplementedError()
 
+    def init_search(
+        self,
+        source_view: str,
+        search_configs: list["SearchConfig"],
+    ):
+        from bmsdna.lakeapi.context.polars_search import get_search_index
+
+        modified_date = self.modified_dates.get(source_view)
+        if modified_date is None:
+            return
+        filters = self._filters.get(source_view)
+        if (
+            filters
+            and "__search_id"
+            not in self._to_register[source_view].collect_schema().names()
+        ):
+            # the index is built once for the whole source, the filters are applied to its rows instead
+            self.register_datasource(
+                source_view, *self._sources[source_view], filters=None
+            )
+            self._filters[source_view] = filters
+        df = self._to_register[source_view]
+        for cfg in search_configs:
+            columns = tuple(cfg.columns)
+            if (source_view, columns) in self._search_indexes:
+                continue
+            self._search_indexes[(source_view, columns)] = get_search_index(
+                (source_view, columns),
+                modified_date,
+                df,
+                cfg.columns,
+            )
+        if "__search_id" not in df.collect_schema().names():
+            df = df.with_row_index("__search_id")
+            if filters:
+                df = df.filter(_get_filter_expr(filters, df.collect_schema()))
+            self._to_register[source_view] = df
+
+    def search_score_function(
+        self,
+        source_view: str,
+        search_text: str,
+        search_config: "SearchConfig",
+        alias: Optional[str],
+    ):
+        import polars as pl
+
+        index = self._search_indexes.get((source_view, tuple(search_config.columns)))
+        if index is None:
+            return super().search_score_function(
+                source_view, search_text, search_config, alias
+            )
+        score_col = f"__search_score_{self._search_score_count}"
+        self._search_score_count += 1
+        scores = index.score(search_text).rename({"score": score_col})
+        df = self._to_register[source_view]
+        # only matching rows are kept, like the sum of the scores being null otherwise
+        self._to_register[source_view] = df.join(
+            scores if isinstance(df, pl.DataFrame) else scores.lazy(),  # type: ignore
+            on="__search_id",
+            how="inner",
+        )
+        col = ex.column(score_col)
+        return col.as_(alias) if alias else col
+
     def jsonify_complex(
         self, query: ex.Query, complex_cols: list[str], columns: list[str]
     ):
@@ -243,6 +377,8 @@ class PolarsExecutionContext(ExecutionContext):
         ab_uri, uri_opts = uri.get_uri_options(flavor="object_store")
 
         self.modified_dates[target_name] = self.get_modified_date(uri, file_type)
+        self._filters[target_name] = filters
+        self._sources[target_name] = (source_table_name, uri, file_type)
         match file_type:
             case "delta":
                 from deltalake2db.protocol_check import DeltaProtocolError
@@ -319,7 +455,11 @@ class PolarsExecutionContext(ExecutionContext):
             str,
         ],
     ) -> PolarsResultData:
-        return PolarsResultData(sql, self.chunk_size, self._to_register.copy())
+        res = PolarsResultData(
+            sql, self.chunk_size, self._to_register.copy(), self.cancel_event
+        )
+        self._results.append(res)
+        return res
 
     def list_tables(self) -> ResultData:
         return self.execute_sql("SHOW TABLES")
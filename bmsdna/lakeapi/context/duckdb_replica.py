@@ -0,0 +1,321 @@
+import os
+import shutil
+import threading
+from time import time
+from typing import Optional
+from uuid import uuid4
+
+import duckdb
+import pyarrow as pa
+
+from bmsdna.lakeapi.context.source_uri import SourceUri
+from bmsdna.lakeapi.core.config import DuckDBBackendConfig
+from bmsdna.lakeapi.core.log import get_logger
+from bmsdna.lakeapi.core.types import FileTypes
+from bmsdna.lakeapi.utils.file_lock import file_lock
+
+logger = get_logger(__name__)
+
+REPLICA_REFRESH_INTERVAL = int(
+    os.getenv("DUCKDB_REPLICA_REFRESH_INTERVAL", "3600")
+)  # in seconds, for sources without a version (odbc)
+REPLICA_CHECK_INTERVAL = int(
+    os.getenv("DUCKDB_REPLICA_CHECK_INTERVAL", "60")
+)  # in seconds, how often a request may check the source for changes
+
+_STATE_TABLE = "__lakeapi_replica_state"
+_FILES_TABLE = "__lakeapi_replica_files"
+
+_replica_state: dict[tuple[str, str], tuple[Optional[str], float]] = {}
+_last_checked: dict[tuple[str, str], float] = {}
+_refreshing: set[tuple[str, str]] = set()
+_locks: dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def _get_lock(db_path: str):
+    with _locks_lock:
+        if db_path not in _locks:
+            _locks[db_path] = threading.Lock()
+        return _locks[db_path]
+
+
+def _should_check(key: tuple[str, str]) -> bool:
+    """Whether the source should be checked for changes, at most every REPLICA_CHECK_INTERVAL seconds"""
+    now = time()
+    with _locks_lock:
+        if now - _last_checked.get(key, 0) < REPLICA_CHECK_INTERVAL:
+            return False
+        _last_checked[key] = now
+        return True
+
+
+def _action_key(add_action: dict) -> str:
+    """Identifies the content of an add action. A file that gets a deletion vector is added again with the same path,
+    so the deletion vector is part of the key"""
+    dv = add_action.get("deletionVector")
+    if not dv:
+        return add_action["path"]
+    return f"{add_action['path']}#{dv.get('storageType')}:{dv.get('pathOrInlineDv')}@{dv.get('offset')}"
+
+
+def _quote(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _split_cols(cols: str):
+    return ", ".join(_quote(c.strip()) for c in cols.split(","))
+
+
+def _get_source_version(uri: SourceUri, file_type: FileTypes) -> Optional[str]:
+    if file_type == "odbc":
+        return None
+    if file_type == "delta":
+        from bmsdna.lakeapi.utils.meta_cache import get_deltalake_meta
+
+        return str(get_deltalake_meta(False, uri).version)
+    fs, fs_uri = uri.get_fs_spec()
+    return fs.modified(fs_uri).isoformat()
+
+
+def _read_state(db_path: str, table_name: str):
+    if not os.path.exists(db_path):
+        return None
+    with duckdb.connect(db_path, read_only=True) as con:
+        if not con.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_name=?",
+            [_STATE_TABLE],
+        ).fetchone():
+            return None
+        row = con.execute(
+            f"SELECT version, refreshed_at FROM {_STATE_TABLE} WHERE table_name=?",
+            [table_name],
+        ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def _is_stale(
+    state: tuple[Optional[str], float], uri: SourceUri, file_type: FileTypes
+) -> bool:
+    version, refreshed_at = state
+    if file_type == "odbc":
+        return time() - refreshed_at > REPLICA_REFRESH_INTERVAL
+    return _get_source_version(uri, file_type) != version
+
+
+def _load_full(
+    con: duckdb.DuckDBPyConnection,
+    table_name: str,
+    source_table_name: str,
+    uri: SourceUri,
+    file_type: FileTypes,
+):
+    if file_type == "odbc":
+        import arrow_odbc
+
+        reader = arrow_odbc.read_arrow_batches_from_odbc(
+            f"SELECT * FROM {source_table_name}", connection_string=uri.uri
+        )
+        assert reader is not None
+        con.register(
+            "__replica_src", pa.RecordBatchReader.from_batches(reader.schema, reader)
+        )
+        con.execute(f"CREATE TABLE {_quote(table_name)} AS SELECT * FROM __replica_src")
+        con.unregister("__replica_src")
+        return
+    from bmsdna.lakeapi.context.df_duckdb import DuckDbExecutionContextBase
+
+    ctx = DuckDbExecutionContextBase(con, chunk_size=10000)
+    ctx.register_datasource(
+        "__replica_src", source_table_name, uri, file_type, filters=None
+    )
+    ctx.con.execute(f"CREATE TABLE {_quote(table_name)} AS SELECT * FROM __replica_src")
+    ctx.con.execute("DROP VIEW __replica_src")
+    ctx.close()
+
+
+def _apply_delta(
+    con: duckdb.DuckDBPyConnection,
+    table_name: str,
+    uri: SourceUri,
+    applied: set[str],
+) -> set[str]:
+    """Brings the replica to the current version of the delta table. Returns the keys of all add actions
+    contained in the replica afterwards. If files were only added, without deletion vectors, just the new files are inserted"""
+    from deltalake2db import duckdb_apply_storage_options
+    from deltalake2db.duckdb import get_sql_for_delta
+    from bmsdna.lakeapi.context.df_duckdb import USE_FSSPEC
+    from bmsdna.lakeapi.utils.meta_cache import get_deltalake_meta
+
+    meta = get_deltalake_meta(False, uri)
+    current = {_action_key(ac): ac for ac in meta.add_actions.values()}
+    remote_uri, remote_opts = uri.get_uri_options(flavor="original")
+    duckdb_apply_storage_options(con, remote_uri, remote_opts, use_fsspec=USE_FSSPEC)
+    table_exists = con.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_name=?", [table_name]
+    ).fetchone()
+    new_actions = [ac for k, ac in current.items() if k not in applied]
+    if (
+        table_exists
+        and applied
+        and applied <= current.keys()
+        and not any(ac.get("deletionVector") for ac in new_actions)
+    ):  # append only
+        new_paths = {ac["path"] for ac in new_actions}
+        if new_paths:
+            sql = get_sql_for_delta(
+                meta,
+                action_filter=lambda ac: ac["path"] in new_paths,
+                duck_con=con,
+                use_fsspec=USE_FSSPEC,
+            )
+            con.execute(f"INSERT INTO {_quote(table_name)} BY NAME {sql}")
+        return set(current.keys())
+    con.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+    sql = get_sql_for_delta(meta, duck_con=con, use_fsspec=USE_FSSPEC)
+    con.execute(f"CREATE TABLE {_quote(table_name)} AS {sql}")
+    return set(current.keys())
+
+
+def _create_indexes(
+    con: duckdb.DuckDBPyConnection, table_name: str, backend: DuckDBBackendConfig
+):
+    if backend.primary_key:
+        con.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {_quote(table_name + '__pk')} ON {_quote(table_name)}({_split_cols(backend.primary_key)})"
+        )
+    for i, cols in enumerate(backend.index or []):
+        con.execute(
+            f"CREATE INDEX IF NOT EXISTS {_quote(table_name + '__ix' + str(i))} ON {_quote(table_name)}({_split_cols(cols)})"
+        )
+
+
+def _build_replica(
+    backend: DuckDBBackendConfig,
+    db_path: str,
+    table_name: str,
+    source_table_name: str,
+    uri: SourceUri,
+    file_type: FileTypes,
+):
+    version = _get_source_version(uri, file_type)
+    tmp_path = db_path + "." + uuid4().hex + ".tmp"
+    if os.path.exists(db_path):
+        shutil.copyfile(db_path, tmp_path)  # keep other tables and allow incremental
+    else:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    try:
+        with duckdb.connect(tmp_path, read_only=False) as con:
+            con.execute(
+                f"CREATE TABLE IF NOT EXISTS {_STATE_TABLE}(table_name VARCHAR PRIMARY KEY, version VARCHAR, refreshed_at DOUBLE)"
+            )
+            con.execute(
+                f"CREATE TABLE IF NOT EXISTS {_FILES_TABLE}(table_name VARCHAR, path VARCHAR)"
+            )
+            if file_type == "delta":
+                applied = {
+                    r[0]
+                    for r in con.execute(
+                        f"SELECT path FROM {_FILES_TABLE} WHERE table_name=?",
+                        [table_name],
+                    ).fetchall()
+                }
+                paths = _apply_delta(con, table_name, uri, applied)
+                con.execute(
+                    f"DELETE FROM {_FILES_TABLE} WHERE table_name=?", [table_name]
+                )
+                con.executemany(
+                    f"INSERT INTO {_FILES_TABLE} VALUES (?, ?)",
+                    [(table_name, p) for p in paths],
+                )
+            else:
+                con.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+                _load_full(con, table_name, source_table_name, uri, file_type)
+            _create_indexes(con, table_name, backend)
+            refreshed_at = time()
+            con.execute(
+                f"INSERT OR REPLACE INTO {_STATE_TABLE} VALUES (?, ?, ?)",
+                [table_name, version, refreshed_at],
+            )
+            con.execute("CHECKPOINT")
+        os.replace(tmp_path, db_path)
+        _replica_state[(db_path, table_name)] = (version, refreshed_at)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if os.path.exists(tmp_path + ".wal"):
+            os.remove(tmp_path + ".wal")
+
+
+def _refresh_replica(
+    backend: DuckDBBackendConfig,
+    db_path: str,
+    table_name: str,
+    source_table_name: str,
+    uri: SourceUri,
+    file_type: FileTypes,
+    blocking: bool,
+):
+    lock = _get_lock(db_path)
+    if not lock.acquire(blocking=blocking):
+        return  # someone else is refreshing, use the current replica meanwhile
+    try:
+        # the file is shared by all workers, the state on disk tells if another one refreshed it meanwhile
+        with file_lock(db_path):
+            state = _read_state(db_path, table_name)
+            if state is not None:
+                _replica_state[(db_path, table_name)] = state
+                if not _is_stale(state, uri, file_type):
+                    return
+            _build_replica(
+                backend, db_path, table_name, source_table_name, uri, file_type
+            )
+    except Exception as err:
+        if blocking:
+            raise
+        logger.warning(f"Could not refresh replica {db_path}: {err}", exc_info=err)
+    finally:
+        lock.release()
+
+
+def _refresh_in_background(*args):
+    try:
+        _refresh_replica(*args, blocking=False)
+    finally:
+        with _locks_lock:
+            _refreshing.discard((args[1], args[2]))
+
+
+def get_replica_path(
+    backend: DuckDBBackendConfig,
+    db_path: str,
+    table_name: str,
+    source_table_name: str,
+    uri: SourceUri,
+    file_type: FileTypes,
+) -> str:
+    """Returns the path of the DuckDB file containing table_name as a local copy of the source.
+    Creates the replica if it does not exist yet. If the source has changed, the replica is refreshed in the background
+    and swapped in atomically, until then the current replica is used. The source is checked at most every
+    REPLICA_CHECK_INTERVAL seconds"""
+    key = (db_path, table_name)
+    state = _replica_state.get(key)
+    if state is None:
+        state = _read_state(db_path, table_name)
+        if state is not None:
+            _replica_state[key] = state
+    args = (backend, db_path, table_name, source_table_name, uri, file_type)
+    if state is None:
+        _refresh_replica(*args, blocking=True)
+    elif _should_check(key) and _is_stale(state, uri, file_type):
+        with _locks_lock:
+            if key in _refreshing:
+                return db_path  # one refresh thread per replica
+            _refreshing.add(key)
+        threading.Thread(
+            target=_refresh_in_background,
+            args=args,
+            name="duckdb_replica",
+            daemon=True,
+        ).start()
+    return db_path
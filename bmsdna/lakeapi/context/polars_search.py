@@ -0,0 +1,103 @@
+import threading
+from datetime import datetime
+from typing import Optional
+
+import polars as pl
+
+BM25_K1 = 1.2  # same defaults as DuckDB's match_bm25
+BM25_B = 0.75
+TOKEN_PATTERN = r"[^\W_]+"
+
+_indexes: dict[tuple, tuple[Optional[datetime], "SearchIndex"]] = {}
+_index_locks: dict[tuple, threading.Lock] = {}
+_index_locks_lock = threading.Lock()
+
+
+def _tokenize_expr(expr: pl.Expr) -> pl.Expr:
+    return expr.cast(pl.Utf8).str.to_lowercase().str.extract_all(TOKEN_PATTERN)
+
+
+class SearchIndex:
+    """Inverted index over the given columns, kept in Arrow backed polars frames.
+    Row ids are the position of the row in the frame the index was built from"""
+
+    def __init__(self, df: pl.DataFrame, columns: list[str]):
+        tokens = df.select(
+            pl.int_range(pl.len(), dtype=pl.UInt32).alias("__search_id"),
+            pl.concat_list([_tokenize_expr(pl.col(c)) for c in columns]).alias("token"),
+        )
+        self.num_docs = df.height
+        self.doc_len = tokens.select(pl.col("token").list.len()).to_series()
+        self.avg_doc_len = float(self.doc_len.mean() or 0) or 1.0  # type: ignore
+        self.postings = (
+            tokens.explode("token")
+            .drop_nulls("token")
+            .group_by("token", "__search_id")
+            .agg(pl.len().alias("tf"))
+            .sort("token", "__search_id")
+        )
+        self.terms = (
+            self.postings.group_by("token").agg(pl.len().alias("df")).sort("token")
+        )
+
+    def _match_terms(self, search_text: str) -> pl.DataFrame:
+        """Terms of the index matching the search text. Terms not in the index are matched as prefix,
+        like an edge n-gram index would, eg `kar` matches `karen`"""
+        query_terms = (
+            pl.Series([search_text]).str.to_lowercase().str.extract_all(TOKEN_PATTERN)
+        )[0].to_list()
+        exact = self.terms.filter(pl.col("token").is_in(query_terms))
+        missing = [t for t in query_terms if t not in set(exact["token"].to_list())]
+        if not missing:
+            return exact
+        prefixed = self.terms.filter(
+            pl.any_horizontal([pl.col("token").str.starts_with(t) for t in missing])
+        )
+        return pl.concat([exact, prefixed]).unique("token")
+
+    def score(self, search_text: str) -> pl.DataFrame:
+        """Returns __search_id and a BM25 score for all rows matching at least one term"""
+        terms = self._match_terms(search_text).with_columns(
+            (
+                ((self.num_docs - pl.col("df") + 0.5) / (pl.col("df") + 0.5) + 1).log()
+            ).alias("idf")
+        )
+        postings = self.postings.join(terms, on="token", how="inner")
+        doc_len = self.doc_len.gather(postings["__search_id"]).cast(pl.Float64)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / self.avg_doc_len)
+        return (
+            postings.with_columns(
+                (
+                    pl.col("idf") * pl.col("tf") * (BM25_K1 + 1) / (pl.col("tf") + norm)
+                ).alias("score")
+            )
+            .group_by("__search_id")
+            .agg(pl.col("score").sum())
+        )
+
+
+def get_search_index(
+    key: tuple,
+    modified_date: Optional[datetime],
+    df: pl.LazyFrame | pl.DataFrame,
+    columns: list[str],
+) -> SearchIndex:
+    """Returns the index for key, building it once per modified_date of the source"""
+    cached = _indexes.get(key)
+    if cached is not None and cached[0] == modified_date:
+        return cached[1]
+    with _index_locks_lock:
+        if key not in _index_locks:
+            _index_locks[key] = threading.Lock()
+        lock = _index_locks[key]
+    with lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == modified_date:
+            return cached[1]
+        text_df = df.select(columns)
+        index = SearchIndex(
+            text_df.collect() if not isinstance(text_df, pl.DataFrame) else text_df,
+            columns,
+        )
+        _indexes[key] = (modified_date, index)
+        return index
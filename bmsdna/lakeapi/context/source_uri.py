@@ -1,12 +1,12 @@
 from pathlib import Path
 from typing import Any, Callable, Literal, TYPE_CHECKING, Mapping, Union
-import fsspec
-import adlfs
 import os
+import re
 import urllib.parse
 
 if TYPE_CHECKING:
     from azure.core.credentials import TokenCredential
+    import fsspec
 
 
 def _convert_options(
@@ -72,7 +72,9 @@ class SourceUri:
     def is_local(self):
         return self.account is None and "://" not in self.uri
 
-    def get_fs_spec(self) -> tuple[fsspec.AbstractFileSystem, str]:
+    def get_fs_spec(self) -> "tuple[fsspec.AbstractFileSystem, str]":
+        import fsspec  # storage backends are only loaded once needed
+
         if self.account is None:
             return fsspec.filesystem("file"), self.real_uri
         real_uri = self.real_uri
@@ -84,6 +86,8 @@ class SourceUri:
         )
         assert opts is not None
         if self.is_azure():
+            import adlfs
+
             return adlfs.AzureBlobFileSystem(**opts), real_uri  # type: ignore
         else:
             pr = urllib.parse.urlparse(self.uri)
@@ -105,6 +109,30 @@ class SourceUri:
         fs, fs_path = self.get_fs_spec()
         return fs.exists(fs_path)
 
+    def get_version_key(self, delta_table: bool) -> str | None:
+        """A cheap version of the content: the version and modification time of the latest commit of a delta table,
+        found by listing the delta log, or the etag or modification time and size of a file. None if it does not exist"""
+        fs, fs_path = self.get_fs_spec()
+        if delta_table:
+            try:
+                files = fs.ls(fs_path + "/_delta_log", detail=True)
+            except FileNotFoundError:
+                return None
+            commits = [
+                (int(m.group(1)), f)
+                for f in files
+                if (m := re.search(r"(\d{20})\.json$", f["name"]))
+            ]
+            if not commits:
+                return None
+            version, info = max(commits, key=lambda c: c[0])
+            return f"{version}:{info.get('mtime') or info.get('last_modified')}"
+        try:
+            info = fs.info(fs_path)
+        except FileNotFoundError:
+            return None
+        return f"{info.get('etag') or info.get('mtime') or info.get('last_modified')}:{info.get('size')}"
+
     def copy_to_local(
         self,
         local_path: str,
@@ -0,0 +1,118 @@
+import os
+import typing
+import zlib
+from typing import Optional, Protocol
+
+import anyio
+import anyio.to_thread
+
+RESPONSE_COMPRESSION = [
+    e.strip()
+    for e in os.getenv("RESPONSE_COMPRESSION", "zstd,br,gzip").split(",")
+    if e.strip()
+]  # in order of preference, empty disables compression
+RESPONSE_COMPRESSION_MIN_SIZE = int(
+    os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", "4096")
+)  # smaller responses are sent uncompressed
+RESPONSE_COMPRESSION_LEVELS = {
+    "gzip": int(os.getenv("RESPONSE_COMPRESSION_LEVEL_GZIP", "6")),
+    "zstd": int(os.getenv("RESPONSE_COMPRESSION_LEVEL_ZSTD", "3")),
+    "br": int(os.getenv("RESPONSE_COMPRESSION_LEVEL_BR", "4")),
+}
+
+
+class Compressor(Protocol):
+    def compress(self, data: bytes, /) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+
+class _BrotliCompressor:
+    def __init__(self, level: int):
+        import brotli
+
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+def _is_available(encoding: str) -> bool:
+    if encoding == "gzip":
+        return True
+    try:
+        if encoding == "zstd":
+            import zstandard  # noqa: F401
+        elif encoding == "br":
+            import brotli  # noqa: F401
+        else:
+            return False
+    except ImportError:
+        return False
+    return True
+
+
+_available: Optional[list[str]] = None
+
+
+def available_encodings() -> list[str]:
+    """The encodings of RESPONSE_COMPRESSION whose library is installed. zstd needs zstandard, br needs brotli"""
+    global _available
+    if _available is None:
+        _available = [e for e in RESPONSE_COMPRESSION if _is_available(e)]
+    return _available
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The preferred available encoding the client accepts, None for no compression"""
+    if not accept_encoding:
+        return None
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in available_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def get_compressor(encoding: str) -> Compressor:
+    level = RESPONSE_COMPRESSION_LEVELS[encoding]
+    if encoding == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if encoding == "br":
+        return _BrotliCompressor(level)
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    compressor = get_compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+async def compress_stream(
+    chunks: typing.AsyncIterable[bytes], encoding: str
+) -> typing.AsyncIterator[bytes]:
+    """Compresses the chunks while they are sent, nothing but the compressor state is kept"""
+    compressor = get_compressor(encoding)
+    async for chunk in chunks:
+        compressed = await anyio.to_thread.run_sync(compressor.compress, chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
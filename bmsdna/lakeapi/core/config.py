@@ -1,5 +1,6 @@
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from typing import (
@@ -38,6 +39,10 @@ if TYPE_CHECKING:
     from azure.core.credentials import TokenCredential
 logger = get_logger(__name__)
 
+WILDCARD_EXPANSION_WORKERS = int(
+    os.getenv("WILDCARD_EXPANSION_WORKERS", "16")
+)  # tables of a "*" config read in parallel
+
 
 @dataclass(frozen=True)
 class BasicConfig:
@@ -54,6 +59,10 @@ class BasicConfig:
     should_hide_col_name: Callable[[str], bool]
     default_copy_local: bool = False
     max_route_init_time: int = 200  # seconds
+    max_execution_time: Optional[float] = None  # seconds, per request
+    route_resolution: Literal["eager", "background", "on_demand"] = "eager"
+    config_reload_interval: Optional[float] = None  # seconds, None disables it
+    flight_location: Optional[str] = None  # eg grpc://0.0.0.0:8815, None disables it
 
 
 def _should_hide_colname(name: str):
@@ -62,6 +71,7 @@ def _should_hide_colname(name: str):
         or "_md5_prefix_" in name
         or "_xxhash64_prefix_" in name
         or "_md5_mod_" in name
+        or "_geohash_prefix_" in name
     )
 
 
@@ -81,6 +91,21 @@ def get_default_config():
         token_retrieval_func=None,
         should_hide_col_name=_should_hide_colname,
         max_route_init_time=200,
+        max_execution_time=(
+            float(os.environ["MAX_EXECUTION_TIME"])
+            if os.getenv("MAX_EXECUTION_TIME")
+            else None
+        ),
+        route_resolution=cast(
+            Literal["eager", "background", "on_demand"],
+            os.getenv("ROUTE_RESOLUTION", "eager"),
+        ),
+        config_reload_interval=(
+            float(os.environ["CONFIG_RELOAD_INTERVAL"])
+            if os.getenv("CONFIG_RELOAD_INTERVAL")
+            else None
+        ),
+        flight_location=os.getenv("FLIGHT_LOCATION") or None,
     )
 
 
@@ -169,6 +194,88 @@ def _to_dict(d: Union[list, dict]):
     return d
 
 
+@dataclass(frozen=True)
+class DeltaSummary:
+    """The parts of the delta metadata a config is created from"""
+
+    configuration: dict
+    partition_columns: list[str]
+
+
+class DeltaSummaryCache:
+    """Delta summaries of the tables of a "*" config, kept in the temp folder for the next start.
+    An entry is only used while the latest commit of the delta log is the same"""
+
+    def __init__(self, basic_config: BasicConfig, folder: str):
+        self.path = os.path.join(
+            basic_config.temp_folder_path,
+            "lakeapi_expand_" + get_md5_hash(folder) + ".json",
+        )
+        self.entries: dict[str, dict] = {}
+        self.used: dict[str, dict] = {}
+        if os.path.exists(self.path):
+            import json
+
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as err:
+                logger.warning(f"Could not read {self.path}: {err}")
+
+    def get(self, key: str, log_key: str) -> Optional[DeltaSummary]:
+        entry = self.entries.get(key)
+        if entry is None or entry["log_key"] != log_key:
+            return None
+        self.used[key] = entry
+        return DeltaSummary(
+            configuration=entry["configuration"],
+            partition_columns=entry["partition_columns"],
+        )
+
+    def set(self, key: str, log_key: str, summary: DeltaSummary):
+        self.used[key] = {"log_key": log_key} | asdict(summary)
+
+    def save(self):
+        """Stores the entries used since loading, tables no longer in the folder are dropped"""
+        import json
+
+        if self.used == self.entries:
+            return
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.used, f)
+        except OSError as err:
+            logger.warning(f"Could not write {self.path}: {err}")
+
+
+def _get_delta_summary(
+    uri: SourceUri, basic_config: BasicConfig, cache: Optional[DeltaSummaryCache]
+) -> Optional[DeltaSummary]:
+    """Reads the delta metadata once, for both config_from_delta and the implicit partition parameters.
+    None if uri is not a readable delta table"""
+    log_key = uri.get_version_key(delta_table=True)
+    if log_key is None:
+        return None
+    if cache is not None and (cached := cache.get(str(uri), log_key)):
+        return cached
+    try:
+        from bmsdna.lakeapi.utils.meta_cache import get_deltalake_meta
+
+        meta = get_deltalake_meta(basic_config.default_engine == "polars", uri)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        logger.warning(f"Error retrieving delta metadata: {uri}\n{err}")
+        return None
+    summary = DeltaSummary(
+        configuration=dict(meta.configuration),
+        partition_columns=list(meta.partition_columns),
+    )
+    if cache is not None:
+        cache.set(str(uri), log_key, summary)
+    return summary
+
+
 @dataclass
 class Config:
     name: str
@@ -185,6 +292,7 @@ class Config:
     engine: Optional[Engines] = None
     chunk_size: Optional[int] = None
     duckdb_backend: Optional[DuckDBBackendConfig] = None
+    max_execution_time: Optional[float] = None  # seconds
 
     def __post_init__(self):
         self.version_str = (
@@ -203,7 +311,13 @@ class Config:
         return "{}({})".format(type(self).__name__, ", ".join(kws))
 
     @classmethod
-    def _from_dict(cls, config: Dict, basic_config: BasicConfig, accounts: dict):
+    def _from_dict(
+        cls,
+        config: Dict,
+        basic_config: BasicConfig,
+        accounts: dict,
+        summary_cache: Optional[DeltaSummaryCache] = None,
+    ):
         name = config["name"]
         tag = config["tag"]
         datasource: dict[str, Any] = config.get("datasource", {})
@@ -224,34 +338,30 @@ class Config:
             accounts=accounts,
             data_path=basic_config.data_path if file_type not in ["odbc"] else None,
         )
+        delta_summary = (
+            _get_delta_summary(uri_obj, basic_config, summary_cache)
+            if file_type == "delta"
+            else None
+        )
         if config.get("config_from_delta"):
             import json
 
             real_path = str(uri_obj)
-            try:
-                from bmsdna.lakeapi.utils.meta_cache import get_deltalake_meta
-
-                meta = get_deltalake_meta(
-                    basic_config.default_engine == "polars", uri_obj
-                )
-                assert meta.last_metadata is not None
-                cfg = json.loads(
-                    _to_dict(meta.last_metadata.get("configuration", {})).get(
-                        "lakeapi.config", "{}"
-                    )
-                )
-                config = (
-                    config | cfg
-                )  # simple merge. in that case we expect config to be in delta mainly
-                datasource = config.get(
-                    "datasource", {"uri": uri, "file_type": file_type}
-                )  # get data source again, could have select, columns etc
-            except json.JSONDecodeError as err:
-                logger.warning(f"Not correct json: {real_path}\n{err}")
-            except FileNotFoundError:
+            if delta_summary is None:
                 logger.warning(f"Not a real delta path: {real_path}")
-            except Exception as err:
-                logger.warning(f"Error reading delta: {real_path}\n{err}")
+            else:
+                try:
+                    cfg = json.loads(
+                        delta_summary.configuration.get("lakeapi.config", "{}")
+                    )
+                    config = (
+                        config | cfg
+                    )  # simple merge. in that case we expect config to be in delta mainly
+                    datasource = config.get(
+                        "datasource", {"uri": uri, "file_type": file_type}
+                    )  # get data source again, could have select, columns etc
+                except json.JSONDecodeError as err:
+                    logger.warning(f"Not correct json: {real_path}\n{err}")
 
         version = config.get("version", 1)
         api_method = cast(Literal["post", "get"], config.get("api_method", "get"))
@@ -272,6 +382,11 @@ class Config:
             if "nearby" in config
             else None
         )
+        duckdb_backend = (
+            DuckDBBackendConfig(**config["duckdb_backend"])
+            if config.get("duckdb_backend")
+            else None
+        )
         logger.debug(config)
 
         _params: list[Param] = []
@@ -310,7 +425,9 @@ class Config:
         )
 
         new_params = _with_implicit_parameters(
-            _params, file_type, uri_obj, basic_config=basic_config
+            _params,
+            delta_summary.partition_columns if delta_summary else [],
+            basic_config=basic_config,
         )
 
         return cls(
@@ -322,9 +439,11 @@ class Config:
             api_method=api_method,
             engine=config.get("engine", None),
             chunk_size=config.get("chunk_size", None),
+            max_execution_time=config.get("max_execution_time", None),
             params=new_params,  # type: ignore
             allow_get_all_pages=config.get("allow_get_all_pages", False),
             datasource=datasource_obj,
+            duckdb_backend=duckdb_backend,
         )
 
     @classmethod
@@ -355,7 +474,7 @@ class Config:
                 logger.warning("Path not existing: " + fs_path)
                 return []
             else:
-                ls = []
+                config_subs = []
                 for it in fs.ls(fs_path, detail=True):
                     fullname: str = it["name"]
                     type: Literal["file", "directory"] = it["type"]
@@ -378,7 +497,20 @@ class Config:
                         (type == "directory" and file_type == "delta")
                         or (it == "file" and file_type != "delta")
                     ):
-                        ls.append(cls._from_dict(config_sub, basic_config, accounts))
+                        config_subs.append(config_sub)
+                summary_cache = DeltaSummaryCache(basic_config, str(suri))
+                with ThreadPoolExecutor(
+                    max_workers=WILDCARD_EXPANSION_WORKERS
+                ) as executor:
+                    ls = list(
+                        executor.map(
+                            lambda c: cls._from_dict(
+                                c, basic_config, accounts, summary_cache
+                            ),
+                            config_subs,
+                        )
+                    )
+                summary_cache.save()
             return ls
         else:
             return [cls._from_dict(config, basic_config, accounts)]
@@ -430,6 +562,20 @@ class Configs:
         for i in self.configs:
             yield i
 
+    @staticmethod
+    def get_yaml_files(
+        root: str = "config",
+        exclude_internal: bool = True,
+        internal_pattern: str = "_",
+    ) -> list[str]:
+        if re.search(r"\.ya?ml$", root):
+            return [root]
+        return [
+            os.path.join(root, file)
+            for file in os.listdir(root)
+            if not file.startswith(internal_pattern) or not exclude_internal
+        ]
+
     @classmethod
     def from_yamls(
         cls,
@@ -438,14 +584,7 @@ class Configs:
         exclude_internal: bool = True,
         internal_pattern: str = "_",
     ):
-        if re.search(r"\.ya?ml$", root):
-            files = [root]
-        else:
-            files = [
-                os.path.join(root, file)
-                for file in os.listdir(root)
-                if not file.startswith(internal_pattern) or not exclude_internal
-            ]
+        files = cls.get_yaml_files(root, exclude_internal, internal_pattern)
 
         tables = []
         users = []
@@ -23,6 +23,7 @@ from bmsdna.lakeapi.context.df_base import ExecutionContext, ResultData
 from bmsdna.lakeapi.core.config import (
     BasicConfig,
     DatasourceConfig,
+    DuckDBBackendConfig,
     Param,
     SelectColumn,
 )
@@ -103,6 +104,12 @@ def to_pyarrow_schema(schema: DataType) -> pa.DataType:
     raise ValueError(f"unknown complex type {schema}")
 
 
+def get_unique_table_name(version: str, tag: str, name: str):
+    if version in ["1", "v1"]:
+        return tag + "_" + name
+    return tag + "_" + name + "_" + version
+
+
 class Datasource:
     def __init__(
         self,
@@ -115,6 +122,7 @@ class Datasource:
         sql_context: ExecutionContext,
         basic_config: BasicConfig,
         df: Optional[ResultData] = None,
+        duckdb_backend: Optional[DuckDBBackendConfig] = None,
     ) -> None:
         self.version = version
         self.config = config
@@ -137,6 +145,9 @@ class Datasource:
         )
         self._execution_uri = None
         self.source_uri = base_source_uri
+        self.duckdb_backend = (
+            duckdb_backend if duckdb_backend and duckdb_backend.enable else None
+        )
 
     def __str__(self) -> str:
         return str(self.source_uri)
@@ -171,6 +182,32 @@ class Datasource:
             self._execution_uri = local_uri
         return self._execution_uri
 
+    def get_replica_uri(self) -> Optional[SourceUri]:
+        """Returns the uri of the local DuckDB replica, if one is configured and usable with the current engine"""
+        if self.duckdb_backend is None or self.sql_context.engine_name != "duckdb":
+            return None
+        from bmsdna.lakeapi.context.duckdb_replica import get_replica_path
+
+        db_path = os.path.join(
+            self.basic_config.local_data_cache_path, self.duckdb_backend.db_path
+        )
+        try:
+            get_replica_path(
+                self.duckdb_backend,
+                db_path,
+                self.unique_table_name,
+                self.tablename,
+                self.get_execution_uri(False),
+                self.config.file_type,
+            )
+        except Exception as err:
+            logger.warning(
+                f"Could not create replica {db_path}, using source: {err}",
+                exc_info=err,
+            )
+            return None
+        return SourceUri(db_path, None, {}, None)
+
     def file_exists(self):
         if self.config.file_type in ["odbc", "sqlite"]:
             return True  # the uri is not really a file here
@@ -205,9 +242,7 @@ class Datasource:
 
     @property
     def unique_table_name(self):
-        if self.version in ["1", "v1"]:
-            return self.tag + "_" + self.name
-        return self.tag + "_" + self.name + "_" + self.version
+        return get_unique_table_name(self.version, self.tag, self.name)
 
     def get_table_name(self, force_unique_name: bool) -> ex.Table:
         tname = self.tablename if not force_unique_name else self.unique_table_name
@@ -265,6 +300,27 @@ class Datasource:
                 else query
             )
 
+            replica_uri = self.get_replica_uri() if endpoint != "meta" else None
+            if replica_uri is not None:
+                view_name = (
+                    self.tablename
+                    if "." not in self.tablename
+                    else self.unique_table_name  # eg dbo.table of odbc sources
+                )
+                query = select("*").from_(ex.table_(view_name))
+                self.query = (
+                    select_df(query, self.config.select, self.config.exclude or [])
+                    if endpoint != "query"
+                    else query
+                )
+                self.sql_context.register_datasource(
+                    view_name,
+                    self.unique_table_name,
+                    replica_uri,
+                    "duckdb",
+                    filters=None,
+                )
+                self.df = self.sql_context.execute_sql(self.query)
             if self.df is None:
                 self.sql_context.register_datasource(
                     self.unique_table_name if unique_table_name else self.tablename,
@@ -1,7 +1,7 @@
 # pyright: reportUndefinedVariable=false, reportGeneralTypeIssues=false
 
 import datetime
-from typing import Any, Dict, List, Literal, Union, cast, Optional, Iterable
+from typing import Any, Callable, Dict, List, Literal, Union, cast, Optional, Iterable
 from fastapi import Query
 from pydantic import ConfigDict, BaseModel, create_model
 from pydantic.fields import FieldInfo
@@ -12,6 +12,20 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# by fingerprint, shared by all routes with the same schema and params
+_models: dict[tuple, type[BaseModel]] = {}
+
+
+def _intern_model(key: tuple, create: Callable[[], type[BaseModel]]):
+    model = _models.get(key)
+    if model is None:
+        model = _models.setdefault(key, create())
+    return model
+
+
+def _schema_fingerprint(schema: Optional[pa.Schema]):
+    return None if schema is None else tuple((f.name, f.type) for f in schema)
+
 
 def _make_model(v, name):
     if type(v) is dict:
@@ -94,17 +108,15 @@ def get_schema_for(
             )
             for ind in range(0, st.num_fields)
         }
-        return (
-            Union[
-                create_model(
-                    model_ns + ("_" + field_name if field_name else ""),
-                    **res,  # type: ignore
-                    __base__=TypeBaseModel,
-                ),
-                None,
-            ],
-            None,
+        model = _intern_model(
+            ("struct", st),
+            lambda: create_model(
+                model_ns + ("_" + field_name if field_name else ""),
+                **res,  # type: ignore
+                __base__=TypeBaseModel,
+            ),
         )
+        return (Union[model, None], None)
     if pa.types.is_list(field_type) or pa.types.is_large_list(field_type):
         if cast(pa.ListType, field_type).value_type is None:
             return (Union[List[Any], None], [])
@@ -176,9 +188,32 @@ def create_parameter_model(
     nearby: Optional[Iterable[NearbyConfig]],
     apimethod: Literal["get", "post"],
 ):
-    query_params: dict[str, tuple[str, Any]] = {}
     if not params and not search and not nearby:
         return empty_model
+    return _intern_model(
+        (
+            "parameter",
+            _schema_fingerprint(schema),
+            repr(list(params or [])),
+            repr(list(search or [])),
+            repr(list(nearby or [])),
+            apimethod,
+        ),
+        lambda: _create_parameter_model(
+            schema, name, params, search, nearby, apimethod
+        ),
+    )
+
+
+def _create_parameter_model(
+    schema: Optional[pa.Schema],
+    name: str,
+    params: Optional[Iterable[Union[Param, str]]],
+    search: Optional[Iterable[SearchConfig]],
+    nearby: Optional[Iterable[NearbyConfig]],
+    apimethod: Literal["get", "post"],
+):
+    query_params: dict[str, tuple[str, Any]] = {}
     for param in params or []:
         param = Param(name=param) if isinstance(param, str) else param
         operators = param.operators or ["="]
@@ -245,10 +280,15 @@ def create_response_model(
     schema: pa.Schema,
     basic_config: BasicConfig,
 ) -> type[BaseModel]:
-    props = {
-        k: get_schema_for(name, schema.field(k).name, schema.field(k).type)
-        for k in schema.names
-        if not basic_config.should_hide_col_name(k)
-    }
+    names = [k for k in schema.names if not basic_config.should_hide_col_name(k)]
+
+    def _create():
+        props = {
+            k: get_schema_for(name, schema.field(k).name, schema.field(k).type)
+            for k in names
+        }
+        return create_model(name, **props, __base__=TypeBaseModel)  # type: ignore
 
-    return create_model(name, **props, __base__=TypeBaseModel)  # type: ignore
+    return _intern_model(
+        ("response", tuple((k, schema.field(k).type) for k in names)), _create
+    )
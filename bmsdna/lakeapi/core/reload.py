@@ -0,0 +1,60 @@
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from bmsdna.lakeapi.core.config import BasicConfig, Configs
+from bmsdna.lakeapi.core.log import get_logger
+
+if TYPE_CHECKING:
+    from bmsdna.lakeapi.core.route import LakeApiRoutes
+
+logger = get_logger(__name__)
+
+
+class ConfigReloader:
+    """Polls the config files and applies changes to the running app. Routes of unchanged configs
+    are kept, and so are the caches of their tables"""
+
+    def __init__(self, routes: "LakeApiRoutes", basic_config: BasicConfig, root: str):
+        self.routes = routes
+        self.basic_config = basic_config
+        self.root = root
+        self._signature = self._get_signature()
+        self._stop = threading.Event()
+
+    def _get_signature(self):
+        return sorted(
+            (file, os.path.getmtime(file))
+            for file in Configs.get_yaml_files(self.root)
+            if os.path.exists(file)
+        )
+
+    def check(self) -> bool:
+        """Reloads the configs if the files changed since the last check. Returns whether they were reloaded"""
+        signature = self._get_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            configs = Configs.from_yamls(self.basic_config, self.root)
+        except Exception as err:
+            logger.error(
+                f"Could not reload {self.root}, keeping the current config. Error:{err}",
+                exc_info=err,
+            )
+            return False
+        self.routes.apply_configs(configs)
+        return True
+
+    def start(self, interval: float):
+        def _watch():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception as err:
+                    logger.error(f"Config reload failed. Error:{err}", exc_info=err)
+
+        threading.Thread(target=_watch, name="config_reload", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
@@ -1,16 +1,27 @@
+import codecs
 import hashlib
+import math
 import mimetypes
 import os
 import tempfile
 from enum import Enum
-from typing import Union
+from time import monotonic
+from typing import Awaitable, Callable, Optional, TypeVar, Union
 from uuid import uuid4
 import pyarrow as pa
 from starlette.background import BackgroundTask
 from starlette.datastructures import URL, QueryParams
 from starlette.responses import Response, StreamingResponse
 from email.utils import formatdate
+from fastapi import HTTPException
 from bmsdna.lakeapi.context.df_base import ExecutionContext, ResultData
+from bmsdna.lakeapi.core.compression import (
+    RESPONSE_COMPRESSION_MIN_SIZE,
+    available_encodings,
+    compress,
+    compress_stream,
+    negotiate_encoding,
+)
 from bmsdna.lakeapi.core.config import BasicConfig
 from bmsdna.lakeapi.core.log import get_logger
 from bmsdna.lakeapi.core.types import OutputFileType
@@ -20,11 +31,19 @@ from mimetypes import guess_type
 from starlette.concurrency import iterate_in_threadpool
 import sqlglot.expressions as ex
 import anyio
+import anyio.to_thread
 
 from bmsdna.lakeapi.utils.async_utils import _async
 
 logger = get_logger(__name__)
 
+DISCONNECT_CHECK_INTERVAL = float(
+    os.getenv("DISCONNECT_CHECK_INTERVAL", "0.5")
+)  # in seconds
+
+T = TypeVar("T")
+ArrowCompression = typing.Literal["zstd", "lz4"]
+
 
 class OutputFormats(Enum):
     CSV = 2
@@ -91,83 +110,106 @@ async def _write_frame(
     out: str,
     basic_config: BasicConfig,
     csv_separator: str | None = None,
-    charset: str = "utf-8",
-) -> list[str]:
+    parquet_compression: str = "snappy",
+    parquet_compression_level: Optional[int] = None,
+    arrow_compression: Optional[ArrowCompression] = None,
+):
+    """Writes content to out, text formats are always written as utf-8"""
     if csv_separator == "\\t":
         csv_separator = "\t"
-    is_utf_8 = charset.lower() == "utf-8"
     if format == OutputFormats.CSV:
-        await _async(
-            content.write_csv(
-                out + ("" if is_utf_8 else "_u8"), separator=csv_separator or ","
-            )
-        )
+        await _async(content.write_csv(out, separator=csv_separator or ","))
     elif format == OutputFormats.SEMI_CSV:
-        await _async(
-            content.write_csv(
-                out + ("" if is_utf_8 else "_u8"), separator=csv_separator or ";"
-            )
-        )
-    elif format == OutputFormats.CSV4EXCEL:  # need to write sep=, on first line
-        await _async(
-            content.write_csv(
-                out + ("" if is_utf_8 else "_u8"), separator=csv_separator or ","
-            )
-        )
+        await _async(content.write_csv(out, separator=csv_separator or ";"))
+    elif format == OutputFormats.CSV4EXCEL:
+        await _async(content.write_csv(out, separator=csv_separator or ","))
 
     elif format == OutputFormats.XLSX:
-        import polars as pl
-
-        ds = pl.from_arrow(await _async(content.to_arrow_recordbatch()))
-        assert isinstance(ds, pl.DataFrame)
-        ds.write_excel(out, autofit=True)
-        is_utf_8 = True
-    elif format == OutputFormats.HTML:
-        (await _async(content.to_pandas())).to_html(
-            out + ("" if is_utf_8 else "_u8"), index=False
-        )
+        from bmsdna.lakeapi.utils.xlsx import write_xlsx
 
-    elif format == OutputFormats.XML:
-        (await _async(content.to_pandas())).to_xml(
-            out + ("" if is_utf_8 else "_u8"), index=False, parser="etree"
-        )
+        with await _async(content.to_arrow_recordbatch(content.chunk_size)) as batches:
+            await anyio.to_thread.run_sync(write_xlsx, batches, out)
+    elif format in (OutputFormats.HTML, OutputFormats.XML):
+        from bmsdna.lakeapi.utils.markup import write_html, write_xml
+
+        with await _async(content.to_arrow_recordbatch(content.chunk_size)) as batches:
+            await anyio.to_thread.run_sync(
+                write_html if format == OutputFormats.HTML else write_xml,
+                batches,
+                out,
+            )
 
     elif format == OutputFormats.ARROW_IPC:
-        is_utf_8 = True
         with await _async(content.to_arrow_recordbatch(content.chunk_size)) as batches:
             with pa.OSFile(out, "wb") as sink:
-                with pa.ipc.new_file(sink, batches.schema) as writer:
+                with pa.ipc.new_file(
+                    sink,
+                    batches.schema,
+                    options=pa.ipc.IpcWriteOptions(compression=arrow_compression),
+                ) as writer:
                     for batch in batches:
                         writer.write(batch)
 
     elif format == OutputFormats.ARROW_STREAM:
-        is_utf_8 = True
         with await _async(content.to_arrow_recordbatch(content.chunk_size)) as batches:
             with pa.OSFile(out, "wb") as sink:
-                with pa.ipc.new_stream(sink, batches.schema) as writer:
+                with pa.ipc.new_stream(
+                    sink,
+                    batches.schema,
+                    options=pa.ipc.IpcWriteOptions(compression=arrow_compression),
+                ) as writer:
                     for batch in batches:
                         writer.write_batch(batch)
 
     elif format == OutputFormats.ND_JSON:
-        await _async(content.write_nd_json(out + ("" if is_utf_8 else "_u8")))
+        await _async(content.write_nd_json(out))
     elif format == OutputFormats.PARQUET:
-        await _async(content.write_parquet(out))
-        is_utf_8 = True
+        await _async(
+            content.write_parquet(
+                out,
+                compression=parquet_compression,
+                compression_level=parquet_compression_level,
+            )
+        )
     else:
-        await content.write_json(out + ("" if is_utf_8 else "_u8"))
-    if not is_utf_8:
-        with (
-            open(out, mode="wb") as f
-        ):  # excel wants utf-16le which polars does not support. therefore we need reencoding
-            if format == OutputFormats.CSV4EXCEL:
-                f.write(b"sep=,\n")  # add utf-8 bom at beginning
-            with open(out + "_u8", mode="r", encoding="utf-8") as c8:
-                line = c8.readline()
-                while line != "":
-                    f.write(line.encode(charset))
-                    line = c8.readline()
-            return [out + "_u8"]
-    return []
+        await content.write_json(out)
+
+
+BINARY_FORMATS = (
+    OutputFormats.XLSX,
+    OutputFormats.ARROW_IPC,
+    OutputFormats.ARROW_STREAM,
+    OutputFormats.PARQUET,
+    OutputFormats.ORC,
+)
+COMPRESSED_FORMATS = (
+    OutputFormats.XLSX,
+    OutputFormats.PARQUET,
+    OutputFormats.ORC,
+)  # not compressed again for the http response
+PARQUET_COMPRESSIONS = ("none", "snappy", "gzip", "brotli", "zstd", "lz4")
+PARQUET_COMPRESSION_LEVELS = {
+    "gzip": (1, 9),
+    "brotli": (0, 11),
+    "zstd": (1, 22),
+}  # the codecs supporting a level, and its range
+ARROW_COMPRESSIONS: tuple[ArrowCompression, ...] = ("zstd", "lz4")
+
+
+async def transcode(
+    chunks: typing.AsyncIterable[bytes], charset: str, preamble: bytes = b""
+) -> typing.AsyncIterator[bytes]:
+    """Re-encodes the utf-8 chunks to charset, chunk by chunk. A character split between chunks is
+    kept back until the next one. Characters not available in charset are replaced"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    encoder = codecs.getincrementalencoder(charset)(errors="replace")
+    if preamble:
+        yield preamble
+    async for chunk in chunks:
+        encoded = encoder.encode(decoder.decode(chunk))
+        if encoded:
+            yield encoded
+    yield encoder.encode(decoder.decode(b"", final=True), final=True)
 
 
 Content = typing.Union[str, bytes]
@@ -264,6 +306,124 @@ def get_temp_file(extension: str):
     return temp_file
 
 
+class QueryInterrupted(Exception):
+    def __init__(self, reason: typing.Literal["timeout", "disconnect"]) -> None:
+        self.reason = reason
+        super().__init__(reason)
+
+
+async def run_interruptible(
+    context: ExecutionContext,
+    work: Callable[[], Awaitable[T]],
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+    timeout: Optional[float],
+) -> T:
+    """Runs work while watching for a client disconnect and the timeout. If one of them happens,
+    the queries of the context are interrupted and QueryInterrupted is raised.
+    The queries are also interrupted if the caller is cancelled"""
+    if is_disconnected is None and timeout is None:
+        return await work()
+    start = monotonic()
+    reason: list[typing.Literal["timeout", "disconnect"]] = []
+    # emptied once work is done, so the watcher does not keep the context alive
+    running: list[ExecutionContext] = [context]
+
+    async def _watch():
+        try:
+            while True:
+                wait = DISCONNECT_CHECK_INTERVAL
+                if timeout is not None:
+                    wait = min(wait, max(timeout - (monotonic() - start), 0))
+                await anyio.sleep(wait)
+                if timeout is not None and monotonic() - start >= timeout:
+                    reason.append("timeout")
+                    break
+                if is_disconnected is not None and await is_disconnected():
+                    reason.append("disconnect")
+                    break
+        except anyio.get_cancelled_exc_class():
+            for ctx in running:  # eg the response got cancelled by starlette
+                ctx.interrupt()
+            raise
+        for ctx in running:
+            ctx.interrupt()
+
+    result = None
+    error = None
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(_watch)
+        try:
+            result = await work()
+        except Exception as err:
+            error = err
+        finally:
+            running.clear()
+            tg.cancel_scope.cancel()
+    if error is not None:
+        try:
+            if reason:
+                raise QueryInterrupted(reason[0]) from error
+            raise error
+        finally:
+            error = None  # breaks the cycle frame -> error -> traceback -> frame
+    return typing.cast(T, result)
+
+
+def _get_timeout(query_params: QueryParams, max_execution_time: Optional[float]):
+    timeout = query_params.get("$timeout", None)
+    if timeout is None:
+        return max_execution_time
+    try:
+        timeout = float(timeout)
+    except ValueError:
+        timeout = math.nan
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise HTTPException(400, "$timeout must be a positive number of seconds")
+    if max_execution_time is not None:
+        return min(timeout, max_execution_time)
+    return timeout
+
+
+def _get_parquet_compression(query_params: QueryParams):
+    compression = query_params.get("$parquet_compression", "snappy").lower()
+    if compression not in PARQUET_COMPRESSIONS:
+        raise HTTPException(
+            400,
+            f"$parquet_compression must be one of {', '.join(PARQUET_COMPRESSIONS)}",
+        )
+    level = query_params.get("$parquet_compression_level", None)
+    if level is None:
+        return compression, None
+    if compression not in PARQUET_COMPRESSION_LEVELS:
+        raise HTTPException(
+            400,
+            f"$parquet_compression_level is only supported for {', '.join(PARQUET_COMPRESSION_LEVELS)}",
+        )
+    min_level, max_level = PARQUET_COMPRESSION_LEVELS[compression]
+    try:
+        level = int(level)
+    except ValueError:
+        level = None
+    if level is None or not min_level <= level <= max_level:
+        raise HTTPException(
+            400,
+            f"$parquet_compression_level must be an integer from {min_level} to {max_level} for {compression}",
+        )
+    return compression, level
+
+
+def _get_arrow_compression(query_params: QueryParams) -> Optional[ArrowCompression]:
+    compression = query_params.get("$arrow_compression", None)
+    if not compression:
+        return None
+    for c in ARROW_COMPRESSIONS:
+        if c == compression.lower():
+            return c
+    raise HTTPException(
+        400, f"$arrow_compression must be one of {', '.join(ARROW_COMPRESSIONS)}"
+    )
+
+
 async def create_response(
     url: URL,
     query_params: QueryParams,
@@ -273,11 +433,78 @@ async def create_response(
     basic_config: BasicConfig,
     charset: str | None = None,
     close_context=False,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    max_execution_time: Optional[float] = None,
+    accept_encoding: Optional[str] = None,
+):
+    """Executes sql and returns the result in the requested format. The execution is interrupted
+    once is_disconnected returns True or the timeout ($timeout, at most max_execution_time) is exceeded.
+    The response is compressed with the best encoding of accept_encoding, unless the format already is compressed"""
+    timeout = _get_timeout(query_params, max_execution_time)
+    streaming = False
+    try:
+        response = await _create_response(
+            url,
+            query_params,
+            accept,
+            context,
+            sql,
+            basic_config,
+            charset,
+            close_context,
+            is_disconnected,
+            timeout,
+            accept_encoding,
+        )
+        # a streamed response closes the context in its background task, once it is sent
+        streaming = isinstance(response, StreamingResponseWCharset)
+        return response
+    except QueryInterrupted as err:
+        if err.reason == "timeout":
+            logger.warning(f"Query exceeded {timeout}s and was cancelled: {url}")
+            raise HTTPException(
+                504, f"Query exceeded the maximum execution time of {timeout}s"
+            )
+        logger.info(f"Client disconnected, query was cancelled: {url}")
+        return Response(status_code=499)  # client closed request
+    finally:
+        if close_context and not streaming:
+            context.close()
+
+
+async def _create_response(
+    url: URL,
+    query_params: QueryParams,
+    accept: str,
+    context: ExecutionContext,
+    sql: ex.Query | str,
+    basic_config: BasicConfig,
+    charset: str | None,
+    close_context: bool,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+    timeout: Optional[float],
+    accept_encoding: Optional[str],
 ):
     headers = {}
     format, extension = await parse_format(accept)
+    parquet_compression, parquet_compression_level = _get_parquet_compression(
+        query_params
+    )
+    arrow_compression = _get_arrow_compression(query_params)
+    encoding = None
+    if format not in COMPRESSED_FORMATS and not (
+        arrow_compression
+        and format in (OutputFormats.ARROW_IPC, OutputFormats.ARROW_STREAM)
+    ):
+        if available_encodings():
+            headers["Vary"] = "Accept-Encoding"
+        encoding = negotiate_encoding(accept_encoding)
 
     charset = charset or ("utf-16-le" if format == OutputFormats.CSV4EXCEL else "utf-8")
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        raise HTTPException(400, f"Unknown encoding {charset}")
 
     content_dispositiont_type = "attachment"
     filename = "file" + extension
@@ -287,17 +514,36 @@ async def create_response(
         else mimetypes.guess_type("file" + extension)[0]
     )
 
+    async def _compressed(content: Union[str, bytes]):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        if encoding is None or len(content) < RESPONSE_COMPRESSION_MIN_SIZE:
+            return content
+        headers["Content-Encoding"] = encoding
+        return await anyio.to_thread.run_sync(compress, content, encoding)
+
     if format == OutputFormats.JSON:
         with context.execute_sql(sql) as res:
             return Response(
-                content=await _async(res.to_json()),
+                content=await _compressed(
+                    await run_interruptible(
+                        context, lambda: _async(res.to_json()), is_disconnected, timeout
+                    )
+                ),
                 headers=headers,
                 media_type=(media_type or "application/json") + "; charset=" + charset,
             )
     if format == OutputFormats.ND_JSON:
         with context.execute_sql(sql) as res:
             return Response(
-                content=await _async(res.to_ndjson()),
+                content=await _compressed(
+                    await run_interruptible(
+                        context,
+                        lambda: _async(res.to_ndjson()),
+                        is_disconnected,
+                        timeout,
+                    )
+                ),
                 headers=headers,
                 media_type="application/json-nd; charset=" + charset,
             )
@@ -314,19 +560,22 @@ async def create_response(
 
     temp_file = get_temp_file(extension)
 
-    async def response_stream(context: ExecutionContext, sql, url, format):
-        chunk_size = 64 * 1024
+    async def write_file():
         with context.execute_sql(sql) as content:
-            additional_files = await _write_frame(
+            await _write_frame(
                 url,
                 content,
                 format,
                 temp_file.name,
                 basic_config,
                 query_params.get("$csv_separator", None),
-                charset,
+                parquet_compression,
+                parquet_compression_level,
+                arrow_compression,
             )
 
+    async def response_stream():
+        chunk_size = 64 * 1024
         async with await anyio.open_file(temp_file.name, mode="rb") as file:
             more_body = True
             while more_body:
@@ -342,8 +591,26 @@ async def create_response(
         except FileNotFoundError:
             pass
 
+    try:
+        # written before the response starts, so a timeout can still be reported
+        await run_interruptible(context, write_file, is_disconnected, timeout)
+    except BaseException:
+        clean_up()
+        raise
+
+    stream = response_stream()
+    if format not in BINARY_FORMATS and codecs.lookup(charset).name != "utf-8":
+        # sep= tells excel the separator
+        preamble = b"sep=,\n" if format == OutputFormats.CSV4EXCEL else b""
+        stream = transcode(stream, charset, preamble)
+    if (
+        encoding is not None
+        and os.path.getsize(temp_file.name) >= RESPONSE_COMPRESSION_MIN_SIZE
+    ):
+        stream = compress_stream(stream, encoding)
+        headers["Content-Encoding"] = encoding
     return StreamingResponseWCharset(
-        content=response_stream(context, sql, url, format),
+        content=stream,
         headers=headers,
         media_type=media_type,
         content_disposition_type=content_dispositiont_type,
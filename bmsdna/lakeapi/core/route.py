@@ -1,142 +1,514 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import os
+import threading
 from time import time
-from typing import Literal, Tuple, cast
+from typing import Literal, Optional, Tuple, cast, TYPE_CHECKING
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import BaseRoute, Match
 from bmsdna.lakeapi.context import ExecutionContextManager
 
-from bmsdna.lakeapi.core.config import BasicConfig, Configs
+from bmsdna.lakeapi.core.config import BasicConfig, Config, Configs, get_md5_hash
 from bmsdna.lakeapi.core.log import get_logger
 
 
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from fastapi import FastAPI
+    from starlette.routing import Router
+    from bmsdna.lakeapi.endpoint.sql_endpoint import SqlTableCatalog
+    from bmsdna.lakeapi.core.datasource import Datasource
+
 logger = get_logger(__name__)
 
 all_lake_api_routers: list[Tuple[BasicConfig, Configs]] = []
 
 
-def init_routes(configs: Configs, basic_config: BasicConfig):
-    from bmsdna.lakeapi.endpoint.endpoint import (
-        get_response_model,
-        create_config_endpoint,
+def _warm_search_index(realdataframe: "Datasource", config: Config):
+    """Starts building the search index in the background, so that the first search does not have to"""
+    from bmsdna.lakeapi.context.df_duckdb import schedule_search_index_build
+
+    assert config.datasource is not None and config.search is not None
+    if realdataframe.sql_context.engine_name != "duckdb":
+        return
+    if not realdataframe.file_exists():
+        return
+    uri = realdataframe.get_execution_uri(False)
+    modified_date = realdataframe.sql_context.get_modified_date(
+        uri, config.datasource.file_type
     )
-    from bmsdna.lakeapi.endpoint.detail_endpoint import create_detailed_meta_endpoint
-    from bmsdna.lakeapi.endpoint.sql_endpoint import create_sql_endpoint
+    if modified_date is None:
+        return
+    schedule_search_index_build(
+        realdataframe.tablename,
+        realdataframe.tablename,
+        uri,
+        config.datasource.file_type,
+        config.search,
+        modified_date,
+    )
+
+
+ROUTE_INIT_WORKERS = int(os.getenv("ROUTE_INIT_WORKERS", "16"))
+ROUTE_INIT_WORKERS_PER_ACCOUNT = int(
+    os.getenv("ROUTE_INIT_WORKERS_PER_ACCOUNT", "8")
+)  # concurrent schema requests to the same storage account
+
+
+def _discover_schema(
+    config: Config,
+    configs: Configs,
+    basic_config: BasicConfig,
+    mgr: ExecutionContextManager,
+) -> "Tuple[Optional[pa.Schema], Optional[dict]]":
+    """Returns the schema and the metadata entry of a route"""
+    from bmsdna.lakeapi.core.datasource import Datasource
     from bmsdna.lakeapi.core.schema_cache import get_schema_cached
 
-    all_lake_api_routers.append((basic_config, configs))
-    router = APIRouter()
-    metadata = []
-    now_time = time()
-    with ExecutionContextManager(
-        basic_config.default_engine,
-        basic_config.default_chunk_size,
-    ) as mgr:
-        for config in configs:
-            methods = (
-                cast(list[Literal["get", "post"]], [config.api_method])
-                if isinstance(config.api_method, str)
-                else config.api_method
-            )
-            if time() - now_time > basic_config.max_route_init_time:
+    methods = _get_methods(config)
+    try:
+        assert config.datasource is not None
+        with Datasource(
+            config.version_str,
+            config.tag,
+            config.name,
+            config=config.datasource,
+            sql_context=mgr.get_context(config.engine),
+            basic_config=basic_config,
+            accounts=configs.accounts,
+        ) as realdataframe:
+            try:
+                schema = get_schema_cached(
+                    basic_config,
+                    realdataframe,
+                    config.datasource.get_unique_hash(),
+                )
+                if schema is None:
+                    logger.warning(
+                        f"Could not get response type for {config.route}. Path does not exist:{realdataframe}"
+                    )
+            except Exception as err:
                 logger.warning(
-                    f"Route initialization time exceeded {basic_config.max_route_init_time}s. Stopping further route initialization."
+                    f"Could not get schema for {config.route}. Error:{err}",
+                    exc_info=err,
                 )
                 schema = None
-            else:
+            if config.search and schema is not None:
                 try:
-                    from bmsdna.lakeapi.core.datasource import Datasource
-
-                    assert config.datasource is not None
-                    with Datasource(
-                        config.version_str,
-                        config.tag,
-                        config.name,
-                        config=config.datasource,
-                        sql_context=mgr.get_context(config.engine),
-                        basic_config=basic_config,
-                        accounts=configs.accounts,
-                    ) as realdataframe:
-                        try:
-                            schema = get_schema_cached(
-                                basic_config,
-                                realdataframe,
-                                config.datasource.get_unique_hash(),
-                            )
-                            if schema is None:
-                                logger.warning(
-                                    f"Could not get response type for {config.route}. Path does not exist:{realdataframe}"
-                                )
-                        except Exception as err:
-                            logger.warning(
-                                f"Could not get schema for {config.route}. Error:{err}",
-                                exc_info=err,
-                            )
-                            schema = None
-
-                    metadata.append(
-                        {
-                            "name": config.name,
-                            "tag": config.tag,
-                            "route": config.route,
-                            "methods": methods,
-                            "file_type": config.datasource.file_type,
-                            "uri": config.datasource.uri,
-                            "version": config.version,
-                            "schema": {
-                                n: str(schema.field(n).type) for n in schema.names
-                            }
-                            if schema
-                            else None,
-                        }
+                    _warm_search_index(realdataframe, config)
+                except Exception as err:
+                    logger.warning(
+                        f"Could not start building search index for {config.route}. Error:{err}",
+                        exc_info=err,
                     )
 
-                except Exception as err:
-                    import traceback
+        return schema, {
+            "name": config.name,
+            "tag": config.tag,
+            "route": config.route,
+            "methods": methods,
+            "file_type": config.datasource.file_type,
+            "uri": config.datasource.uri,
+            "version": config.version,
+            "schema": {n: str(schema.field(n).type) for n in schema.names}
+            if schema
+            else None,
+        }
+    except Exception as err:
+        import traceback
+
+        print(traceback.format_exc())
+        logger.warning(f"Could not get response type for f{config.route}. Error:{err}")
+        return None, None
+
+
+def discover_schemas(
+    configs: Configs, basic_config: BasicConfig
+) -> "list[Tuple[Optional[pa.Schema], Optional[dict]]]":
+    """Gets the schemas of all configs in parallel, at most ROUTE_INIT_WORKERS_PER_ACCOUNT at a time per storage account.
+    Configs not done within max_route_init_time get no schema"""
+    deadline = time() + basic_config.max_route_init_time
+    account_limits: dict[Optional[str], threading.Semaphore] = {}
+    managers: list[ExecutionContextManager] = []
+    local = threading.local()
+    lock = threading.Lock()
+
+    def _get_manager():
+        mgr = getattr(local, "mgr", None)
+        if mgr is None:
+            mgr = ExecutionContextManager(
+                basic_config.default_engine,
+                basic_config.default_chunk_size,
+            )
+            local.mgr = mgr
+            with lock:
+                managers.append(mgr)
+        return mgr
+
+    def _discover(config: Config):
+        account = config.datasource.account if config.datasource else None
+        with lock:
+            if account not in account_limits:
+                account_limits[account] = threading.Semaphore(
+                    ROUTE_INIT_WORKERS_PER_ACCOUNT
+                )
+            limit = account_limits[account]
+        with limit:
+            if time() > deadline:
+                return None, None
+            return _discover_schema(config, configs, basic_config, _get_manager())
+
+    executor = ThreadPoolExecutor(ROUTE_INIT_WORKERS, thread_name_prefix="route_init")
+    futures = [executor.submit(_discover, config) for config in configs]
+    _, not_done = wait(futures, timeout=max(deadline - time(), 0))
+    if not_done:
+        logger.warning(
+            f"Route initialization time exceeded {basic_config.max_route_init_time}s. {len(not_done)} routes get no schema."
+        )
+
+    def _close():
+        from bmsdna.lakeapi.core.schema_cache import get_schema_catalog
+
+        executor.shutdown(wait=True, cancel_futures=True)
+        for mgr in managers:
+            mgr.__exit__()
+        if catalog := get_schema_catalog(basic_config):
+            catalog.save()
+
+    if not_done:
+        threading.Thread(target=_close, name="route_init_close", daemon=True).start()
+    else:
+        _close()
+    return [
+        fut.result() if fut.done() and not fut.cancelled() else (None, None)
+        for fut in futures
+    ]
+
+
+def _create_routes(
+    router: APIRouter,
+    config: Config,
+    configs: Configs,
+    basic_config: BasicConfig,
+    schema: "Optional[pa.Schema]",
+):
+    from bmsdna.lakeapi.endpoint.endpoint import (
+        get_response_model,
+        create_config_endpoint,
+    )
+    from bmsdna.lakeapi.endpoint.detail_endpoint import create_detailed_meta_endpoint
+
+    response_model = (
+        get_response_model(
+            config=config,
+            schema=schema,
+            basic_config=basic_config,
+        )
+        if schema is not None
+        else None
+    )
+    create_detailed_meta_endpoint(
+        schema=schema,
+        config=config,
+        configs=configs,
+        router=router,
+        basic_config=basic_config,
+    )
+    for am in _get_methods(config):
+        create_config_endpoint(
+            apimethod=am,
+            config=config,
+            router=router,
+            response_model=response_model,
+            schema=schema,
+            basic_config=basic_config,
+            configs=configs,
+        )
+
 
-                    print(traceback.format_exc())
+def _get_methods(config: Config) -> list[Literal["get", "post"]]:
+    return (
+        cast(list[Literal["get", "post"]], [config.api_method])
+        if isinstance(config.api_method, str)
+        else config.api_method
+    )
+
+
+class _RouteResponse(Response):
+    """Hands the request over to another route"""
+
+    def __init__(self, route: BaseRoute, child_scope: dict):
+        super().__init__()
+        self.route = route
+        self.child_scope = child_scope
+
+    async def __call__(self, scope, receive, send):
+        scope.update(self.child_scope)
+        await self.route.handle(scope, receive, send)
+
+
+class LazyRoute:
+    """Placeholder for the routes of a config. Schema, parameter and response models are resolved
+    on first access or by LakeApiRoutes in the background"""
+
+    def __init__(
+        self,
+        config: Config,
+        configs: Configs,
+        basic_config: BasicConfig,
+        owner: "LakeApiRoutes",
+    ):
+        self.config = config
+        self.configs = configs
+        self.basic_config = basic_config
+        self.owner = owner
+        self.metadata: Optional[dict] = None
+        self.routes: Optional[list[BaseRoute]] = None
+        self._lock = threading.Lock()
+
+    def resolve(
+        self, discovered: "Optional[Tuple[Optional[pa.Schema], Optional[dict]]]" = None
+    ):
+        if self.routes is not None:
+            return self.routes
+        with self._lock:
+            if self.routes is not None:
+                return self.routes
+            if discovered is None:
+                with ExecutionContextManager(
+                    self.basic_config.default_engine,
+                    self.basic_config.default_chunk_size,
+                ) as mgr:
+                    discovered = _discover_schema(
+                        self.config, self.configs, self.basic_config, mgr
+                    )
+                from bmsdna.lakeapi.core.schema_cache import get_schema_catalog
+
+                if catalog := get_schema_catalog(self.basic_config):
+                    catalog.save()
+            schema, self.metadata = discovered
+            router = APIRouter()
+            _create_routes(router, self.config, self.configs, self.basic_config, schema)
+            self.routes = router.routes
+        self.owner.add_resolved(self, router)
+        return self.routes
+
+    async def endpoint(self, request: Request):
+        routes = self.routes or await run_in_threadpool(self.resolve)
+        partial = None
+        for route in routes:
+            match, child_scope = route.matches(request.scope)
+            if match == Match.FULL:
+                return _RouteResponse(route, child_scope)
+            if match == Match.PARTIAL and partial is None:
+                partial = _RouteResponse(route, child_scope)  # wrong method
+        if partial is not None:
+            return partial
+        raise HTTPException(status_code=404)
+
+
+def _config_hash(config: Config) -> str:
+    """Changes with anything the routes of a config are created from, including the datasource"""
+    return get_md5_hash(repr(config))
+
+
+def _config_paths(config: Config) -> set[str]:
+    return {config.route, config.route + "/metadata_detail"}
+
+
+def _remove_routes(router: "Router", paths: set[str]):
+    """Removes the routes with the given paths from router and the routers included into it"""
+    kept = []
+    for route in router.routes:
+        if getattr(route, "path", None) in paths:
+            continue
+        # newer FastAPI versions keep included routers instead of copying their routes
+        included = getattr(route, "original_router", None)
+        if included is not None:
+            _remove_routes(included, paths)
+        kept.append(route)
+    router.routes[:] = kept
+    if hasattr(router, "_mark_routes_changed"):
+        router._mark_routes_changed()  # type: ignore
+
+
+class LakeApiRoutes:
+    """The routes of all configs. Routes resolved later and routes of changed configs are added to the app,
+    so they show up in the OpenAPI document"""
+
+    def __init__(self, configs: Configs, basic_config: BasicConfig):
+        self.configs = configs
+        self.basic_config = basic_config
+        self.metadata: dict[str, dict] = {}  # by route, of eagerly created routes
+        self.lazy_routes: dict[str, LazyRoute] = {}
+        self.sql_catalog: "Optional[SqlTableCatalog]" = None
+        self._app: "Optional[FastAPI]" = None
+        self._pending: list[APIRouter] = []
+        self._lock = threading.Lock()
+
+    def get_metadata(self) -> list[dict]:
+        metadata = dict(self.metadata)
+        for route, lr in self.lazy_routes.items():
+            if lr.metadata is not None:
+                metadata[route] = lr.metadata
+        return [
+            metadata[config.route]
+            for config in self.configs
+            if config.route in metadata
+        ]
+
+    def attach(self, app: "FastAPI"):
+        openapi = app.openapi
+
+        def _openapi():  # routes must not change while the document is generated
+            with self._lock:
+                return openapi()
+
+        app.openapi = _openapi
+        with self._lock:
+            self._app = app
+            pending = self._pending
+            self._pending = []
+        for router in pending:
+            self._include(router)
+
+    def add_resolved(self, lazy_route: "LazyRoute", router: APIRouter):
+        with self._lock:
+            if self.lazy_routes.get(lazy_route.config.route) is not lazy_route:
+                return  # removed by a config reload in the meantime
+            if self._app is None:
+                self._pending.append(router)
+                return
+        self._include(router)
+
+    def _include(self, router: APIRouter):
+        assert self._app is not None
+        with self._lock:
+            self._app.include_router(router)
+            self._app.openapi_schema = None  # regenerated on the next request
+
+    def resolve_in_background(self):
+        lazy_routes = list(self.lazy_routes.values())
+
+        def _resolve_all():
+            discovered = discover_schemas(
+                Configs(
+                    [lr.config for lr in lazy_routes],
+                    self.configs.users,
+                    self.configs.accounts,
+                ),
+                self.basic_config,
+            )
+            for lazy_route, res in zip(lazy_routes, discovered):
+                if res[1] is None:
+                    continue  # failed or timed out, retried on first access
+                try:
+                    lazy_route.resolve(res)
+                except Exception as err:
                     logger.warning(
-                        f"Could not get response type for f{config.route}. Error:{err}"
+                        f"Could not create routes for {lazy_route.config.route}. Error:{err}",
+                        exc_info=err,
                     )
-                    schema = None
 
-            response_model = (
-                get_response_model(
-                    config=config,
-                    schema=schema,
-                    basic_config=basic_config,
+        threading.Thread(target=_resolve_all, name="lazy_routes", daemon=True).start()
+
+    def apply_configs(self, configs: Configs):
+        """Replaces the configs of the running app. Only routes of added, changed or removed configs are touched,
+        so caches of unchanged tables are kept. The schemas of new routes are read before the old ones are removed"""
+        assert self._app is not None, "Configs can only be replaced on a running app"
+        old = {c.route: _config_hash(c) for c in self.configs}
+        new = {c.route: _config_hash(c) for c in configs}
+        removed = [r for r, h in old.items() if new.get(r) != h]
+        added = [c for c in configs if old.get(c.route) != new[c.route]]
+        if not removed and not added:
+            self.configs = configs
+            return
+        logger.info(
+            f"Config changed. Removing {len(removed)}, adding {len(added)} routes"
+        )
+        router = APIRouter()
+        schemas = discover_schemas(
+            Configs(added, configs.users, configs.accounts), self.basic_config
+        )
+        metadata = {}
+        for config, (schema, meta) in zip(added, schemas):
+            if meta is not None:
+                metadata[config.route] = meta
+            _create_routes(router, config, configs, self.basic_config, schema)
+        removed_paths = set()
+        for config in self.configs:
+            if config.route in removed:
+                removed_paths |= _config_paths(config)
+        with self._lock:
+            _remove_routes(self._app.router, removed_paths)
+            for route in removed:
+                self.metadata.pop(route, None)
+                self.lazy_routes.pop(route, None)
+            self.metadata.update(metadata)
+            self._app.include_router(router)
+            self._app.openapi_schema = None
+            self.configs = configs
+            all_lake_api_routers[:] = [
+                (bc, configs) if bc is self.basic_config else (bc, c)
+                for bc, c in all_lake_api_routers
+            ]
+        if self.sql_catalog is not None:
+            self.sql_catalog.update(configs)
+
+
+def init_routes(
+    configs: Configs, basic_config: BasicConfig, app: "Optional[FastAPI]" = None
+):
+    """Creates the router for all configs. Depending on basic_config.route_resolution, the schemas
+    are read right away, or placeholder routes are created and resolved later. Resolved routes are added to app"""
+    from bmsdna.lakeapi.endpoint.sql_endpoint import create_sql_endpoint
+
+    all_lake_api_routers.append((basic_config, configs))
+    router = APIRouter()
+    lake_api_routes = LakeApiRoutes(configs, basic_config)
+    if basic_config.route_resolution == "eager":
+        schemas = discover_schemas(configs, basic_config)
+        for config, (schema, meta) in zip(configs, schemas):
+            if meta is not None:
+                lake_api_routes.metadata[config.route] = meta
+            _create_routes(router, config, configs, basic_config, schema)
+    else:
+        for config in configs:
+            lazy_route = LazyRoute(config, configs, basic_config, lake_api_routes)
+            lake_api_routes.lazy_routes[config.route] = lazy_route
+            for am in _get_methods(config):
+                router.add_api_route(
+                    config.route,
+                    lazy_route.endpoint,
+                    methods=[am.upper()],
+                    name=config.name,
+                    include_in_schema=False,
                 )
-                if schema is not None
-                else None
+            router.add_api_route(
+                config.route + "/metadata_detail",
+                lazy_route.endpoint,
+                methods=["GET"],
+                include_in_schema=False,
             )
-            create_detailed_meta_endpoint(
-                schema=schema,
-                config=config,
-                configs=configs,
-                router=router,
-                basic_config=basic_config,
-            )
-            for am in methods:
-                create_config_endpoint(
-                    apimethod=am,
-                    config=config,
-                    router=router,
-                    response_model=response_model,
-                    schema=schema,
-                    basic_config=basic_config,
-                    configs=configs,
-                )
+        if basic_config.route_resolution == "background":
+            lake_api_routes.resolve_in_background()
+    if app is not None:
+        lake_api_routes.attach(app)
+    router.lake_api_routes = lake_api_routes  # type: ignore
 
-        @router.get(
-            "/metadata",
-            name="metadata",
+    @router.get(
+        "/metadata",
+        name="metadata",
+    )
+    async def get_metadata():
+        return lake_api_routes.get_metadata()
+
+    if basic_config.enable_sql_endpoint:
+        lake_api_routes.sql_catalog = create_sql_endpoint(
+            router=router,
+            basic_config=basic_config,
+            configs=configs,
         )
-        async def get_metadata():
-            return metadata
-
-        if basic_config.enable_sql_endpoint:
-            create_sql_endpoint(
-                router=router,
-                basic_config=basic_config,
-                configs=configs,
-            )
 
-        return router
+    return router
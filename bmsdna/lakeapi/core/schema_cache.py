@@ -1,32 +1,126 @@
+import base64
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import pyarrow as pa
+
 from bmsdna.lakeapi.core.datasource import Datasource
 from bmsdna.lakeapi.core.config import BasicConfig
-from bmsdna.lakeapi.utils.async_utils import _async
+from bmsdna.lakeapi.core.log import get_logger
+from bmsdna.lakeapi.utils.file_lock import file_lock
 
+logger = get_logger(__name__)
 
-def get_schema_cached(cfg: BasicConfig, datasource: Datasource, key: str):
-    if cfg.schema_cache_ttl is not None:
-        import os
-        import time
-        import pyarrow.parquet as pq
-
-        schema_cache_file = os.path.join(
-            cfg.temp_folder_path,
-            key + ".parquet",
+SCHEMA_CATALOG_FILE = "lakeapi_schema_catalog.json"
+
+
+class SchemaCatalog:
+    """The schemas of all routes, kept in one file in the temp folder. An entry is used as long as the
+    version of its source did not change. Sources without a version, like odbc, are cached for schema_cache_ttl"""
+
+    def __init__(self, path: str, ttl: int):
+        self.path = path
+        self.ttl = ttl
+        self.entries: dict[str, dict] = self._read()
+        self._changed: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict[str, dict]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Could not read schema catalog {self.path}: {err}")
+            return {}
+
+    def get(self, key: str, version: Optional[str]) -> Optional[pa.Schema]:
+        entry = self.entries.get(key)
+        if entry is None or entry["version"] != version:
+            return None
+        if version is None and time.time() - entry["written_at"] > self.ttl:
+            return None
+        return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(entry["schema"])))
+
+    def set(self, key: str, version: Optional[str], schema: pa.Schema):
+        with self._lock:
+            self.entries[key] = {
+                "version": version,
+                "written_at": time.time(),
+                "schema": base64.b64encode(schema.serialize().to_pybytes()).decode(
+                    "ascii"
+                ),
+            }
+            self._changed.add(key)
+
+    def save(self):
+        """Writes the entries changed since the last save. Several workers share the file, so it is
+        re-read under a file lock and the entries of the others are kept, the newer one wins"""
+        with self._lock:
+            if not self._changed:
+                return
+            try:
+                with file_lock(self.path):
+                    entries = self._read()
+                    for key in self._changed:
+                        current = entries.get(key)
+                        if (
+                            current is None
+                            or current["written_at"] <= self.entries[key]["written_at"]
+                        ):
+                            entries[key] = self.entries[key]
+                    tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump(entries, f)
+                    os.replace(tmp_path, self.path)
+                self.entries = entries
+                self._changed = set()
+            except OSError as err:
+                logger.warning(f"Could not write schema catalog {self.path}: {err}")
+
+
+_catalogs: dict[str, SchemaCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_schema_catalog(cfg: BasicConfig) -> Optional[SchemaCatalog]:
+    if cfg.schema_cache_ttl is None:
+        return None
+    path = os.path.join(cfg.temp_folder_path, SCHEMA_CATALOG_FILE)
+    with _catalogs_lock:
+        if path not in _catalogs:
+            _catalogs[path] = SchemaCatalog(path, cfg.schema_cache_ttl)
+        return _catalogs[path]
+
+
+def _get_source_version(datasource: Datasource) -> Optional[str]:
+    if datasource.config.file_type == "odbc":
+        return None  # no cheap way to tell
+    try:
+        return datasource.source_uri.get_version_key(
+            delta_table=datasource.config.file_type == "delta"
         )
-        if (
-            not os.path.exists(schema_cache_file)
-            or (time.time() - os.path.getmtime(schema_cache_file))
-            > cfg.schema_cache_ttl
-        ):
-            if not datasource.file_exists():
-                schema = None
-            else:
-                schema = datasource.get_schema()
-                pq.write_metadata(schema, schema_cache_file)
-        else:
-            schema = pq.read_schema(schema_cache_file)
-        return schema
-    else:
+    except Exception as err:
+        logger.warning(f"Could not get version of {datasource.source_uri}: {err}")
+        return None
+
+
+def get_schema_cached(cfg: BasicConfig, datasource: Datasource, key: str):
+    catalog = get_schema_catalog(cfg)
+    if catalog is None:
         if not datasource.file_exists():
             return None
         return datasource.get_schema()
+    version = _get_source_version(datasource)
+    schema = catalog.get(key, version)
+    if schema is not None:
+        return schema
+    if not datasource.file_exists():
+        return None
+    schema = datasource.get_schema()
+    catalog.set(key, version, schema)
+    return schema
@@ -1,68 +1,215 @@
-from typing import Sequence
-
-from fastapi import FastAPI, Request, Response
+from collections import OrderedDict, deque
+import hashlib
+import hmac
+import os
+import threading
+import time
+from typing import Literal, Optional, Sequence, Union
+
+import anyio
+from fastapi import FastAPI, Response
 from fastapi.security import HTTPBasic
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from bmsdna.lakeapi.core.config import BasicConfig, UserConfig
-from functools import lru_cache
 
 security = HTTPBasic()
 userhashmap: dict[str, str] | None = None
 
+AUTH_VERIFY_WORKERS = int(
+    os.getenv("AUTH_VERIFY_WORKERS", "4")
+)  # concurrent argon2 verifications
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))  # seconds
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_MAX_FAILURES = int(
+    os.getenv("AUTH_MAX_FAILURES", "5")
+)  # per user within AUTH_FAILURE_WINDOW, further attempts get a 429
+AUTH_FAILURE_WINDOW = int(os.getenv("AUTH_FAILURE_WINDOW", "60"))  # seconds
+
+_cache_secret = os.urandom(32)  # credentials are only kept as keyed hash
+_verified: "OrderedDict[bytes, float]" = OrderedDict()  # expiry by credential key
+_failures: dict[str, deque[float]] = {}
+_lock = threading.Lock()
+_verify_limiter: Optional[anyio.CapacityLimiter] = None
+_verify_semaphore = threading.BoundedSemaphore(AUTH_VERIFY_WORKERS)  # same, for threads
+
 
-@lru_cache
 def is_correct(
     hash: str,
     pwd_str: str,
-):
+) -> bool:
     import argon2
 
     ph = argon2.PasswordHasher()
-    return ph.verify(
-        hash.encode("utf-8"),
-        pwd_str.encode("utf-8"),
+    try:
+        return ph.verify(
+            hash.encode("utf-8"),
+            pwd_str.encode("utf-8"),
+        )
+    except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+        return False
+
+
+def _credential_key(username: str, pwd_str: str, hash: str) -> bytes:
+    return hmac.new(
+        _cache_secret,
+        "\0".join((username, pwd_str, hash)).encode("utf-8"),
+        hashlib.sha256,
+    ).digest()
+
+
+def _is_verified(key: bytes) -> bool:
+    with _lock:
+        expiry = _verified.get(key)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del _verified[key]
+            return False
+        return True
+
+
+def _set_verified(key: bytes):
+    with _lock:
+        _verified[key] = time.monotonic() + AUTH_CACHE_TTL
+        _verified.move_to_end(key)
+        while len(_verified) > AUTH_CACHE_SIZE:
+            _verified.popitem(last=False)
+
+
+def _is_throttled(username: str) -> bool:
+    with _lock:
+        failures = _failures.get(username)
+        if failures is None:
+            return False
+        while failures and failures[0] < time.monotonic() - AUTH_FAILURE_WINDOW:
+            failures.popleft()
+        if not failures:
+            del _failures[username]
+            return False
+        return len(failures) >= AUTH_MAX_FAILURES
+
+
+def _add_failure(username: str):
+    with _lock:
+        _failures.setdefault(username, deque()).append(time.monotonic())
+
+
+def _verify(
+    username: str, pwd_str: str, hash: str, key: bytes
+) -> Literal["ok", "invalid", "throttled"]:
+    # checked again once a worker is free, the attempts queued before may have failed or succeeded meanwhile
+    if _is_verified(key):
+        return "ok"
+    if _is_throttled(username):
+        return "throttled"
+    if is_correct(hash, pwd_str):
+        _set_verified(key)
+        return "ok"
+    _add_failure(username)
+    return "invalid"
+
+
+async def verify_credentials(
+    username: str, pwd_str: str, hash: str
+) -> Literal["ok", "invalid", "throttled"]:
+    """Verifies the password against the argon2 hash in a worker thread, so the event loop is not blocked.
+    Successful verifications are cached for AUTH_CACHE_TTL, failures are counted per user"""
+    global _verify_limiter
+    key = _credential_key(username, pwd_str, hash)
+    if _is_verified(key):
+        return "ok"
+    if _is_throttled(username):
+        return "throttled"
+    if _verify_limiter is None:
+        _verify_limiter = anyio.CapacityLimiter(AUTH_VERIFY_WORKERS)
+    return await anyio.to_thread.run_sync(
+        _verify, username, pwd_str, hash, key, limiter=_verify_limiter
     )
 
 
-def get_basic_auth_middleware_func(users: Sequence[UserConfig]):
-    async def basic_auth_middleware_func(request: Request, call_next):
-        import json
-
-        credentials = await HTTPBasic(auto_error=False)(request)
-        if credentials is None:
-            return Response(
-                status_code=401,
-                headers={"WWW-Authenticate": "Basic"},
-                content=json.dumps({"detail": "Not authenticated"}),
-            )
-
-        global userhashmap
-        userhashmap = userhashmap or {
-            ud["name"].casefold(): ud["passwordhash"] for ud in users if ud["name"]
-        }  # pay attention not to include an empty user by accident
-
-        if credentials.username.casefold() not in userhashmap.keys():
-            return Response(
-                status_code=401,
-                headers={"WWW-Authenticate": "Basic"},
-                content=json.dumps({"detail": "Incorrect email or password"}),
-            )
-        pwd_str = credentials.password
-        hash = userhashmap[credentials.username.casefold()]
-
-        is_correct_password = is_correct(hash, pwd_str)
-        if not isinstance(is_correct_password, bool):
-            is_correct_password = is_correct_password
-        if not is_correct_password:
-            return Response(
-                status_code=401,
-                headers={"WWW-Authenticate": "Basic"},
-                content="Incorrect email or password",
-            )
-        request.scope["user"] = {"username": credentials.username}
-        return await call_next(request)
-
-    return basic_auth_middleware_func
+def verify_credentials_sync(
+    username: str, pwd_str: str, hash: str
+) -> Literal["ok", "invalid", "throttled"]:
+    """Same as verify_credentials, for callers running in a worker thread already"""
+    key = _credential_key(username, pwd_str, hash)
+    if _is_verified(key):
+        return "ok"
+    if _is_throttled(username):
+        return "throttled"
+    with _verify_semaphore:
+        return _verify(username, pwd_str, hash, key)
+
+
+def get_password_hash(username: str, users: Sequence[UserConfig]) -> Optional[str]:
+    global userhashmap
+    userhashmap = userhashmap or {
+        ud["name"].casefold(): ud["passwordhash"] for ud in users if ud["name"]
+    }  # pay attention not to include an empty user by accident
+    return userhashmap.get(username.casefold())
+
+
+async def authenticate(
+    conn: HTTPConnection, users: Sequence[UserConfig]
+) -> Union[dict, Response]:
+    """Returns the user of the request or websocket, or the response to send if it is not authenticated"""
+    import json
+
+    # HTTPBasic only reads the headers, which websockets have as well
+    credentials = await HTTPBasic(auto_error=False)(conn)  # type: ignore
+    if credentials is None:
+        return Response(
+            status_code=401,
+            headers={"WWW-Authenticate": "Basic"},
+            content=json.dumps({"detail": "Not authenticated"}),
+        )
+
+    hash = get_password_hash(credentials.username, users)
+    if hash is None:
+        return Response(
+            status_code=401,
+            headers={"WWW-Authenticate": "Basic"},
+            content=json.dumps({"detail": "Incorrect email or password"}),
+        )
+    verified = await verify_credentials(
+        credentials.username.casefold(), credentials.password, hash
+    )
+    if verified == "throttled":
+        return Response(
+            status_code=429,
+            headers={"Retry-After": str(AUTH_FAILURE_WINDOW)},
+            content="Too many failed attempts",
+        )
+    if verified != "ok":
+        return Response(
+            status_code=401,
+            headers={"WWW-Authenticate": "Basic"},
+            content="Incorrect email or password",
+        )
+    return {"username": credentials.username}
+
+
+class BasicAuthMiddleware:
+    """Plain ASGI middleware: only the request headers are looked at, the response is passed through as is"""
+
+    def __init__(self, app: ASGIApp, users: Sequence[UserConfig]):
+        self.app = app
+        self.users = users
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        user = await authenticate(HTTPConnection(scope), self.users)
+        if isinstance(user, Response):
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1008})
+            else:
+                await user(scope, receive, send)
+            return
+        scope["user"] = user
+        await self.app(scope, receive, send)
 
 
 def add_user_middlware(
@@ -70,8 +217,4 @@ def add_user_middlware(
     basic_config: BasicConfig,
     users: Sequence[UserConfig],
 ):
-    from starlette.middleware.base import BaseHTTPMiddleware
-
-    app.add_middleware(
-        BaseHTTPMiddleware, dispatch=get_basic_auth_middleware_func(users)
-    )
+    app.add_middleware(BasicAuthMiddleware, users=users)
@@ -4,6 +4,7 @@ import pyarrow as pa
 
 
 import sqlglot.expressions as ex
+from deltalake2db.filter_by_meta import FilterType
 
 from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
 from pydantic import BaseModel
@@ -23,7 +24,12 @@ from bmsdna.lakeapi.core.model import create_parameter_model, create_response_mo
 from bmsdna.lakeapi.core.response import create_response
 from bmsdna.lakeapi.core.types import Engines, OperatorType, OutputFileType
 from bmsdna.lakeapi.endpoint.endpoint_search import handle_search_request
-from bmsdna.lakeapi.endpoint.endpoint_nearby import handle_nearby_request
+from bmsdna.lakeapi.endpoint.endpoint_nearby import (
+    handle_nearby_request,
+    get_nearby_filter,
+    get_nearby_prefilter,
+    get_nearby_partition_filter,
+)
 from starlette.concurrency import run_in_threadpool
 from bmsdna.lakeapi.utils.async_utils import _async
 
@@ -47,7 +53,7 @@ def get_params_filter_expr(
     context: ExecutionContext,
     columns: List[str],
     config: Config,
-    params: BaseModel,
+    params: Optional[BaseModel],
 ) -> Optional[ex.Condition | ex.Binary]:
     expr = filter_df_based_on_params(
         context,
@@ -112,6 +118,148 @@ def is_complex_type(
     return pa.types.is_nested(f.type)
 
 
+def resolve_engine(
+    config: Config, basic_config: BasicConfig, engine: Optional[Engines]
+) -> Engines:
+    return (
+        engine
+        or (
+            "duckdb" if config.duckdb_backend and config.duckdb_backend.enable else None
+        )  # the local replica is a duckdb file
+        or config.engine
+        or basic_config.default_engine
+    )
+
+
+def build_query(
+    context: ExecutionContext,
+    realdataframe: Datasource,
+    config: Config,
+    basic_config: BasicConfig,
+    params: Optional[BaseModel],
+    *,
+    limit: Optional[int],
+    offset: Optional[int],
+    select: Optional[str],
+    distinct: bool,
+    jsonify_complex: bool,
+    format: Optional[str],
+    has_complex: bool,
+    filters: Optional[FilterType] = None,
+) -> ex.Query:
+    """The query of a route for the given parameters. filters are added to the partition and file filters"""
+    assert config.datasource is not None
+    param_dict = params.model_dump(exclude_unset=True) if params else None
+    if param_dict:
+        pre_filter, _ = get_filters(
+            param_dict,
+            config.params if config.params else [],
+            None,
+        )
+    else:
+        pre_filter = None
+    if config.datasource.file_type == "delta" and config.params is not None:
+        st = realdataframe.get_delta_table(True)
+        if st is not None and param_dict is not None:
+            part_filter = filter_partitions_based_on_params(
+                st, remove_search_nearby(param_dict, config), config.params
+            )
+            if part_filter:
+                pre_filter = list(pre_filter or []) + part_filter
+    if config.nearby and params is not None:
+        nearbyes = get_nearby_filter(config.nearby, params, basic_config)
+        # prunes files by lat/lon statistics
+        nearby_filter: list = get_nearby_prefilter(nearbyes)
+        st = (
+            realdataframe.get_delta_table(True)
+            if nearbyes and config.datasource.file_type == "delta"
+            else None
+        )
+        if st is not None and st.last_metadata is not None:
+            nearby_filter += get_nearby_partition_filter(
+                nearbyes, st.last_metadata.get("partitionColumns", [])
+            )
+        if nearby_filter:
+            pre_filter = list(pre_filter or []) + nearby_filter
+    if filters:
+        pre_filter = list(pre_filter or []) + list(filters)
+    df = realdataframe.get_df(
+        filters=pre_filter,
+        limit=limit
+        if not config.datasource.sortby
+        and not offset
+        and not limit == -1
+        and not param_dict
+        else None,  # if sorted we need all data to sort correctly
+    )
+    df_cols = df.columns()
+    expr = get_params_filter_expr(  # this supports all kinds of filters, while the prefilter only supports equality
+        context,
+        df_cols,
+        config,
+        params,
+    )
+    new_query = df.query_builder()
+    new_query = new_query.where(expr) if expr is not None else new_query
+    columns = exclude_cols(df_cols, basic_config)
+    if select:
+        columns = [
+            c for c in columns if c in split_csv(select)
+        ]  # split , is a bit naive, we might want to support real CSV with quotes here
+    if config.datasource.exclude and len(config.datasource.exclude) > 0:
+        columns = [c for c in columns if c not in config.datasource.exclude]
+    if config.datasource.sortby:
+        for s in config.datasource.sortby:
+            new_query = cast(ex.Select, new_query).order_by(
+                ex.column(s.by, quoted=True).desc()
+                if s.direction and s.direction.lower() == "desc"
+                else ex.column(s.by, quoted=True),
+                copy=False,
+            )
+    if has_complex and format in ["csv", "excel", "scsv", "csv4excel"]:
+        jsonify_complex = True
+    if jsonify_complex:
+        base_schema = df.arrow_schema()
+
+        complex_cols = [c for c in columns if is_complex_type(base_schema, c)]
+
+        new_query = context.jsonify_complex(new_query, complex_cols, columns)
+    else:
+        new_query = new_query.select(
+            *[ex.column(c, quoted=True) for c in columns], append=False
+        )
+
+    if distinct:
+        assert len(columns) <= 3  # reduce complexity here
+        new_query = cast(ex.Select, new_query).distinct()
+
+    if not (limit == -1 and config.allow_get_all_pages):
+        limit = (1000 if limit == -1 else limit) or 1000
+        new_query = new_query.limit(limit)
+        if offset:
+            new_query.offset(offset, copy=False)
+
+    if params is not None:
+        new_query = handle_search_request(
+            context,
+            config,
+            params,
+            basic_config,
+            source_view=realdataframe.tablename,
+            query=new_query,
+        )
+        new_query = handle_nearby_request(
+            context,
+            config,
+            params,
+            basic_config,
+            source_view=realdataframe.tablename,
+            query=new_query,
+        )
+    logger.debug(f"Query: {get_sql(new_query, dialect='duckdb')}")
+    return new_query
+
+
 def create_config_endpoint(
     schema: pa.Schema | None,
     apimethod: Literal["get", "post"],
@@ -192,12 +340,18 @@ def create_config_endpoint(
             include_in_schema=False,
             default=None,
         ),
+        timeout: Union[str, None] = Query(
+            title="$timeout",
+            alias="$timeout",
+            default=None,
+            description="Cancels the query after this many seconds, lowers the configured max_execution_time",
+        ),
     ):  # type: ignore
         logger.debug(
             f"{params.model_dump(exclude_unset=True) if params else None}Union[ ,  ]{request.url.path}"
         )
 
-        engine = engine or config.engine or basic_config.default_engine
+        engine = resolve_engine(config, basic_config, engine)
 
         logger.debug(f"Engine: {engine}")
         real_chunk_size = (
@@ -218,97 +372,22 @@ def create_config_endpoint(
             sql_context=context,
             basic_config=basic_config,
             accounts=configs.accounts,
+            duckdb_backend=config.duckdb_backend,
         ) as realdataframe:
-            param_dict = params.model_dump(exclude_unset=True) if params else None
-            if param_dict:
-                pre_filter, _ = get_filters(
-                    param_dict,
-                    config.params if config.params else [],
-                    None,
-                )
-            else:
-                pre_filter = None
-            if config.datasource.file_type == "delta" and config.params is not None:
-                st = realdataframe.get_delta_table(True)
-                if st is not None and param_dict is not None:
-                    part_filter = filter_partitions_based_on_params(
-                        st, param_dict, config.params
-                    )
-                    if part_filter:
-                        pre_filter = list(pre_filter or []) + part_filter
-            df = realdataframe.get_df(
-                filters=pre_filter,
-                limit=limit
-                if not config.datasource.sortby
-                and not offset
-                and not limit == -1
-                and not param_dict
-                else None,  # if sorted we need all data to sort correctly
-            )
-            df_cols = df.columns()
-            expr = get_params_filter_expr(  # this supports all kinds of filters, while the prefilter only supports equality
-                context,
-                df_cols,
-                config,
-                params,
-            )
-            new_query = df.query_builder()
-            new_query = new_query.where(expr) if expr is not None else new_query
-            columns = exclude_cols(df_cols, basic_config)
-            if select:
-                columns = [
-                    c for c in columns if c in split_csv(select)
-                ]  # split , is a bit naive, we might want to support real CSV with quotes here
-            if config.datasource.exclude and len(config.datasource.exclude) > 0:
-                columns = [c for c in columns if c not in config.datasource.exclude]
-            if config.datasource.sortby:
-                for s in config.datasource.sortby:
-                    new_query = cast(ex.Select, new_query).order_by(
-                        ex.column(s.by, quoted=True).desc()
-                        if s.direction and s.direction.lower() == "desc"
-                        else ex.column(s.by, quoted=True),
-                        copy=False,
-                    )
-            if has_complex and format in ["csv", "excel", "scsv", "csv4excel"]:
-                jsonify_complex = True
-            if jsonify_complex:
-                base_schema = df.arrow_schema()
-
-                complex_cols = [c for c in columns if is_complex_type(base_schema, c)]
-
-                new_query = context.jsonify_complex(new_query, complex_cols, columns)
-            else:
-                new_query = new_query.select(
-                    *[ex.column(c, quoted=True) for c in columns], append=False
-                )
-
-            if distinct:
-                assert len(columns) <= 3  # reduce complexity here
-                new_query = cast(ex.Select, new_query).distinct()
-
-            if not (limit == -1 and config.allow_get_all_pages):
-                limit = (1000 if limit == -1 else limit) or 1000
-                new_query = new_query.limit(limit)
-                if offset:
-                    new_query.offset(offset, copy=False)
-
-            new_query = handle_search_request(
+            new_query = build_query(
                 context,
+                realdataframe,
                 config,
-                params,
                 basic_config,
-                source_view=realdataframe.tablename,
-                query=new_query,
-            )
-            new_query = handle_nearby_request(
-                context,
-                config,
                 params,
-                basic_config,
-                source_view=realdataframe.tablename,
-                query=new_query,
+                limit=limit,
+                offset=offset,
+                select=select,
+                distinct=distinct,
+                jsonify_complex=jsonify_complex,
+                format=format,
+                has_complex=has_complex,
             )
-            logger.debug(f"Query: {get_sql(new_query, dialect='duckdb')}")
 
             try:
                 return await create_response(
@@ -320,7 +399,13 @@ def create_config_endpoint(
                     basic_config=basic_config,
                     close_context=True,
                     charset=request.query_params.get("$encoding"),
+                    is_disconnected=request.is_disconnected,
+                    max_execution_time=config.max_execution_time
+                    or basic_config.max_execution_time,
+                    accept_encoding=request.headers.get("Accept-Encoding"),
                 )
+            except HTTPException:
+                raise
             except Exception as err:
                 logger.error("Error in creating response", exc_info=err)
                 raise HTTPException(status_code=500)
@@ -1,3 +1,4 @@
+import math
 from pydantic import BaseModel
 from bmsdna.lakeapi.context.df_base import ExecutionContext
 import sqlglot.expressions as ex
@@ -5,11 +6,18 @@ import sqlglot.expressions as ex
 from bmsdna.lakeapi.core.config import BasicConfig, Config
 from bmsdna.lakeapi.core.model import GeoModel
 from bmsdna.lakeapi.core.types import NearbyConfig
+from bmsdna.lakeapi.utils.geohash import geohash_cells
 from sqlglot import select
+from typing import cast
 
 
 NearbyType = list[tuple[GeoModel, NearbyConfig]] | None  # list of config with values
 
+# same earth radius as distance_m_function
+METERS_PER_DEGREE_LAT = 6371000 * math.pi / 180
+
+GEOHASH_MAX_CELLS = 512  # above that, reading all partitions is cheaper than filtering
+
 
 def parse_lat_lon(vl: str):
     lat, lon = vl.split(",")
@@ -34,6 +42,83 @@ def get_nearby_filter(
     return v if len(v) > 0 else None
 
 
+def get_bounding_box(
+    lat: float, lon: float, distance_m: float
+) -> tuple[float, float, float | None, float | None]:
+    """min/max latitude and longitude of all points within distance_m. Longitude is None
+    if the box contains a pole or crosses the antimeridian"""
+    d_lat = distance_m / METERS_PER_DEGREE_LAT
+    min_lat, max_lat = lat - d_lat, lat + d_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), None, None
+    d_lon = distance_m / (
+        METERS_PER_DEGREE_LAT
+        * min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    )
+    min_lon, max_lon = lon - d_lon, lon + d_lon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def get_nearby_prefilter(nearbyes: NearbyType) -> list[tuple[str, str, float]]:
+    """Bounding box conditions for the nearby filters, used to prune files by their lat/lon statistics"""
+    conditions = []
+    for nearby_val, nearby_cfg in nearbyes or []:
+        min_lat, max_lat, min_lon, max_lon = get_bounding_box(
+            nearby_val.lat, nearby_val.lon, nearby_val.distance_m
+        )
+        conditions.append((nearby_cfg.lat_col, ">=", min_lat))
+        conditions.append((nearby_cfg.lat_col, "<=", max_lat))
+        if min_lon is not None and max_lon is not None:
+            conditions.append((nearby_cfg.lon_col, ">=", min_lon))
+            conditions.append((nearby_cfg.lon_col, "<=", max_lon))
+    return conditions
+
+
+def get_nearby_partition_filter(
+    nearbyes: NearbyType, partition_columns: list[str]
+) -> list[tuple[str, str, list[str]]]:
+    """`in` filters for partition columns named `<lat_col>_<lon_col>_geohash_prefix_N`, containing the
+    first N characters of the geohash. Selects all cells intersecting the bounding box"""
+    filters = []
+    for nearby_val, nearby_cfg in nearbyes or []:
+        prefix = f"{nearby_cfg.lat_col}_{nearby_cfg.lon_col}_geohash_prefix_"
+        for partcol in partition_columns:
+            if not partcol.startswith(prefix):
+                continue
+            min_lat, max_lat, min_lon, max_lon = get_bounding_box(
+                nearby_val.lat, nearby_val.lon, nearby_val.distance_m
+            )
+            cells = geohash_cells(
+                min_lat,
+                max_lat,
+                min_lon if min_lon is not None else -180,
+                max_lon if max_lon is not None else 180,
+                int(partcol[len(prefix) :]),
+                GEOHASH_MAX_CELLS,
+            )
+            if cells is not None:
+                filters.append((partcol, "in", cells))
+    return filters
+
+
+def _bounding_box_expr(nearby_val: GeoModel, nearby_cfg: NearbyConfig):
+    min_lat, max_lat, min_lon, max_lon = get_bounding_box(
+        nearby_val.lat, nearby_val.lon, nearby_val.distance_m
+    )
+    expr = ex.column(nearby_cfg.lat_col, quoted=True).between(
+        ex.convert(min_lat), ex.convert(max_lat)
+    )
+    if min_lon is not None and max_lon is not None:
+        expr = expr.and_(
+            ex.column(nearby_cfg.lon_col, quoted=True).between(
+                ex.convert(min_lon), ex.convert(max_lon)
+            )
+        )
+    return expr
+
+
 def handle_nearby_request(
     context: ExecutionContext,
     config: Config,
@@ -57,6 +142,10 @@ def handle_nearby_request(
     orders = []
     wheres = []
     for nearby_val, nearby_cfg in nearbyes:
+        # cheap pre-filter, the exact distance is only computed for rows within the bounding box
+        query = cast(ex.Select, query).where(
+            _bounding_box_expr(nearby_val, nearby_cfg), copy=False
+        )
         fn = context.distance_m_function(
             ex.column(nearby_cfg.lat_col, quoted=True),
             ex.column(nearby_cfg.lon_col, quoted=True),
@@ -55,6 +55,12 @@ def handle_search_request(
     assert score_sum is not None
     query = query.select(score_sum.as_("search_score"))
     assert isinstance(query, ex.Select)
-    query = query.where(~ex.column("search_score").is_(ex.convert(None)))
+    query = query.where(
+        ~(
+            ex.column("search_score")
+            if context.supports_alias_in_where
+            else score_sum.copy()
+        ).is_(ex.convert(None))
+    )
     query = query.order_by(ex.column("search_score").desc(), append=False)
     return query
@@ -0,0 +1,208 @@
+import multiprocessing
+import os
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Optional
+
+import anyio
+import sqlglot as sg
+import sqlglot.expressions as exp
+
+from bmsdna.lakeapi.context.df_base import ExecutionContext, get_sql
+from bmsdna.lakeapi.core.log import get_logger
+
+if TYPE_CHECKING:
+    from bmsdna.lakeapi.endpoint.sql_endpoint import SqlTableCatalog
+
+logger = get_logger(__name__)
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return int(value) if int(value) > 0 else None  # 0 disables the limit
+
+
+SQL_MAX_ESTIMATED_ROWS = _env_int(
+    "SQL_MAX_ESTIMATED_ROWS", 1_000_000_000
+)  # of any operator in the plan
+SQL_MAX_SCANNED_BYTES = _env_int("SQL_MAX_SCANNED_BYTES", None)
+SQL_MAX_RESULT_ROWS = _env_int(
+    "SQL_MAX_RESULT_ROWS", None
+)  # larger results are limited instead of rejected
+SQL_ENDPOINT_THREADS = _env_int(
+    "SQL_ENDPOINT_THREADS", max(1, multiprocessing.cpu_count() // 4)
+)  # shared by all running queries of the sql endpoint
+
+
+@dataclass
+class QueryCost:
+    result_rows: Optional[int]  # estimated
+    max_rows: Optional[int]  # estimated, of the most expensive operator
+    scanned_bytes: int
+
+
+class QueryTooExpensiveError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+        super().__init__(message)
+
+
+class ThreadBudget:
+    """Threads shared by the queries of the sql endpoint. A query gets half of the free threads, at least one,
+    and waits while all are in use"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.free = total
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> int:
+        with self._lock:
+            threads = (self.free + 1) // 2
+            self.free -= threads
+            return threads
+
+    async def acquire(self) -> int:
+        while True:
+            threads = self._try_acquire()
+            if threads:
+                return threads
+            await anyio.sleep(0.05)
+
+    def release(self, threads: int):
+        with self._lock:
+            self.free += threads
+
+
+thread_budget = (
+    ThreadBudget(SQL_ENDPOINT_THREADS) if SQL_ENDPOINT_THREADS is not None else None
+)
+
+_OPERATORS = {
+    exp.EQ: "=",
+    exp.NEQ: "<>",
+    exp.GT: ">",
+    exp.GTE: ">=",
+    exp.LT: "<",
+    exp.LTE: "<=",
+}
+
+
+def _literal(node: exp.Expression) -> Any:
+    if not isinstance(node, exp.Literal):
+        raise ValueError("Not a literal")
+    if node.is_string:
+        return node.this
+    return int(node.this) if node.is_int else float(node.this)
+
+
+def _get_table_filters(table: exp.Table, columns: set[str]) -> list[tuple]:
+    """Conditions of the WHERE clause on columns of table, used to prune its files. Only conditions
+    combined with AND and comparing a column with literals are used"""
+    select = table.find_ancestor(exp.Select)
+    where = select.args.get("where") if select is not None else None
+    if where is None:
+        return []
+    names = {table.name, table.alias_or_name}
+    conditions = (
+        list(where.this.flatten()) if isinstance(where.this, exp.And) else [where.this]
+    )
+    filters = []
+    for cond in conditions:
+        col = cond.this
+        if (
+            not isinstance(col, exp.Column)
+            or (col.table and col.table not in names)
+            or col.name not in columns
+        ):
+            continue
+        try:
+            if isinstance(cond, exp.In) and not cond.args.get("query"):
+                filters.append(
+                    (col.name, "in", [_literal(e) for e in cond.expressions])
+                )
+            elif type(cond) in _OPERATORS:
+                filters.append(
+                    (col.name, _OPERATORS[type(cond)], _literal(cond.expression))
+                )
+        except ValueError:
+            continue
+    return filters
+
+
+def _scanned_bytes(con: ExecutionContext, sql: str, catalog: "SqlTableCatalog"):
+    """Size of the files of the referenced delta tables that are read, as of the delta log.
+    Files are pruned by the partition values and statistics the WHERE clause allows"""
+    from bmsdna.lakeapi.utils.meta_cache import get_deltalake_meta
+
+    total = 0
+    for table in sg.parse_one(sql, dialect=con.dialect).find_all(exp.Table):
+        cfg = catalog.tables.get(table.name)
+        if cfg is None or cfg.datasource is None or cfg.datasource.file_type != "delta":
+            continue
+        with catalog.get_datasource(cfg, con) as df:
+            try:
+                meta = get_deltalake_meta(
+                    con.engine_name == "polars", df.get_execution_uri(meta_only=True)
+                )
+            except FileNotFoundError:
+                continue
+        columns = {f["name"] for f in meta.schema["fields"]} if meta.schema else set()
+        filters = _get_table_filters(table, columns)
+        total += sum(
+            ac.get("size") or 0 for ac in meta.get_add_actions_filtered(filters or None)
+        )
+    return total
+
+
+def estimate_cost(
+    con: ExecutionContext,
+    sql: str,
+    catalog: "SqlTableCatalog",
+) -> QueryCost:
+    estimate = con.estimate_cardinality(sql)
+    return QueryCost(
+        result_rows=estimate[0] if estimate else None,
+        max_rows=estimate[1] if estimate else None,
+        scanned_bytes=_scanned_bytes(con, sql, catalog),
+    )
+
+
+def guard_query(
+    con: ExecutionContext,
+    sql: str,
+    catalog: "SqlTableCatalog",
+    threads: Optional[int] = None,
+) -> str:
+    """Checks the estimated cost of sql against the limits before it is executed. Raises QueryTooExpensiveError
+    for queries exceeding them, and returns the sql to run, which is limited to SQL_MAX_RESULT_ROWS
+    if only the result is too large. The query runs with threads threads, as taken from thread_budget"""
+    if threads is not None:
+        con.set_threads(threads)
+    cost = estimate_cost(con, sql, catalog)
+    logger.debug(f"Estimated cost: {cost}")
+    if SQL_MAX_SCANNED_BYTES is not None and cost.scanned_bytes > SQL_MAX_SCANNED_BYTES:
+        raise QueryTooExpensiveError(
+            f"Query would scan {cost.scanned_bytes} bytes, the maximum is {SQL_MAX_SCANNED_BYTES}"
+        )
+    if (
+        SQL_MAX_ESTIMATED_ROWS is not None
+        and cost.max_rows is not None
+        and cost.max_rows > SQL_MAX_ESTIMATED_ROWS
+        and not (  # only the result is too large, limiting helps
+            SQL_MAX_RESULT_ROWS is not None and cost.max_rows == cost.result_rows
+        )
+    ):
+        raise QueryTooExpensiveError(
+            f"Query would process an estimated {cost.max_rows} rows, the maximum is {SQL_MAX_ESTIMATED_ROWS}"
+        )
+    if (
+        SQL_MAX_RESULT_ROWS is not None
+        and cost.result_rows is not None
+        and cost.result_rows > SQL_MAX_RESULT_ROWS
+    ):
+        logger.info(f"Limiting query to {SQL_MAX_RESULT_ROWS} rows: {sql}")
+        return get_sql(sql, limit=SQL_MAX_RESULT_ROWS, dialect=con.dialect)
+    return sql
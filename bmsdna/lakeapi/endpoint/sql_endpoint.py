@@ -1,53 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from time import time
 from typing import Optional, Union
 from fastapi import APIRouter, BackgroundTasks, Header, Query, Request, Response
+from starlette.concurrency import run_in_threadpool
 from bmsdna.lakeapi.context.df_base import ExecutionContext, FileTypeNotSupportedError
-from bmsdna.lakeapi.core.config import BasicConfig, Configs
-from bmsdna.lakeapi.core.datasource import Datasource
+from bmsdna.lakeapi.core.config import BasicConfig, Config, Configs
+from bmsdna.lakeapi.core.datasource import Datasource, get_unique_table_name
 from bmsdna.lakeapi.core.log import get_logger
 from bmsdna.lakeapi.core.types import OutputFileType
 from bmsdna.lakeapi.core.response import create_response
+from bmsdna.lakeapi.endpoint.sql_cost import (
+    QueryTooExpensiveError,
+    guard_query,
+    thread_budget,
+)
 from bmsdna.lakeapi.context import get_context_by_engine, Engines
 
 
 logger = get_logger(__name__)
 
 
-def _register_tables(
-    con: ExecutionContext,
-    basic_config: BasicConfig,
-    configs: Configs,
-    tables: list[str],
-):
-    for cfg in configs:
+SQL_CATALOG_REFRESH_INTERVAL = int(
+    os.getenv("SQL_CATALOG_REFRESH_INTERVAL", "300")
+)  # in seconds
+SQL_CATALOG_CHECK_WORKERS = int(os.getenv("SQL_CATALOG_CHECK_WORKERS", "8"))
+
+
+class SqlTableCatalog:
+    """All tables queryable through the sql endpoint by their unique_table_name. Whether the tables exist is
+    checked in the background and cached, so a query only needs to look at the tables it references"""
+
+    def __init__(self, basic_config: BasicConfig, configs: Configs):
+        self.basic_config = basic_config
+        self.tables: dict[str, Config] = {}
+        self._exists: dict[str, bool] = {}
+        self._refreshed_at: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+        self.update(configs)
+
+    def update(self, configs: Configs):
+        """Replaces the tables. Tables with an unchanged datasource keep their cached state"""
+        tables: dict[str, Config] = {}
+        for cfg in configs:
+            assert cfg.datasource is not None
+            if cfg.engine == "odbc":
+                continue
+            tables[get_unique_table_name(cfg.version_str, cfg.tag, cfg.name)] = cfg
+        for name in list(self._exists):
+            old = self.tables.get(name)
+            new = tables.get(name)
+            if (
+                old is None
+                or new is None
+                or old.datasource.get_unique_hash() != new.datasource.get_unique_hash()  # type: ignore
+            ):
+                self._exists.pop(name)
+        self.configs = configs
+        self.tables = tables
+
+    def get_datasource(self, cfg: Config, con: ExecutionContext) -> Datasource:
         assert cfg.datasource is not None
-        with Datasource(
+        return Datasource(
             cfg.version_str,
             cfg.tag,
             cfg.name,
             config=cfg.datasource,
             sql_context=con,
-            accounts=configs.accounts,
-            basic_config=basic_config,
-        ) as df:
-            if cfg.engine != "odbc" and df.file_exists():
-                try:
-                    if df.unique_table_name in tables:
-                        con.register_datasource(
-                            df.unique_table_name,
-                            df.tablename,
-                            df.get_execution_uri(False),
-                            df.config.file_type,
-                            None,
+            accounts=self.configs.accounts,
+            basic_config=self.basic_config,
+        )
+
+    def _check_exists(self, name: str, con: ExecutionContext) -> bool:
+        try:
+            with self.get_datasource(self.tables[name], con) as df:
+                exists = df.file_exists()
+        except Exception as err:
+            logger.warning(f"Cannot check {name}: {err}")
+            exists = False
+        self._exists[name] = exists
+        return exists
+
+    def refresh(self, blocking: bool = True):
+        if not self._refresh_lock.acquire(blocking=blocking):
+            return  # already refreshing
+        try:
+            con = get_context_by_engine(
+                self.basic_config.default_engine, self.basic_config.default_chunk_size
+            )
+            try:
+                with ThreadPoolExecutor(SQL_CATALOG_CHECK_WORKERS) as executor:
+                    list(
+                        executor.map(
+                            lambda n: self._check_exists(n, con), list(self.tables)
                         )
-                except (FileTypeNotSupportedError, FileNotFoundError):
-                    logger.warning(f"Cannot query {df.tablename}")
+                    )
+            finally:
+                con.close()
+            self._refreshed_at = time()
+        finally:
+            self._refresh_lock.release()
+
+    def refresh_in_background(self):
+        threading.Thread(
+            target=self.refresh,
+            kwargs={"blocking": False},
+            name="sql_table_catalog",
+            daemon=True,
+        ).start()
+
+    def existing_tables(self) -> list[str]:
+        """The names of all existing tables. Waits for the first refresh, afterwards the cached state is returned
+        and refreshed in the background once it is older than SQL_CATALOG_REFRESH_INTERVAL"""
+        if self._refreshed_at is None:
+            self.refresh()
+        elif time() - self._refreshed_at > SQL_CATALOG_REFRESH_INTERVAL:
+            self.refresh_in_background()
+        return [n for n in self.tables if self._exists.get(n)]
+
+    def exists(self, name: str, con: ExecutionContext) -> bool:
+        if self._exists.get(name):
+            return True
+        return self._check_exists(name, con)  # might have been created since
+
+
+async def _guarded_response(
+    request: Request,
+    format: Optional[OutputFileType],
+    con: ExecutionContext,
+    sql: str,
+    catalog: SqlTableCatalog,
+    basic_config: BasicConfig,
+):
+    """Runs sql if its estimated cost is within the limits, with threads of the shared thread budget.
+    The threads are given back once the result is written, before it is sent"""
+    threads = await thread_budget.acquire() if thread_budget is not None else None
+    try:
+        try:
+            sql = await run_in_threadpool(guard_query, con, sql, catalog, threads)
+        except QueryTooExpensiveError as err:
+            con.close()
+            return Response(status_code=400, content=err.message)
+        return await create_response(
+            request.url,
+            request.query_params,
+            format or request.headers["Accept"],
+            con,
+            sql,
+            basic_config=basic_config,
+            close_context=True,
+            is_disconnected=request.is_disconnected,
+            max_execution_time=basic_config.max_execution_time,
+            accept_encoding=request.headers.get("Accept-Encoding"),
+        )
+    finally:
+        if thread_budget is not None and threads is not None:
+            thread_budget.release(threads)
+
+
+def _register_tables(
+    con: ExecutionContext,
+    catalog: SqlTableCatalog,
+    tables: list[str],
+):
+    for name in set(tables):
+        cfg = catalog.tables.get(name)
+        if cfg is None or not catalog.exists(name, con):
+            continue
+        with catalog.get_datasource(cfg, con) as df:
+            try:
+                con.register_datasource(
+                    df.unique_table_name,
+                    df.tablename,
+                    df.get_execution_uri(False),
+                    df.config.file_type,
+                    None,
+                )
+            except (FileTypeNotSupportedError, FileNotFoundError):
+                logger.warning(f"Cannot query {df.tablename}")
 
 
 def create_sql_endpoint(
     router: APIRouter,
     basic_config: BasicConfig,
     configs: Configs,
-):
+) -> SqlTableCatalog:
+    catalog = SqlTableCatalog(basic_config, configs)
+    catalog.refresh_in_background()
+
     @router.get("/api/sql/tables", tags=["sql"], operation_id="get_sql_tables")
     async def get_sql_tables(
         request: Request,
@@ -66,25 +207,7 @@ def create_sql_endpoint(
             ) as con:
                 return await con.list_tables().to_pylist()
         else:
-            tbls = []
-            with get_context_by_engine(
-                engine,
-                basic_config.default_chunk_size,
-            ) as con:
-                for cfg in configs:
-                    assert cfg.datasource is not None
-                    with Datasource(
-                        cfg.version_str,
-                        cfg.tag,
-                        cfg.name,
-                        config=cfg.datasource,
-                        sql_context=con,
-                        accounts=configs.accounts,
-                        basic_config=basic_config,
-                    ) as df:
-                        if cfg.engine != "odbc" and df.file_exists():
-                            tbls.append(df.unique_table_name)
-            return tbls
+            return catalog.existing_tables()
 
     @router.post(
         "/api/sql",
@@ -102,6 +225,12 @@ def create_sql_endpoint(
             default="duckdb",
             include_in_schema=False,
         ),
+        timeout: Union[str, None] = Query(
+            title="$timeout",
+            alias="$timeout",
+            default=None,
+            description="Cancels the query after this many seconds, lowers the configured max_execution_time",
+        ),
     ):
         body = await request.body()
         sql = body.decode("utf-8")
@@ -122,16 +251,9 @@ def create_sql_endpoint(
                     status_code=400, content="Only a single SELECT statement is allowed"
                 )
             table_names = [t.name for t in expr.find_all(exp.Table)]
-            _register_tables(con, basic_config, configs, table_names)
-
-            return await create_response(
-                request.url,
-                request.query_params,
-                format or request.headers["Accept"],
-                con,
-                sql,
-                basic_config=basic_config,
-                close_context=True,
+            _register_tables(con, catalog, table_names)
+            return await _guarded_response(
+                request, format, con, sql, catalog, basic_config
             )
         except Exception as e:
             if con:
@@ -155,6 +277,12 @@ def create_sql_endpoint(
             default="duckdb",
             include_in_schema=False,
         ),
+        timeout: Union[str, None] = Query(
+            title="$timeout",
+            alias="$timeout",
+            default=None,
+            description="Cancels the query after this many seconds, lowers the configured max_execution_time",
+        ),
     ):
         con = None
         try:
@@ -173,18 +301,13 @@ def create_sql_endpoint(
                     status_code=400, content="Only a single SELECT statement is allowed"
                 )
             table_names = [t.name for t in expr.find_all(exp.Table)]
-            _register_tables(con, basic_config, configs, table_names)
-
-            return await create_response(
-                request.url,
-                request.query_params,
-                format or request.headers["Accept"],
-                con,
-                sql,
-                basic_config=basic_config,
-                close_context=True,
+            _register_tables(con, catalog, table_names)
+            return await _guarded_response(
+                request, format, con, sql, catalog, basic_config
             )
         except Exception as e:
             if con:
                 con.close()
             raise e
+
+    return catalog
@@ -0,0 +1,60 @@
+import math
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            ch = ch * 2 + 1
+            rng[0] = mid
+        else:
+            ch = ch * 2
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            bit = 0
+            ch = 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision: int) -> tuple[float, float]:
+    """height (latitude) and width (longitude) of a cell in degrees"""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180 / 2**lat_bits, 360 / 2**lon_bits
+
+
+def geohash_cells(
+    min_lat: float,
+    max_lat: float,
+    min_lon: float,
+    max_lon: float,
+    precision: int,
+    max_cells: int,
+) -> list[str] | None:
+    """All geohash cells of the given precision intersecting the box, None if there are more than max_cells"""
+    height, width = geohash_cell_size(precision)
+    lat_start = math.floor((min_lat + 90) / height)
+    lat_end = min(math.floor((max_lat + 90) / height), round(180 / height) - 1)
+    lon_start = math.floor((min_lon + 180) / width)
+    lon_end = min(math.floor((max_lon + 180) / width), round(360 / width) - 1)
+    if (lat_end - lat_start + 1) * (lon_end - lon_start + 1) > max_cells:
+        return None
+    return [
+        geohash_encode(
+            (i + 0.5) * height - 90, (j + 0.5) * width - 180, precision
+        )  # cell centers
+        for i in range(lat_start, lat_end + 1)
+        for j in range(lon_start, lon_end + 1)
+    ]
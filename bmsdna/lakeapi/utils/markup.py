@@ -0,0 +1,101 @@
+import json
+import re
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+_XML_INVALID_NAME_CHARS = re.compile(r"[^\w.-]")
+
+
+def _escape(value: str) -> str:
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _xml_name(name: str) -> str:
+    name = _XML_INVALID_NAME_CHARS.sub("_", name)
+    return "_" + name if not name or not (name[0].isalpha() or name[0] == "_") else name
+
+
+def _to_text(column: pa.Array) -> pa.Array:
+    """The escaped text of each value, null stays null"""
+    if pa.types.is_nested(column.type):
+        text = pa.array(
+            [
+                None if v is None else json.dumps(v, default=str)
+                for v in column.to_pylist()
+            ],
+            pa.string(),
+        )
+    elif pa.types.is_binary(column.type) or pa.types.is_large_binary(column.type):
+        text = pa.array(
+            [None if v is None else v.hex() for v in column.to_pylist()], pa.string()
+        )
+    else:
+        text = pc.cast(column, pa.string())
+    for char, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;")):
+        text = pc.replace_substring(text, char, entity)
+    return text
+
+
+def _str(value: str) -> pa.StringScalar:
+    return pa.scalar(value, pa.string())
+
+
+def _join(*parts: pa.Array | pa.StringScalar) -> pa.Array:
+    """Concatenates the parts row by row, scalars are repeated for each row"""
+    return pc.call_function("binary_join_element_wise", [*parts, _str("")])
+
+
+def _write_rows(f, cells: list[pa.Array], start: str, end: str):
+    rows = _join(_str(start), *cells, _str(end))
+    # the rows are stored one after the other, so the data buffer is written without python strings
+    _, offsets_buffer, data = rows.buffers()
+    assert offsets_buffer is not None and data is not None
+    offsets = memoryview(offsets_buffer).cast("i")
+    f.write(data[offsets[rows.offset] : offsets[rows.offset + len(rows)]])
+
+
+def write_html(batches: pa.RecordBatchReader, out: str):
+    """Writes the batches as html table, like pandas' to_html. Only one batch is in memory at a time"""
+    with open(out, "wb") as f:
+        f.write(
+            b'<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n'
+        )
+        for name in batches.schema.names:
+            f.write(f"      <th>{_escape(name)}</th>\n".encode("utf-8"))
+        f.write(b"    </tr>\n  </thead>\n  <tbody>\n")
+        for batch in batches:
+            if batch.num_rows == 0:
+                continue
+            cells = [
+                _join(
+                    _str("      <td>"),
+                    pc.fill_null(_to_text(c), _str("")),
+                    _str("</td>\n"),
+                )
+                for c in batch.columns
+            ]
+            _write_rows(f, cells, "    <tr>\n", "    </tr>\n")
+        f.write(b"  </tbody>\n</table>")
+
+
+def write_xml(batches: pa.RecordBatchReader, out: str):
+    """Writes the batches as xml, like pandas' to_xml. Only one batch is in memory at a time"""
+    names = [_xml_name(n) for n in batches.schema.names]
+    with open(out, "wb") as f:
+        f.write(b'<?xml version="1.0" encoding="utf-8"?>\n<data>\n')
+        for batch in batches:
+            if batch.num_rows == 0:
+                continue
+            cells = []
+            for name, column in zip(names, batch.columns):
+                text = _to_text(column)
+                cells.append(
+                    pc.if_else(
+                        pc.is_null(text),
+                        _str(f"    <{name}/>\n"),
+                        _join(_str(f"    <{name}>"), text, _str(f"</{name}>\n")),
+                    )
+                )
+            _write_rows(f, cells, "  <row>\n", "  </row>\n")
+        f.write(b"</data>\n")
@@ -1,4 +1,5 @@
 import os
+import threading
 import duckdb
 from bmsdna.lakeapi.context.source_uri import SourceUri
 from deltalake2db import (
@@ -16,6 +17,7 @@ _cached_meta: dict[SourceUri, DeltaTableMeta] = {}
 
 _global_duck_con: Optional[duckdb.DuckDBPyConnection] = None
 _global_duck_meta_engine: Optional[DuckDBMetaEngine] = None
+_global_duck_lock = threading.Lock()  # metadata is read from several threads at startup
 
 DELTA_META_ENGINE = os.getenv("DELTA_META_ENGINE")
 
@@ -26,15 +28,16 @@ def get_deltalake_meta(use_polars: bool, uri: SourceUri):
     def duck_meta_engine():
         global _global_duck_con
         global _global_duck_meta_engine
-        if _global_duck_con is None:
-            _global_duck_con = duckdb.connect(":memory:")
-            _global_duck_con.execute("set azure_transport_option_type='curl'")
-            _global_duck_meta_engine = DuckDBMetaEngine(
-                _global_duck_con,
-                use_fsspec=os.getenv("DUCKDB_DELTA_USE_FSSPEC", "0") == "1",
-            )
-        assert _global_duck_meta_engine is not None
-        return _global_duck_meta_engine
+        with _global_duck_lock:
+            if _global_duck_con is None:
+                _global_duck_con = duckdb.connect(":memory:")
+                _global_duck_con.execute("set azure_transport_option_type='curl'")
+                _global_duck_meta_engine = DuckDBMetaEngine(
+                    _global_duck_con,
+                    use_fsspec=os.getenv("DUCKDB_DELTA_USE_FSSPEC", "0") == "1",
+                )
+            assert _global_duck_meta_engine is not None
+            return _global_duck_meta_engine
 
     if (
         use_polars and not DELTA_META_ENGINE == "duckdb"
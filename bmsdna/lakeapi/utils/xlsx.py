@@ -0,0 +1,109 @@
+import json
+import os
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+import pyarrow as pa
+
+XLSX_MAX_ROWS = 1_048_576  # per sheet, including the header
+XLSX_WIDTH_SAMPLE_ROWS = int(
+    os.getenv("XLSX_WIDTH_SAMPLE_ROWS", "1000")
+)  # rows used to estimate the column widths
+XLSX_MAX_COLUMN_WIDTH = 60
+
+
+def _cell_converter(type: pa.DataType) -> Optional[Callable[[Any], Any]]:
+    """Values xlsxwriter cannot write natively are written as text"""
+    if pa.types.is_nested(type):
+        return lambda v: None if v is None else json.dumps(v, default=str)
+    if pa.types.is_binary(type) or pa.types.is_large_binary(type):
+        return lambda v: None if v is None else v.hex()
+    return None
+
+
+def _display_length(value: Any) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, datetime):
+        return 19
+    return len(str(value))
+
+
+def estimate_column_widths(batch: pa.RecordBatch) -> list[float]:
+    """Column widths from the header and the first XLSX_WIDTH_SAMPLE_ROWS rows, as autofit would need all cells"""
+    sample = batch.slice(0, XLSX_WIDTH_SAMPLE_ROWS)
+    widths = []
+    for name, column in zip(sample.schema.names, sample.columns):
+        length = max(
+            [len(name)] + [_display_length(v) for v in column.to_pylist()],
+        )
+        widths.append(min(length + 2, XLSX_MAX_COLUMN_WIDTH))
+    return widths
+
+
+def write_xlsx(
+    batches: pa.RecordBatchReader,
+    out: str,
+    max_rows_per_sheet: int = XLSX_MAX_ROWS,
+):
+    """Writes the batches to an xlsx file without keeping them in memory. xlsxwriter's constant_memory mode
+    flushes every row once it is written. Rows exceeding max_rows_per_sheet continue on a new sheet"""
+    import xlsxwriter
+
+    schema = batches.schema
+    converters = [_cell_converter(f.type) for f in schema]
+    with xlsxwriter.Workbook(
+        out,
+        {
+            "constant_memory": True,
+            "remove_timezone": True,
+            "nan_inf_to_errors": True,
+            "strings_to_numbers": False,
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+            "default_date_format": "yyyy-mm-dd",
+        },
+    ) as workbook:
+        header_format = workbook.add_format({"bold": True})
+        datetime_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        column_formats = [
+            datetime_format if pa.types.is_timestamp(f.type) else None for f in schema
+        ]
+        widths: Optional[list[float]] = None
+        sheet = None
+        row = max_rows_per_sheet
+
+        def _finish_sheet():
+            if sheet is not None and len(schema) > 0:
+                sheet.autofilter(0, 0, row - 1, len(schema) - 1)
+
+        def _new_sheet():
+            nonlocal sheet, row
+            _finish_sheet()
+            sheet = workbook.add_worksheet()
+            for i, w in enumerate(widths or []):
+                sheet.set_column(i, i, w, column_formats[i])
+            sheet.write_row(0, 0, schema.names, header_format)
+            sheet.freeze_panes(1, 0)
+            row = 1
+
+        for batch in batches:
+            if batch.num_rows == 0:
+                continue
+            if widths is None:
+                widths = estimate_column_widths(batch)
+            columns = [
+                c.to_pylist() if conv is None else [conv(v) for v in c.to_pylist()]
+                for c, conv in zip(batch.columns, converters)
+            ]
+            for values in zip(*columns):
+                if row >= max_rows_per_sheet:
+                    _new_sheet()
+                assert sheet is not None
+                for col, value in enumerate(values):
+                    if value is not None:
+                        sheet.write(row, col, value, column_formats[col])
+                row += 1
+        if sheet is None:  # no rows, still write the header
+            _new_sheet()
+        _finish_sheet()
@@ -1,14 +1,95 @@
+"""Import and init time benchmark of the LakeAPI.
+
+python startup_perf.py            compares against the committed baseline in startup_perf.json, exits with 1 on a regression
+python startup_perf.py --update   stores the current timings as the new baseline
+
+Timings are the median of STARTUP_PERF_RUNS fresh interpreters. A timing regresses if it is more than
+STARTUP_PERF_TOLERANCE (relative, default 1.0, so twice the baseline) above the baseline. The tolerance is generous
+as the baseline comes from another machine. Importing bmsdna.lakeapi must not load any of LAZY_MODULES"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASELINE_FILE = os.getenv("STARTUP_PERF_BASELINE", "startup_perf.json")
+RUNS = int(os.getenv("STARTUP_PERF_RUNS", "5"))
+TOLERANCE = float(os.getenv("STARTUP_PERF_TOLERANCE", "1.0"))
+LAZY_MODULES = ["polars", "duckdb", "adlfs", "fsspec", "arrow_odbc"]
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import bmsdna.lakeapi
+print(json.dumps({"import": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+_INIT_SCRIPT = """
+import dataclasses, json, os, time
+start = time.perf_counter()
 from bmsdna.lakeapi.core.config import Configs, get_default_config
-import dataclasses
 from bmsdna.lakeapi.core.route import init_routes
-import os
 
-def_cfg = get_default_config()  # Get default startup config
 start_config = dataclasses.replace(
-    def_cfg, enable_sql_endpoint=True, data_path="tests/data"
-)
-real_config = Configs.from_yamls(
-    start_config, os.getenv("CONFIG_PATH", "config_test.yml")
+    get_default_config(), enable_sql_endpoint=True, data_path="tests/data"
 )
-router = init_routes(real_config, start_config)
-print("done")
+real_config = Configs.from_yamls(start_config, os.getenv("CONFIG_PATH", "config_test.yml"))
+configs_loaded = time.perf_counter()
+init_routes(real_config, start_config)
+print(json.dumps({"config": configs_loaded - start, "routes": time.perf_counter() - configs_loaded}))
+"""
+
+
+def _run(script: str) -> dict:
+    res = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+    lines = res.stdout.strip().splitlines()
+    # the exit code is not checked, interpreter teardown is not part of startup
+    if not lines:
+        raise RuntimeError(res.stderr)
+    return json.loads(lines[-1])
+
+
+def measure() -> tuple[dict[str, float], list[str]]:
+    imports = [_run(_IMPORT_SCRIPT) for _ in range(RUNS)]
+    inits = [_run(_INIT_SCRIPT) for _ in range(RUNS)]
+    timings = {
+        "import": statistics.median(r["import"] for r in imports),
+        "config": statistics.median(r["config"] for r in inits),
+        "routes": statistics.median(r["routes"] for r in inits),
+    }
+    loaded = [
+        m
+        for m in LAZY_MODULES
+        if any(n == m or n.startswith(m + ".") for n in imports[0]["modules"])
+    ]
+    return timings, loaded
+
+
+def main(update: bool) -> int:
+    timings, loaded = measure()
+    for key, value in timings.items():
+        print(f"{key}: {value:.3f}s")
+    failed = False
+    if loaded:
+        print(f"Importing bmsdna.lakeapi loads {', '.join(loaded)}")
+        failed = True
+    if update:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump({k: round(v, 3) for k, v in timings.items()}, f, indent=2)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 1 if failed else 0
+    if not os.path.exists(BASELINE_FILE):
+        print(f"No baseline {BASELINE_FILE}, create it with --update")
+        return 1
+    with open(BASELINE_FILE, encoding="utf-8") as f:
+        baseline: dict[str, float] = json.load(f)
+    for key, value in timings.items():
+        if key in baseline and value > baseline[key] * (1 + TOLERANCE):
+            print(f"{key} regressed: {value:.3f}s, baseline {baseline[key]:.3f}s")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main("--update" in sys.argv))
@@ -317,6 +317,18 @@ if __name__ == "__main__":
         con.execute("insert into fake select * from df_faker;")
 
     store_df_as_delta(df_faker, "delta/fake", partition_by=None)
+    from bmsdna.lakeapi.utils.geohash import geohash_encode
+
+    df_geohash = df_faker.copy()
+    df_geohash["geo_lat_geo_lon_geohash_prefix_4"] = [
+        geohash_encode(lat, lon, 4)
+        for lat, lon in zip(df_geohash["geo_lat"], df_geohash["geo_lon"])
+    ]
+    store_df_as_delta(
+        df_geohash,
+        "delta/fake_geohash",
+        partition_by=["geo_lat_geo_lon_geohash_prefix_4"],
+    )
     # store_df_as_delta(df_faker, "delta/fake_partition", partition_by=None)
 
     parquet_path = "tests/data/parquet/fake.parquet"
@@ -0,0 +1,169 @@
+from fastapi.testclient import TestClient
+from .utils import get_auth
+import sys
+
+sys.path.append(".")
+
+
+def test_auth_cache_and_throttling(client_no_auth: TestClient, monkeypatch):
+    import bmsdna.lakeapi.core.uservalidation as uservalidation
+
+    calls = []
+    is_correct = uservalidation.is_correct
+
+    def _is_correct(hash: str, pwd_str: str):
+        calls.append(pwd_str)
+        return is_correct(hash, pwd_str)
+
+    monkeypatch.setattr(uservalidation, "is_correct", _is_correct)
+    monkeypatch.setattr(uservalidation, "AUTH_MAX_FAILURES", 2)
+    monkeypatch.setattr(uservalidation, "_verified", type(uservalidation._verified)())
+    user, pwd = get_auth()
+    try:
+        for _ in range(3):
+            response = client_no_auth.get("/", auth=(user, pwd))
+            assert response.status_code == 200
+            assert response.json() == {"User": user}
+        assert calls == [pwd]  # verified once, then cached
+
+        for _ in range(2):
+            response = client_no_auth.get("/", auth=(user, "wrong"))
+            assert response.status_code == 401
+        response = client_no_auth.get("/", auth=(user, "wrong"))
+        assert response.status_code == 429
+        assert len(calls) == 3  # throttled without verifying
+
+        response = client_no_auth.get("/", auth=(user, pwd))
+        assert response.status_code == 200  # still cached
+    finally:
+        uservalidation._failures.pop(user.casefold(), None)
+
+
+def test_auth_middleware_passes_response_through(monkeypatch):
+    import argon2
+    import asyncio
+    import bmsdna.lakeapi.core.uservalidation as uservalidation
+
+    scopes = []
+
+    async def app(scope, receive, send):
+        scopes.append(scope)
+        if scope["type"] != "http":
+            return
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in (b"a", b"b"):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    user, pwd = get_auth()
+    monkeypatch.setattr(uservalidation, "userhashmap", None)
+    middleware = uservalidation.BasicAuthMiddleware(
+        app, users=[{"name": user, "passwordhash": argon2.PasswordHasher().hash(pwd)}]
+    )
+
+    async def receive():
+        return {"type": "lifespan.startup"}
+
+    async def send(message):
+        pass
+
+    asyncio.run(middleware({"type": "lifespan"}, receive, send))
+    assert [s["type"] for s in scopes] == ["lifespan"]  # no auth needed
+
+    client = TestClient(middleware)
+    assert client.get("/").status_code == 401
+    assert len(scopes) == 1  # app not called
+    response = client.get("/", auth=(user, pwd))
+    assert response.status_code == 200
+    assert response.content == b"ab"
+    assert scopes[-1]["user"] == {"username": user}
+
+
+def test_auth_throttled_while_queued(monkeypatch):
+    import anyio
+    import argon2
+    import threading
+    import bmsdna.lakeapi.core.uservalidation as uservalidation
+
+    calls = []
+    is_correct = uservalidation.is_correct
+
+    def _is_correct(hash: str, pwd_str: str):
+        calls.append(pwd_str)
+        return is_correct(hash, pwd_str)
+
+    monkeypatch.setattr(uservalidation, "is_correct", _is_correct)
+    monkeypatch.setattr(uservalidation, "AUTH_MAX_FAILURES", 2)
+    monkeypatch.setattr(uservalidation, "_verify_semaphore", threading.Semaphore(1))
+    hash = argon2.PasswordHasher().hash("secret")
+
+    async def _attempts():
+        # a single worker, all attempts are queued behind the first one
+        monkeypatch.setattr(uservalidation, "_verify_limiter", anyio.CapacityLimiter(1))
+        results = []
+
+        async def _attempt():
+            results.append(
+                await uservalidation.verify_credentials("queued", "wrong", hash)
+            )
+
+        async with anyio.create_task_group() as tg:
+            for _ in range(6):
+                tg.start_soon(_attempt)
+        return results
+
+    try:
+        results = anyio.run(_attempts)
+        assert sorted(results) == ["invalid"] * 2 + ["throttled"] * 4
+        assert len(calls) == 2  # no verification once throttled
+
+        calls.clear()
+        uservalidation._failures.pop("queued", None)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    uservalidation.verify_credentials_sync("queued", "wrong", hash)
+                )
+            )
+            for _ in range(6)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(results) == ["invalid"] * 2 + ["throttled"] * 4
+        assert len(calls) == 2
+    finally:
+        uservalidation._failures.pop("queued", None)
+
+
+def test_auth_middleware_websocket(monkeypatch):
+    import argon2
+    import base64
+    import pytest
+    from starlette.websockets import WebSocket, WebSocketDisconnect
+    import bmsdna.lakeapi.core.uservalidation as uservalidation
+
+    async def app(scope, receive, send):
+        websocket = WebSocket(scope, receive, send)
+        await websocket.accept()
+        await websocket.send_json(scope["user"])
+        await websocket.close()
+
+    user, pwd = get_auth()
+    monkeypatch.setattr(uservalidation, "userhashmap", None)
+    middleware = uservalidation.BasicAuthMiddleware(
+        app, users=[{"name": user, "passwordhash": argon2.PasswordHasher().hash(pwd)}]
+    )
+    client = TestClient(middleware)
+    with pytest.raises(WebSocketDisconnect) as err:
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_json()
+    assert err.value.code == 1008
+
+    token = base64.b64encode(f"{user}:{pwd}".encode()).decode()
+    with client.websocket_connect(
+        "/ws", headers={"Authorization": f"Basic {token}"}
+    ) as ws:
+        assert ws.receive_json() == {"username": user}
@@ -0,0 +1,75 @@
+from fastapi.testclient import TestClient
+from bmsdna.lakeapi.context.duckdb_replica import _replica_state
+import os
+import sys
+
+sys.path.append(".")
+
+
+def test_replica_matches_source(client: TestClient):
+    response = client.get("/api/v1/test/fruits?limit=-1&format=json")
+    assert response.status_code == 200
+    source = sorted(response.json(), key=lambda r: r["A"])
+    response = client.get("/api/v1/test/fruits_replica?limit=-1&format=json")
+    assert response.status_code == 200
+    replica = sorted(response.json(), key=lambda r: r["A"])
+    assert replica == source
+    assert any(
+        table_name == "test_fruits_replica" and os.path.exists(db_path)
+        for db_path, table_name in _replica_state.keys()
+    )
+
+
+def test_replica_filter(client: TestClient):
+    response = client.get(
+        "/api/v1/test/fruits_replica?limit=-1&format=json&fruits=banana"
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+    assert all(r["fruits"] == "banana" for r in response.json())
+
+
+def test_replica_indexes(client: TestClient):
+    import duckdb
+
+    client.get("/api/v1/test/fruits_replica?limit=1")
+    db_path = next(p for p, t in _replica_state.keys() if t == "test_fruits_replica")
+    with duckdb.connect(db_path, read_only=True) as con:
+        indexes = {
+            r[0]
+            for r in con.execute(
+                "SELECT index_name FROM duckdb_indexes() WHERE table_name='test_fruits_replica'"
+            ).fetchall()
+        }
+    assert indexes == {"test_fruits_replica__pk", "test_fruits_replica__ix0"}
+
+
+def test_replica_check_throttled(client: TestClient, monkeypatch):
+    import bmsdna.lakeapi.context.duckdb_replica as duckdb_replica
+
+    client.get("/api/v1/test/fruits_replica?limit=1")
+    checks = []
+    is_stale = duckdb_replica._is_stale
+    monkeypatch.setattr(
+        duckdb_replica,
+        "_is_stale",
+        lambda *args: checks.append(args) or is_stale(*args),
+    )
+    monkeypatch.setattr(duckdb_replica, "_last_checked", {})
+    for _ in range(3):
+        response = client.get("/api/v1/test/fruits_replica?limit=1")
+        assert response.status_code == 200
+    assert len(checks) == 1  # checked once per REPLICA_CHECK_INTERVAL
+
+
+def test_replica_deletion_vector_key():
+    from bmsdna.lakeapi.context.duckdb_replica import _action_key
+
+    add = {"path": "part-0.parquet"}
+    with_dv = {
+        **add,
+        "deletionVector": {"storageType": "u", "pathOrInlineDv": "abc", "offset": 1},
+    }
+    # the file is re-added with a deletion vector, which is no append
+    assert _action_key(add) != _action_key(with_dv)
+    assert _action_key(add) == "part-0.parquet"
@@ -0,0 +1,120 @@
+import dataclasses
+import json
+import sys
+
+import polars as pl
+import pyarrow.flight as flight
+import pytest
+
+from .utils import get_auth
+
+sys.path.append(".")
+
+
+@pytest.fixture(scope="module")
+def flight_client():
+    import bmsdna.lakeapi
+    from bmsdna.lakeapi.api.flight import LakeApiFlightServer
+    from bmsdna.lakeapi.core.config import Configs
+
+    cfg = dataclasses.replace(
+        bmsdna.lakeapi.get_default_config(), data_path="tests/data"
+    )
+    configs = Configs.from_yamls(cfg, "config_test.yml")
+    configs = dataclasses.replace(
+        configs,
+        configs=[
+            dataclasses.replace(c, allow_get_all_pages=True)
+            if c.name in ["fruits_partition", "fruits_partition_int"]
+            else c
+            for c in configs
+        ],
+    )
+    server = LakeApiFlightServer("grpc://127.0.0.1:0", configs, cfg, configs.users)
+    client = flight.connect(f"grpc://127.0.0.1:{server.port}")
+    yield client
+    client.close()
+    server.shutdown()
+
+
+def _descriptor(**request):
+    return flight.FlightDescriptor.for_command(json.dumps(request))
+
+
+def test_flight_auth(flight_client: flight.FlightClient):
+    with pytest.raises(flight.FlightUnauthenticatedError):
+        flight_client.get_flight_info(_descriptor(route="/api/v1/test/fruits"))
+    with pytest.raises(flight.FlightUnauthenticatedError):
+        flight_client.authenticate_basic_token("test", "wrong")
+
+
+def test_flight_get(flight_client: flight.FlightClient):
+    token = flight_client.authenticate_basic_token(*get_auth())
+    options = flight.FlightCallOptions(headers=[token])
+    info = flight_client.get_flight_info(
+        _descriptor(route="/api/v1/test/fruits", params={"cars": "audi"}),
+        options,
+    )
+    assert len(info.endpoints) == 1
+    table = flight_client.do_get(info.endpoints[0].ticket, options).read_all()
+    df = pl.read_delta("tests/data/delta/fruits").filter(pl.col("cars") == "audi")
+    assert table.num_rows == len(df) > 0
+    assert info.schema == table.schema
+
+
+@pytest.mark.parametrize("engine", ["duckdb", "polars"])
+def test_flight_partitions(flight_client: flight.FlightClient, engine):
+    token = flight_client.authenticate_basic_token(*get_auth())
+    options = flight.FlightCallOptions(headers=[token])
+    info = flight_client.get_flight_info(
+        _descriptor(route="/api/v1/test/fruits_partition", engine=engine), options
+    )
+    assert len(info.endpoints) > 1  # one per partition
+    rows = []
+    for endpoint in info.endpoints:
+        rows += flight_client.do_get(endpoint.ticket, options).read_all().to_pylist()
+    expected = pl.read_delta("tests/data/delta/fruits_partition")
+    assert sorted(r["A"] for r in rows) == sorted(expected["A"].to_list())
+
+    info = flight_client.get_flight_info(
+        _descriptor(route="/api/v1/test/fruits_partition", limit=3), options
+    )
+    assert len(info.endpoints) == 1
+
+
+@pytest.mark.parametrize("engine", ["duckdb", "polars"])
+def test_flight_partitions_int(flight_client: flight.FlightClient, engine):
+    token = flight_client.authenticate_basic_token(*get_auth())
+    options = flight.FlightCallOptions(headers=[token])
+    info = flight_client.get_flight_info(
+        _descriptor(route="/api/v1/test/fruits_partition_int", engine=engine), options
+    )
+    expected = pl.read_delta("tests/data/delta/fruits_partition_int")
+    assert len(info.endpoints) == expected["A"].n_unique()
+    for endpoint in info.endpoints:
+        partition = json.loads(endpoint.ticket.ticket)["partition"]
+        rows = flight_client.do_get(endpoint.ticket, options).read_all().to_pylist()
+        assert [r["A"] for r in rows] == [int(partition["A"])]
+
+
+def test_flight_without_params(flight_client: flight.FlightClient):
+    token = flight_client.authenticate_basic_token(*get_auth())
+    options = flight.FlightCallOptions(headers=[token])
+    info = flight_client.get_flight_info(
+        _descriptor(route="/api/v1/test/fake_delta", limit=5), options
+    )  # has a nearby config, but no nearby parameter
+    table = flight_client.do_get(info.endpoints[0].ticket, options).read_all()
+    assert table.num_rows == 5
+
+
+def test_flight_partition_values():
+    from datetime import date, datetime
+    from bmsdna.lakeapi.api.flight import _partition_value
+
+    assert _partition_value("3", "short") == 3
+    assert _partition_value("false", "boolean") is False
+    assert _partition_value("2024-02-29", "date") == date(2024, 2, 29)
+    assert _partition_value("2024-02-29 10:30:00", "timestamp") == datetime(
+        2024, 2, 29, 10, 30
+    )
+    assert _partition_value("a", "string") == "a"
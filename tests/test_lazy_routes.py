@@ -0,0 +1,59 @@
+from fastapi.testclient import TestClient
+from .utils import get_app, get_auth
+import sys
+import time
+
+sys.path.append(".")
+
+
+def _get_client(route_resolution: str):
+    client = TestClient(get_app(route_resolution=route_resolution))
+    client.auth = get_auth()
+    return client
+
+
+def _operation_paths(client: TestClient):
+    response = client.get("/openapi.json")
+    assert response.status_code == 200
+    return response.json()["paths"]
+
+
+def test_on_demand(client: TestClient):
+    lazy_client = _get_client("on_demand")
+    assert "/api/v1/test/fruits" not in _operation_paths(lazy_client)
+    assert lazy_client.get("/metadata").json() == []
+
+    url = "/api/v1/test/fruits?limit=-1&format=json&cars=audi"
+    response = lazy_client.get(url)
+    assert response.status_code == 200
+    assert response.json() == client.get(url).json()
+    assert "cars" in {
+        p["name"]
+        for p in _operation_paths(lazy_client)["/api/v1/test/fruits"]["get"][
+            "parameters"
+        ]
+    }
+    assert [m["route"] for m in lazy_client.get("/metadata").json()] == [
+        "/api/v1/test/fruits"
+    ]
+
+    assert "/api/v1/test/fruits/metadata_detail" in _operation_paths(lazy_client)
+    response = lazy_client.post("/api/v1/startest/fruits", json={})
+    assert response.status_code == 405  # only get is configured
+    response = lazy_client.post(
+        "/api/v1/test/fruits?limit=1", json={"cars": "not a list"}
+    )
+    assert response.status_code == 200
+    lazy_client.close()
+
+
+def test_background():
+    lazy_client = _get_client("background")
+    for _ in range(100):
+        if "/api/v1/test/fruits_partition" in _operation_paths(lazy_client):
+            break
+        time.sleep(0.2)
+    assert "/api/v1/test/fruits_partition" in _operation_paths(lazy_client)
+    response = lazy_client.get("/api/v1/test/fruits_partition?limit=1")
+    assert response.status_code == 200
+    lazy_client.close()
@@ -0,0 +1,49 @@
+import sys
+import pyarrow as pa
+
+sys.path.append(".")
+
+
+def test_models_shared_by_fingerprint():
+    from bmsdna.lakeapi.core.config import get_default_config
+    from bmsdna.lakeapi.core.model import (
+        create_parameter_model,
+        create_response_model,
+    )
+    from bmsdna.lakeapi.core.types import Param
+
+    address = pa.struct([("street", pa.string()), ("zip", pa.int32())])
+    schema = pa.schema(
+        [("name", pa.string()), ("home", address), ("work", address)],
+        metadata={"source": "ch"},
+    )
+    schema_de = pa.schema(
+        [("name", pa.string()), ("home", address), ("work", address)],
+        metadata={"source": "de"},
+    )
+    cfg = get_default_config()
+
+    model_ch = create_response_model("people_ch", schema, cfg)
+    assert create_response_model("people_de", schema_de, cfg) is model_ch
+    fields = model_ch.model_fields
+    assert fields["home"].annotation == fields["work"].annotation
+
+    other = pa.schema([("name", pa.string()), ("age", pa.int32())])
+    assert create_response_model("people_age", other, cfg) is not model_ch
+
+    params = [Param(name="name", operators=["=", "in"])]
+    get_ch = create_parameter_model(schema, "people_ch", params, None, None, "get")
+    assert (
+        create_parameter_model(schema_de, "people_de", params, None, None, "get")
+        is get_ch
+    )
+    assert (
+        create_parameter_model(schema, "people_ch", params, None, None, "post")
+        is not get_ch
+    )
+    assert (
+        "name_in"
+        in create_parameter_model(
+            schema, "people_ch", params, None, None, "post"
+        ).model_fields
+    )
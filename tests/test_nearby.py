@@ -38,3 +38,119 @@ def test_no_nearby(client: TestClient):
         lines = [json.loads(l) for l in response.text.split("\n") if len(l) > 0]
         assert len(lines) == 50
         assert "nearby" not in lines[0]
+
+
+def test_bounding_box():
+    import math
+    from bmsdna.lakeapi.endpoint.endpoint_nearby import get_bounding_box
+
+    def haversine(lat1, lon1, lat2, lon2):
+        return 6371000 * math.acos(
+            math.cos(math.radians(lat1))
+            * math.cos(math.radians(lat2))
+            * math.cos(math.radians(lon2) - math.radians(lon1))
+            + math.sin(math.radians(lat1)) * math.sin(math.radians(lat2))
+        )
+
+    min_lat, max_lat, min_lon, max_lon = get_bounding_box(46.7, 8.6, 10000)
+    assert min_lon is not None and max_lon is not None
+    # points just outside of the box are further away than the distance
+    assert haversine(46.7, 8.6, max_lat + 0.0001, 8.6) > 10000
+    assert haversine(46.7, 8.6, min_lat - 0.0001, 8.6) > 10000
+    assert haversine(46.7, 8.6, 46.7, max_lon + 0.0001) > 10000
+    assert haversine(46.7, 8.6, 46.7, min_lon - 0.0001) > 10000
+
+    assert get_bounding_box(89.99, 0, 10000)[2] is None  # pole
+    assert get_bounding_box(0, 179.99, 10000)[2] is None  # antimeridian
+
+
+@pytest.mark.parametrize(
+    "lat,lon",
+    [
+        (46.7, 8.6),
+        (89.8, 0),  # close to the pole, the box does not contain it
+        (89.95, 0),  # contains the north pole
+        (-89.8, 45),
+        (-89.95, 45),
+        (0, 179.8),  # close to the antimeridian
+        (0, 179.95),  # crosses it
+        (60, -179.95),
+    ],
+)
+def test_bounding_box_contains_circle(lat, lon):
+    import math
+    from bmsdna.lakeapi.endpoint.endpoint_nearby import get_bounding_box
+
+    distance_m = 10000
+    min_lat, max_lat, min_lon, max_lon = get_bounding_box(lat, lon, distance_m)
+    for dist in [distance_m / 2, distance_m]:
+        for bearing in range(0, 360, 5):
+            # the point at dist and bearing from lat/lon, on a sphere
+            d = dist / 6371000
+            b = math.radians(bearing)
+            lat1, lon1 = math.radians(lat), math.radians(lon)
+            lat2 = math.asin(
+                math.sin(lat1) * math.cos(d)
+                + math.cos(lat1) * math.sin(d) * math.cos(b)
+            )
+            lon2 = lon1 + math.atan2(
+                math.sin(b) * math.sin(d) * math.cos(lat1),
+                math.cos(d) - math.sin(lat1) * math.sin(lat2),
+            )
+            p_lat = math.degrees(lat2)
+            p_lon = (math.degrees(lon2) + 540) % 360 - 180
+            assert min_lat - 1e-9 <= p_lat <= max_lat + 1e-9
+            if min_lon is not None and max_lon is not None:
+                assert min_lon - 1e-9 <= p_lon <= max_lon + 1e-9
+
+
+@pytest.mark.parametrize("engine", engines)
+def test_nearby_geohash_partition(client: TestClient, engine):
+    import math
+    import polars as pl
+
+    def radians(col: str):
+        return pl.col(col) * (math.pi / 180)
+
+    lat, lon = math.radians(46.7), math.radians(8.6)
+    # all rows within the distance, with the haversine of the endpoint
+    expected = (
+        pl.read_delta("tests/data/delta/fake_geohash")
+        .filter(
+            6371000
+            * (
+                math.cos(lat)
+                * radians("geo_lat").cos()
+                * (radians("geo_lon") - lon).cos()
+                + math.sin(lat) * radians("geo_lat").sin()
+            ).arccos()
+            <= 10000
+        )["name"]
+        .sort()
+        .to_list()
+    )
+    assert len(expected) > 0
+    response = client.post(
+        f"/api/v1/test/fake_delta_geohash?limit=-1&format=json&%24engine={engine}",
+        json={"nearby": {"lat": 46.7, "lon": 8.6, "distance_m": 10000}},
+    )
+    assert response.status_code == 200
+    assert sorted(r["name"] for r in response.json()) == expected
+
+
+def test_geohash_partition_filter():
+    from bmsdna.lakeapi.core.model import GeoModel
+    from bmsdna.lakeapi.core.types import NearbyConfig
+    from bmsdna.lakeapi.endpoint.endpoint_nearby import get_nearby_partition_filter
+    from bmsdna.lakeapi.utils.geohash import geohash_encode
+
+    nearby = GeoModel(lat=46.7, lon=8.6, distance_m=10000)
+    cfg = NearbyConfig(name="nearby", lat_col="geo_lat", lon_col="geo_lon")
+    filters = get_nearby_partition_filter(
+        [(nearby, cfg)], ["geo_lat_geo_lon_geohash_prefix_4", "other"]
+    )
+    assert len(filters) == 1
+    col, op, cells = filters[0]
+    assert col == "geo_lat_geo_lon_geohash_prefix_4" and op == "in"
+    for lat, lon in [(46.7, 8.6), (46.78, 8.6), (46.62, 8.6), (46.7, 8.72)]:
+        assert geohash_encode(lat, lon, 4) in cells
@@ -0,0 +1,111 @@
+import sys
+
+import pyarrow as pa
+import pytest
+
+sys.path.append(".")
+
+
+class FakeArrowOdbc:
+    """Stands in for arrow_odbc, the batches come from a table instead of a database"""
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self.queries: list[str] = []
+        self.kwargs: list[dict] = []
+
+    def read_arrow_batches_from_odbc(self, query: str, **kwargs):
+        self.queries.append(query)
+        self.kwargs.append(kwargs)
+        return self.table.to_reader(max_chunksize=2)
+
+
+@pytest.fixture
+def fake_odbc(monkeypatch):
+    import bmsdna.lakeapi.context.df_odbc as df_odbc
+
+    fake = FakeArrowOdbc(pa.table({"id": [1, 2, 3], "name": ["a", "b", "c"]}))
+    monkeypatch.setattr(df_odbc, "_get_arrow_odbc", lambda: fake)
+    monkeypatch.setattr(df_odbc, "_schema_cache", type(df_odbc._schema_cache)())
+    return fake
+
+
+def test_odbc_schema_cached(fake_odbc: FakeArrowOdbc, monkeypatch):
+    import bmsdna.lakeapi.context.df_odbc as df_odbc
+
+    for _ in range(2):
+        res = df_odbc.ODBCResultData("SELECT * FROM t", "Driver=fake", 10)
+        assert res.arrow_schema().names == ["id", "name"]
+    assert len(fake_odbc.queries) == 1  # a single schema query
+
+    monkeypatch.setattr(df_odbc, "ODBC_SCHEMA_CACHE_TTL", -1)
+    df_odbc._schema_cache.clear()
+    for _ in range(2):
+        df_odbc.ODBCResultData("SELECT * FROM t", "Driver=fake", 10).arrow_schema()
+    assert len(fake_odbc.queries) == 3  # expired right away
+
+
+def test_odbc_max_bytes_per_batch(fake_odbc: FakeArrowOdbc, monkeypatch):
+    import asyncio
+    import bmsdna.lakeapi.context.df_odbc as df_odbc
+
+    res = df_odbc.ODBCResultData("SELECT * FROM t", "Driver=fake", 10)
+    asyncio.run(res.to_arrow_recordbatch())
+    assert "max_bytes_per_batch" not in fake_odbc.kwargs[-1]  # library default
+
+    monkeypatch.setattr(df_odbc, "ODBC_MAX_BYTES_PER_BATCH", 1024)
+    asyncio.run(res.to_arrow_recordbatch())
+    assert fake_odbc.kwargs[-1]["max_bytes_per_batch"] == 1024
+
+
+def _reader(batches: int):
+    table = pa.table({"id": list(range(batches))})
+    return table.to_reader(max_chunksize=1)
+
+
+def test_batch_reader_prefetch():
+    from bmsdna.lakeapi.context.df_odbc import BatchReaderWrap
+
+    with BatchReaderWrap(_reader(10), prefetch=2) as batches:
+        assert [b["id"][0].as_py() for b in batches] == list(range(10))
+
+
+def test_batch_reader_prefetch_error():
+    from bmsdna.lakeapi.context.df_odbc import BatchReaderWrap
+
+    def _fail():
+        yield pa.record_batch({"id": [1]})
+        raise KeyboardInterrupt()  # not an Exception
+
+    rdr = pa.RecordBatchReader.from_batches(pa.schema({"id": pa.int64()}), _fail())
+    with pytest.raises(BaseException):
+        list(BatchReaderWrap(rdr, prefetch=2))
+
+
+def test_batch_reader_cancel():
+    import threading
+    from bmsdna.lakeapi.context.df_base import QueryCancelledError
+    from bmsdna.lakeapi.context.df_odbc import BatchReaderWrap
+
+    for prefetch in (0, 2):
+        cancel = threading.Event()
+        fetched = []
+        with pytest.raises(QueryCancelledError):
+            for batch in BatchReaderWrap(_reader(100), prefetch, cancel):
+                fetched.append(batch)
+                cancel.set()
+        assert len(fetched) < 100
+
+
+def test_batch_reader_in_memory_no_thread(fake_odbc: FakeArrowOdbc):
+    import asyncio
+    import threading
+    import bmsdna.lakeapi.context.df_odbc as df_odbc
+
+    res = df_odbc.ODBCResultData("SELECT * FROM t", "Driver=fake", 10)
+    asyncio.run(res.get_df())
+    threads = threading.active_count()
+    batches = asyncio.run(res.to_arrow_recordbatch())
+    assert batches.prefetch == 0
+    assert sum(b.num_rows for b in batches) == 3
+    assert threading.active_count() == threads
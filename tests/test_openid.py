@@ -10,6 +10,11 @@ auth = get_auth()
 engines = ("duckdb", "polars")
 
 
+def _ref(paths: dict, route: str, method: str) -> str:
+    content = paths[route][method]["responses"]["200"]["content"]
+    return content["application/json"]["schema"]["$ref"].split("/")[-1]
+
+
 def test_openid():
     for engine in engines:
         client = TestClient(get_app(default_engine=engine))
@@ -20,9 +25,14 @@ def test_openid():
         paths = jsd["paths"]
         schema = jsd["components"]["schemas"]
         ## TODO : Add more tests for different endpoints
-        assert "test_fake_delta_partition" in schema.keys()
-        assert "test_fake_polars_postParameter" in schema.keys()
-        assert "abc" in schema["test_fake_polars_postParameter"]["properties"]
+        # routes with the same schema and params share their models
+        partition_ref = _ref(paths, "/api/v1/test/fake_delta_partition", "get")
+        assert partition_ref in schema.keys()
+        assert partition_ref == _ref(paths, "/api/v1/test/fake_delta", "get")
+        post_ref = paths["/api/v1/test/fake_polars"]["post"]["requestBody"]["content"][
+            "application/json"
+        ]["schema"]["$ref"].split("/")[-1]
+        assert "abc" in schema[post_ref]["properties"]
         assert "/api/v1/startest/fruits" in paths
         assert isinstance(paths["/api/v1/startest/fruits"], dict)
         assert len(paths["/api/v1/startest/fruits"].keys()) == 1
@@ -95,3 +95,88 @@ def test_data_arrow_stream(client: TestClient):
             with pa.ipc.open_stream(fl) as reader:
                 df = reader.read_pandas()
                 assert df["A"][0] == 2
+
+
+def test_transcode_chunks():
+    import asyncio
+    from bmsdna.lakeapi.core.response import transcode
+
+    text = "äöü € " * 1000
+    data = text.encode("utf-8")
+
+    async def _chunks():
+        for i in range(0, len(data), 7):  # splits characters
+            yield data[i : i + 7]
+
+    async def _collect(charset: str, preamble: bytes = b""):
+        return b"".join([c async for c in transcode(_chunks(), charset, preamble)])
+
+    assert asyncio.run(_collect("utf-16", b"sep=,\n")) == b"sep=,\n" + text.encode(
+        "utf-16"
+    )  # one BOM only
+    assert asyncio.run(_collect("cp850")) == text.encode("cp850", errors="replace")
+
+
+def test_unknown_encoding(client: TestClient):
+    response = client.get("/api/v1/test/fruits?limit=1&format=csv&$encoding=nope")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("format", ["csv", "json", "ndjson"])
+def test_compressed_response(client: TestClient, monkeypatch, format):
+    import bmsdna.lakeapi.core.response as response_module
+
+    monkeypatch.setattr(response_module, "RESPONSE_COMPRESSION_MIN_SIZE", 0)
+    url = f"/api/v1/test/fruits?limit=1000&format={format}"
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    compressed = client.get(url, headers={"Accept-Encoding": "br;q=0, gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.content == plain.content  # decompressed by the client
+
+    response = client.get(
+        "/api/v1/test/fruits?limit=1000&format=parquet",
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert "content-encoding" not in response.headers  # parquet is compressed
+
+    response = client.get(
+        url + "&$arrow_compression=zstd", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"  # only applies to arrow
+
+
+@pytest.mark.parametrize("engine", engines)
+def test_parquet_and_arrow_compression(client: TestClient, engine):
+    import io
+    import pyarrow.parquet as pq
+
+    response = client.get(
+        f"/api/v1/test/fruits?limit=1000&format=parquet&%24engine={engine}&$parquet_compression=zstd&$parquet_compression_level=5"
+    )
+    assert response.status_code == 200
+    meta = pq.ParquetFile(io.BytesIO(response.content)).metadata
+    assert meta.row_group(0).column(0).compression == "ZSTD"
+
+    response = client.get(
+        f"/api/v1/test/fruits?limit=1000&format=arrow&%24engine={engine}&$arrow_compression=lz4"
+    )
+    assert response.status_code == 200
+    assert pa.ipc.open_file(io.BytesIO(response.content)).read_all().num_rows > 0
+
+    response = client.get(
+        "/api/v1/test/fruits?limit=1000&format=parquet&$parquet_compression=nope"
+    )
+    assert response.status_code == 400
+    for params in [
+        "$parquet_compression_level=5",  # snappy has no level
+        "$parquet_compression=lz4&$parquet_compression_level=5",
+        "$parquet_compression=none&$parquet_compression_level=1",
+        "$parquet_compression=gzip&$parquet_compression_level=99",
+        "$parquet_compression=zstd&$parquet_compression_level=abc",
+    ]:
+        response = client.get(
+            f"/api/v1/test/fruits?limit=1000&format=parquet&%24engine={engine}&{params}"
+        )
+        assert response.status_code == 400, params
@@ -73,3 +73,53 @@ async def test_async_execution(client: TestClient):
                 tasks.append(run_in_threadpool(call_api_4, e, f))
     print(f"Running {len(tasks)} tasks")
     await asyncio.gather(*tasks)
+
+
+def test_parallel_schema_discovery(app, monkeypatch):
+    import threading
+    import bmsdna.lakeapi.core.route as route
+
+    basic_config, configs = route.all_lake_api_routers[0]
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def _discover_schema(config, configs, basic_config, mgr):
+        with lock:
+            running.append(config)
+            max_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(config)
+        return None, {"route": config.route}
+
+    monkeypatch.setattr(route, "_discover_schema", _discover_schema)
+    monkeypatch.setattr(route, "ROUTE_INIT_WORKERS_PER_ACCOUNT", 3)
+    start = time.time()
+    res = route.discover_schemas(configs, basic_config)
+    assert time.time() - start < 0.05 * len(list(configs)) / 2
+    assert (
+        1
+        < max(max_running)
+        <= 3 * len({c.datasource.account for c in configs if c.datasource})
+    )
+    assert [m["route"] for _, m in res] == [c.route for c in configs]
+
+
+def test_lazy_imports():
+    import subprocess
+
+    from startup_perf import LAZY_MODULES
+
+    res = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, bmsdna.lakeapi; print(' '.join(sorted(sys.modules)))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    loaded = set(res.stdout.split())
+    assert [m for m in LAZY_MODULES if m in loaded] == []
@@ -0,0 +1,91 @@
+import dataclasses
+import os
+import sys
+import time
+import yaml
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.append(".")
+
+
+def _table(name: str, uri: str, params: list[str]):
+    return {
+        "name": name,
+        "tag": "reload",
+        "params": params,
+        "datasource": {"uri": uri, "file_type": "delta"},
+    }
+
+
+def _write_config(path: str, tables: list[dict]):
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump({"tables": tables}, f)
+    mtime = time.time() + len(tables)  # reloads are detected by modification time
+    os.utime(path, (mtime, mtime))
+
+
+def _paths(client: TestClient):
+    return client.get("/openapi.json").json()["paths"]
+
+
+def test_config_reload(tmp_path):
+    import bmsdna.lakeapi
+
+    config_path = str(tmp_path / "config.yml")
+    unchanged = _table("fruits", "delta/fruits", ["cars"])
+    _write_config(
+        config_path, [unchanged, _table("removed", "delta/fruits", ["fruits"])]
+    )
+    app = FastAPI()
+    cfg = dataclasses.replace(
+        bmsdna.lakeapi.get_default_config(),
+        data_path="tests/data",
+        config_reload_interval=3600,  # checked manually
+    )
+    start_info = bmsdna.lakeapi.init_lakeapi(app, False, cfg, config_path)
+    assert start_info.reloader is not None
+    client = TestClient(app)
+    unchanged_routes = [
+        r for r in app.routes if getattr(r, "path", None) == "/api/v1/reload/fruits"
+    ]
+    assert client.get("/api/v1/reload/removed?limit=1").status_code == 200
+    assert not start_info.reloader.check()
+
+    _write_config(
+        config_path,
+        [
+            unchanged,
+            _table("added", "delta/fruits", ["fruits"]),
+            _table("changed", "delta/fruits", ["fruits"]),
+        ],
+    )
+    assert start_info.reloader.check()
+    _write_config(
+        config_path,
+        [
+            unchanged,
+            _table("added", "delta/fruits", ["fruits"]),
+            _table("changed", "delta/fruits", ["cars"]),
+        ],
+    )
+    assert start_info.reloader.check()
+
+    assert client.get("/api/v1/reload/removed?limit=1").status_code == 404
+    assert "/api/v1/reload/removed" not in _paths(client)
+    response = client.get("/api/v1/reload/added?limit=-1&fruits=banana")
+    assert response.status_code == 200
+    assert {r["fruits"] for r in response.json()} == {"banana"}
+    params = {
+        p["name"] for p in _paths(client)["/api/v1/reload/changed"]["get"]["parameters"]
+    }
+    assert "cars" in params and "fruits" not in params
+    assert [
+        r for r in app.routes if getattr(r, "path", None) == "/api/v1/reload/fruits"
+    ] == unchanged_routes  # not recreated
+    assert [m["route"] for m in client.get("/metadata").json()] == [
+        "/api/v1/reload/fruits",
+        "/api/v1/reload/added",
+        "/api/v1/reload/changed",
+    ]
+    start_info.reloader.stop()
@@ -7,3 +7,77 @@ def test_schema():
     from bmsdna.lakeapi.tools.validateschema import validate_schema
 
     validate_schema("config_schema.json", "config_test.yml")
+
+
+def test_schema_catalog(tmp_path):
+    import dataclasses
+    import time
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from bmsdna.lakeapi.context.source_uri import SourceUri
+    from bmsdna.lakeapi.core.config import get_default_config
+    from bmsdna.lakeapi.core.schema_cache import (
+        SCHEMA_CATALOG_FILE,
+        SchemaCatalog,
+        get_schema_cached,
+        get_schema_catalog,
+        _get_source_version as catalog_version,
+    )
+
+    class FakeDatasource:
+        def __init__(self, file_type: str, path: str):
+            self.config = dataclasses.make_dataclass("C", ["file_type"])(file_type)
+            self.source_uri = SourceUri(path, None, None, None)
+            self.reads = 0
+
+        def file_exists(self):
+            return self.source_uri.exists()
+
+        def get_schema(self):
+            self.reads += 1
+            return pq.read_schema(self.source_uri.real_uri)
+
+    cfg = dataclasses.replace(get_default_config(), temp_folder_path=str(tmp_path))
+    data_path = str(tmp_path / "data.parquet")
+    pq.write_table(pa.table({"a": [1]}), data_path)
+    ds = FakeDatasource("parquet", data_path)
+
+    assert get_schema_cached(cfg, ds, "key").names == ["a"]
+    assert get_schema_cached(cfg, ds, "key").names == ["a"]
+    assert ds.reads == 1
+
+    get_schema_catalog(cfg).save()  # type: ignore
+    restarted = SchemaCatalog(str(tmp_path / SCHEMA_CATALOG_FILE), 300)
+    assert restarted.get("key", catalog_version(ds)).names == ["a"]  # type: ignore
+    time.sleep(0.01)  # a new modification time
+
+    pq.write_table(pa.table({"a": [1], "b": [2]}), data_path)
+    assert get_schema_cached(cfg, ds, "key").names == ["a", "b"]
+    assert ds.reads == 2
+
+    # sources without version fall back to the ttl
+    odbc = FakeDatasource("odbc", data_path)
+    get_schema_cached(cfg, odbc, "odbc")
+    get_schema_cached(cfg, odbc, "odbc")
+    assert odbc.reads == 1
+
+
+def test_schema_catalog_merge(tmp_path):
+    import pyarrow as pa
+    from bmsdna.lakeapi.core.schema_cache import SchemaCatalog
+
+    path = str(tmp_path / "catalog.json")
+    # two workers sharing the file
+    first = SchemaCatalog(path, 300)
+    second = SchemaCatalog(path, 300)
+    first.set("a", "1", pa.schema({"a": pa.int64()}))
+    second.set("b", "1", pa.schema({"b": pa.int64()}))
+    first.save()
+    second.save()
+    merged = SchemaCatalog(path, 300)
+    assert merged.get("a", "1").names == ["a"]  # type: ignore
+    assert merged.get("b", "1").names == ["b"]  # type: ignore
+
+    first.set("b", "2", pa.schema({"b": pa.string()}))  # newer than the one of second
+    first.save()
+    assert SchemaCatalog(path, 300).get("b", "2").types == [pa.string()]  # type: ignore
@@ -2,7 +2,7 @@ import sys
 
 sys.path.append(".")
 
-engines = ["duckdb"]
+engines = ["duckdb", "polars"]
 
 
 from fastapi.testclient import TestClient
@@ -42,3 +42,148 @@ def test_no_search(client: TestClient):
         assert len(jsd) >= 3
         assert len(jsd) <= 5
         assert "search_score" not in jsd[0]
+
+
+def test_search_index_single_build():
+    from datetime import datetime, timezone
+    import os
+    from bmsdna.lakeapi.context.df_duckdb import (
+        schedule_search_index_build,
+        get_search_index_path,
+    )
+    from bmsdna.lakeapi.context.source_uri import SourceUri
+    from bmsdna.lakeapi.core.types import SearchConfig
+
+    uri = SourceUri("parquet/search.parquet", None, {}, "tests/data")
+    search_configs = [SearchConfig(name="search", columns=["email", "name"])]
+    modified_date = datetime.now(tz=timezone.utc)
+    builds = [
+        schedule_search_index_build(
+            "test_search_single_build",
+            None,
+            uri,
+            "parquet",
+            search_configs,
+            modified_date,
+        )
+        for _ in range(3)
+    ]
+    assert builds[0] is builds[1] and builds[1] is builds[2]
+    builds[0].result()
+    path = get_search_index_path("test_search_single_build")
+    assert abs(os.path.getmtime(path) - modified_date.timestamp()) < 0.01
+    os.remove(path)
+
+
+def test_search_index_incremental(tmp_path):
+    from datetime import datetime, timezone, timedelta
+    import os
+    import duckdb
+    import pyarrow as pa
+    from deltalake import write_deltalake, DeltaTable
+    from bmsdna.lakeapi.context.df_duckdb import (
+        _build_search_index,
+        get_search_index_path,
+    )
+    from bmsdna.lakeapi.context.source_uri import SourceUri
+
+    delta_path = str(tmp_path / "search_delta")
+    write_deltalake(delta_path, pa.table({"id": [1, 2], "txt": ["apple", "pear"]}))
+    uri = SourceUri(delta_path, None, {}, None)
+    now = datetime.now(tz=timezone.utc)
+
+    def _docs(version: int):
+        _build_search_index(
+            "test_search_incremental",
+            None,
+            uri,
+            "delta",
+            ["txt"],
+            now + timedelta(seconds=version),
+        )
+        with duckdb.connect(
+            get_search_index_path("test_search_incremental"), read_only=True
+        ) as con:
+            con.load_extension("fts")
+            return con.execute(
+                """SELECT id, __search_id, fts_main_test_search_incremental.match_bm25(__search_id, 'apple')
+                    FROM test_search_incremental ORDER BY id"""
+            ).fetchall()
+
+    first = _docs(0)
+    write_deltalake(
+        delta_path, pa.table({"id": [3], "txt": ["apple tree"]}), mode="append"
+    )
+    second = _docs(1)
+    assert [(r[0], r[1]) for r in second[:2]] == [(r[0], r[1]) for r in first]
+    assert second[2][0] == 3 and second[2][2] is not None
+    DeltaTable(delta_path).delete("id = 1")
+    third = _docs(2)
+    assert [r[0] for r in third] == [2, 3]
+    assert third[1][1] == second[2][1]  # the file of id 3 was not touched
+    os.remove(get_search_index_path("test_search_incremental"))
+
+
+def test_search_delta(client: TestClient):
+    for e in engines:
+        response = client.get(
+            f"/api/v1/test/search_delta?limit=10&format=json&%24engine={e}&search=banana"
+        )
+        assert response.status_code == 200
+        jsd = response.json()
+        assert sorted(r["A"] for r in jsd) == [1, 2, 5]
+        assert all(r["search_score"] is not None for r in jsd)
+
+
+def test_search_index_deletion_vectors(tmp_path, monkeypatch):
+    import duckdb
+    import pyarrow as pa
+    from deltalake import write_deltalake
+    import bmsdna.lakeapi.context.df_duckdb as df_duckdb
+    from bmsdna.lakeapi.context.source_uri import SourceUri
+    from bmsdna.lakeapi.utils.meta_cache import get_deltalake_meta
+
+    delta_path = str(tmp_path / "search_dv")
+    write_deltalake(delta_path, pa.table({"id": [1, 2], "txt": ["apple", "pear"]}))
+    uri = SourceUri(delta_path, None, {}, None)
+    meta = get_deltalake_meta(False, uri)
+    with duckdb.connect() as con:
+        assert df_duckdb._update_search_table_delta(con, "dv_test", uri)
+        for ac in meta.add_actions.values():
+            ac["deletionVector"] = {"storageType": "i", "pathOrInlineDv": "x"}
+        monkeypatch.setattr(df_duckdb, "get_deltalake_meta", lambda *args: meta)
+        assert not df_duckdb._update_search_table_delta(con, "dv_test", uri)
+
+
+def test_search_file_key():
+    from bmsdna.lakeapi.context.df_duckdb import _search_file_key
+
+    # the same path added again is another file
+    assert _search_file_key(
+        {"path": "a.parquet", "modificationTime": 1}
+    ) != _search_file_key({"path": "a.parquet", "modificationTime": 2})
+
+
+def test_polars_search_index_filters():
+    from bmsdna.lakeapi.context.df_polars import PolarsExecutionContext
+    from bmsdna.lakeapi.context.polars_search import _indexes
+    from bmsdna.lakeapi.context.source_uri import SourceUri
+    from bmsdna.lakeapi.core.types import SearchConfig
+
+    uri = SourceUri("delta/fruits_partition_int", None, {}, "tests/data")
+    search_configs = [SearchConfig(name="search", columns=["fruits"])]
+    found = []
+    for a in ["1", "3"]:  # partition values are strings
+        ctx = PolarsExecutionContext(chunk_size=1000)
+        ctx.register_datasource(
+            "search_part_int", None, uri, "delta", filters=[("A", "=", a)]
+        )
+        ctx.init_search("search_part_int", search_configs)
+        df = ctx._to_register["search_part_int"].lazy().collect()
+        found.append(df["A"].to_list())
+        ctx.close()
+    assert found == [[1], [3]]
+    # one index for the source, whatever the filters
+    assert [k for k in _indexes.keys() if k[0] == "search_part_int"] == [
+        ("search_part_int", ("fruits",))
+    ]
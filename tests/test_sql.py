@@ -11,6 +11,27 @@ def test_tables(client: TestClient):
         assert len(tables) > 5
 
 
+def test_tables_cached(client: TestClient, monkeypatch):
+    from bmsdna.lakeapi.core.datasource import Datasource
+
+    first = client.get("/api/sql/tables").json()
+    assert "startest_fruits" in first
+    assert "mssql_mssql_department" not in first
+    checks = []
+    orig_exists = Datasource.file_exists
+    monkeypatch.setattr(
+        Datasource,
+        "file_exists",
+        lambda self: checks.append(self.unique_table_name) or orig_exists(self),
+    )
+    assert client.get("/api/sql/tables").json() == first
+    response = client.get(
+        "/api/sql?sql=SELECT distinct A FROM startest_fruits join test_fruits using (A)"
+    )
+    assert response.status_code == 200
+    assert checks == []  # existence is taken from the catalog
+
+
 def test_get(client: TestClient):
     for e in engines:
         response = client.get(
@@ -80,3 +101,151 @@ def test_sql_where_get(client: TestClient):
             "cars": "audi",
         }
     ]
+
+
+def test_sql_timeout(client: TestClient, monkeypatch):
+    monkeypatch.setattr("bmsdna.lakeapi.endpoint.sql_cost.SQL_MAX_ESTIMATED_ROWS", None)
+    import time
+
+    start = time.monotonic()
+    response = client.get(
+        "/api/sql?%24timeout=0.5&sql=SELECT sum(hash(i)) AS s FROM range(100000000000) t(i)"
+    )
+    assert response.status_code == 504
+    assert time.monotonic() - start < 20  # the query got interrupted
+
+    for invalid in ["abc", "nan", "inf", "-1", "0"]:
+        response = client.get(f"/api/sql?%24timeout={invalid}&sql=SELECT 1 AS a")
+        assert response.status_code == 400
+    response = client.get("/api/sql?%24timeout=30&sql=SELECT 1 AS a")
+    assert response.status_code == 200
+    assert response.json() == [{"a": 1}]
+
+
+def test_sql_timeout_file_format(client: TestClient, monkeypatch):
+    monkeypatch.setattr("bmsdna.lakeapi.endpoint.sql_cost.SQL_MAX_ESTIMATED_ROWS", None)
+    response = client.get(
+        "/api/sql?format=csv&%24timeout=0.5&sql=SELECT sum(hash(i)) AS s FROM range(100000000000) t(i)"
+    )
+    assert response.status_code == 504
+
+
+def test_interrupt_on_disconnect():
+    import anyio
+    import pytest
+    from bmsdna.lakeapi.context import get_context_by_engine
+    from bmsdna.lakeapi.core.response import QueryInterrupted, run_interruptible
+
+    async def _is_disconnected():
+        return True
+
+    con = get_context_by_engine("duckdb", 10000)
+    res = con.execute_sql("SELECT sum(hash(i)) AS s FROM range(100000000000) t(i)")
+    with pytest.raises(QueryInterrupted) as err:
+        anyio.run(run_interruptible, con, res.to_pylist, _is_disconnected, None)
+    assert err.value.reason == "disconnect"
+    assert con.cancel_event.is_set()
+    con.close()
+
+
+def test_interruptible_releases_context():
+    import gc
+    import weakref
+    import anyio
+    from bmsdna.lakeapi.context import get_context_by_engine
+    from bmsdna.lakeapi.core.response import run_interruptible
+
+    async def _is_disconnected():
+        return False
+
+    async def _fail():
+        raise ValueError("failed")
+
+    async def _run():
+        con = get_context_by_engine("duckdb", 10000)
+        ref = weakref.ref(con)
+        try:
+            await run_interruptible(con, _fail, _is_disconnected, 30)
+        except ValueError:
+            pass
+        del con
+        return ref() is None
+
+    gc.disable()
+    try:
+        # freed by refcounting, an attached file would stay attached otherwise
+        assert anyio.run(_run)
+    finally:
+        gc.enable()
+
+
+def test_sql_cost_guard(client: TestClient, monkeypatch):
+    import bmsdna.lakeapi.endpoint.sql_cost as sql_cost
+
+    cross_join = "/api/sql?sql=SELECT a.A FROM test_fruits a, test_fruits b, test_fruits c, test_fruits d"
+    assert client.get(cross_join).status_code == 200
+    monkeypatch.setattr(sql_cost, "SQL_MAX_ESTIMATED_ROWS", 1000)
+    response = client.get(cross_join)
+    assert response.status_code == 400
+    assert "estimated" in response.text
+    assert client.get("/api/sql?sql=SELECT * FROM test_fruits").status_code == 200
+
+    monkeypatch.setattr(sql_cost, "SQL_MAX_SCANNED_BYTES", 10)
+    response = client.get("/api/sql?sql=SELECT * FROM test_fruits")
+    assert response.status_code == 400
+    assert "bytes" in response.text
+
+
+def test_sql_cost_guard_limit(client: TestClient, monkeypatch):
+    import bmsdna.lakeapi.endpoint.sql_cost as sql_cost
+
+    monkeypatch.setattr(sql_cost, "SQL_MAX_RESULT_ROWS", 2)
+    response = client.get("/api/sql?sql=SELECT * FROM test_fruits")
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+
+def test_timeout_documented(client: TestClient):
+    spec = client.get("/openapi.json").json()
+    for path in ["/api/sql", "/api/v1/test/fruits"]:
+        params = spec["paths"][path]["get"]["parameters"]
+        assert "$timeout" in [p["name"] for p in params]
+
+
+def test_sql_scanned_bytes_pruned(client: TestClient, monkeypatch):
+    import bmsdna.lakeapi.endpoint.sql_cost as sql_cost
+
+    scanned = []
+    scanned_bytes = sql_cost._scanned_bytes
+    monkeypatch.setattr(
+        sql_cost,
+        "_scanned_bytes",
+        lambda *args: scanned.append(scanned_bytes(*args)) or scanned[-1],
+    )
+    for where in ["", " WHERE cars = 'audi'", " WHERE t.cars IN ('audi', 'fiat')"]:
+        response = client.get(
+            f"/api/sql?sql=SELECT * FROM test_fruits_partition t{where}"
+        )
+        assert response.status_code == 200
+    full, audi, audi_fiat = scanned
+    assert 0 < audi < audi_fiat < full  # files of other partitions are not counted
+
+
+def test_sql_thread_budget():
+    import anyio
+    from bmsdna.lakeapi.endpoint.sql_cost import ThreadBudget
+
+    budget = ThreadBudget(4)
+
+    async def _run():
+        first = await budget.acquire()
+        second = await budget.acquire()
+        third = await budget.acquire()
+        assert (first, second, third) == (2, 1, 1)
+        with anyio.move_on_after(0.2) as scope:
+            await budget.acquire()  # all threads are in use
+        assert scope.cancelled_caught
+        budget.release(second)
+        assert await budget.acquire() == 1
+
+    anyio.run(_run)
@@ -8,3 +8,76 @@ from bmsdna.lakeapi.core.yaml import get_yaml
 def test_load_yaml():
     y = get_yaml("config_test.yml")
     assert y.get("app").get("title") == "LakeAPI"
+
+
+def test_wildcard_expansion_cache(tmp_path, monkeypatch):
+    import dataclasses
+    import bmsdna.lakeapi
+    import bmsdna.lakeapi.utils.meta_cache as meta_cache
+    from bmsdna.lakeapi.core.config import Configs
+
+    cfg = dataclasses.replace(
+        bmsdna.lakeapi.get_default_config(),
+        data_path="tests/data",
+        temp_folder_path=str(tmp_path),
+    )
+
+    def _params(configs: Configs):
+        return {
+            c.route: sorted(p.name for p in c.params or [])  # type: ignore
+            for c in configs
+            if c.tag == "startest"
+        }
+
+    expanded = _params(Configs.from_yamls(cfg, "config_test.yml"))
+    assert expanded["/api/v1/startest/fruits_partition"] == ["cars"]
+    assert any(p.name.startswith("lakeapi_expand_") for p in tmp_path.iterdir())
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("metadata should come from the cache")
+
+    monkeypatch.setattr(meta_cache, "get_deltalake_meta", _fail)
+    assert _params(Configs.from_yamls(cfg, "config_test.yml")) == expanded
+
+
+def test_write_xlsx_sheets(tmp_path):
+    import polars as pl
+    import pyarrow as pa
+    from bmsdna.lakeapi.utils.xlsx import write_xlsx
+
+    table = pa.table(
+        {
+            "id": list(range(7)),
+            "name": [f"name {i}" for i in range(7)],
+            "tags": [[str(i)] for i in range(7)],
+        }
+    )
+    out = str(tmp_path / "out.xlsx")
+    write_xlsx(
+        pa.RecordBatchReader.from_batches(table.schema, table.to_batches(3)), out, 4
+    )
+    sheets = pl.read_excel(out, sheet_id=0)
+    assert [len(s) for s in sheets.values()] == [3, 3, 1]  # plus a header each
+    df = pl.concat(sheets.values())
+    assert df["id"].to_list() == list(range(7))
+    assert df["tags"].to_list()[0] == '["0"]'
+
+
+def test_write_html_xml(tmp_path):
+    import xml.etree.ElementTree as ET
+    import pyarrow as pa
+    from bmsdna.lakeapi.utils.markup import write_html, write_xml
+
+    table = pa.table({"id": [1, None, 3], "a b": ["<x> & y", None, "z"]})
+    out = str(tmp_path / "out.xml")
+    write_xml(pa.RecordBatchReader.from_batches(table.schema, table.to_batches(2)), out)
+    rows = ET.parse(out).getroot().findall("row")
+    assert [r.findtext("id") for r in rows] == ["1", "", "3"]
+    assert [r.findtext("a_b") for r in rows] == ["<x> & y", "", "z"]
+
+    out = str(tmp_path / "out.html")
+    write_html(
+        pa.RecordBatchReader.from_batches(table.schema, table.to_batches(2)), out
+    )
+    cells = [td.text or "" for td in ET.parse(out).getroot().iter("td")]
+    assert cells == ["1", "<x> & y", "", "", "3", "z"]
@@ -8,7 +8,7 @@ import os
 import logging
 
 
-def get_app(default_engine="duckdb"):
+def get_app(default_engine="duckdb", route_resolution="eager"):
     import bmsdna.lakeapi
 
     os.environ["MY_SQL_PWD"] = "MyPass@word4tests"
@@ -19,6 +19,7 @@ def get_app(default_engine="duckdb"):
         enable_sql_endpoint=True,
         data_path="tests/data",
         default_engine=default_engine,
+        route_resolution=route_resolution,
     )
 
     bmsdna.lakeapi.init_lakeapi(app, True, cfg, "config_test.yml")